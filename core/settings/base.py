@@ -141,12 +141,95 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
+REDIS_URL = 'redis://redis:6379'
+
 # CELERY STUFF
-BROKER_URL = 'redis://redis:6379'
-CELERY_RESULT_BACKEND = 'redis://redis:6379'
+BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+
+# SCRAPER
+SCRAPER_REQUEST_TIMEOUT = 30
+SCRAPER_MAX_RETRIES = 3
+SCRAPER_RETRY_BACKOFF = 1
+# Hosts kept open by the session of a store: its website, with or without www or https,
+# and the host of its search_url
+SCRAPER_SESSION_HOST_POOLS = 4
+# One of scraper.parsers.PARSERS, can be overridden per store
+SCRAPER_HTML_PARSER = 'html.parser'
+# Build only the parts of product pages matched by the store selectors
+SCRAPER_PARTIAL_PARSING = True
+# Read the schema.org product data of the pages before using the selectors of the store
+SCRAPER_STRUCTURED_DATA = True
+# Pages go through a browser only when plain HTTP is not enough, see scraper.escalation
+SCRAPER_JS_PROBE_RATE = 0.1
+SCRAPER_JS_ESCALATION_WINDOW = 50
+SCRAPER_JS_PROMOTE_RATE = 0.8
+SCRAPER_JS_DEMOTE_RATE = 0.1
+# Discovery stops paging when a result page has less than this share of unknown products
+SCRAPER_INCREMENTAL_DISCOVERY = True
+SCRAPER_DISCOVERY_MIN_NOVELTY = 0.2
+SCRAPER_DISCOVERY_MAX_PAGES = 10
+# Seconds the product pages imported by a run of searches are remembered, see scraper.runs
+SCRAPER_IMPORT_RUN_TTL = 12 * 60 * 60
+# Sitemap urls are compared with the known products by chunks of this size
+SCRAPER_SITEMAP_CHUNK_SIZE = 1000
+# Safety cap on the catalog pages read from Shopify and WooCommerce stores
+SCRAPER_PLATFORM_MAX_PAGES = 100
+# Scraped products are written by batches, see search.writer.ProductWriter
+SCRAPER_WRITER_BATCH_SIZE = 500
+SCRAPER_WRITER_MAX_DELAY = 30
+
+# Products are refreshed between these intervals in seconds, see scraper.schedule.refresh_interval
+SCRAPER_REFRESH_MIN_INTERVAL = 6 * 60 * 60
+SCRAPER_REFRESH_MAX_INTERVAL = 7 * 24 * 60 * 60
+SCRAPER_REFRESH_VOLATILITY_WEIGHT = 10
+# Weight of the last scrape in the volatility of a product
+SCRAPER_VOLATILITY_SMOOTHING = 0.2
+SCRAPER_REFRESH_CLICKS_DAYS = 30
+# Due products sent to refresh at each run of the queue, and how long before they can be sent again
+SCRAPER_REFRESH_QUEUE_SIZE = 1000
+SCRAPER_REFRESH_LEASE = 60 * 60
+
+# Store slots, see scraper.slots.StoreSlot: lease in seconds, and base delay before a task retries
+SCRAPER_STORE_SLOT_TTL = 10 * 60
+SCRAPER_STORE_SLOT_RETRY = 60
+
+# Re-imports commit their progress every chunk of products, see search.models.ReImportRun,
+# and products re-imported on demand are sent by batches of this size.
+# A run without progress for this many seconds is continued by the next re-import of the store
+SCRAPER_REIMPORT_CHUNK_SIZE = 100
+SCRAPER_REIMPORT_RUN_STALE = 30 * 60
+BROWSER_POOL_SIZE = 2
+BROWSER_MAX_PAGES = 100
+BROWSER_MAX_TABS = 4
+BROWSER_READY_TIMEOUT = 15
+# Not needed to read names, prices and availability, see scraper.browser.RESOURCE_EXTENSIONS
+BROWSER_BLOCKED_RESOURCES = ['image', 'font', 'media']
+BROWSER_BLOCKED_DOMAINS = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googleadservices.com',
+    'doubleclick.net',
+    'facebook.net',
+    'facebook.com',
+    'hotjar.com',
+    'clarity.ms',
+    'tiktok.com',
+    'pinterest.com',
+    'bing.com',
+    'trustpilot.com',
+    'klaviyo.com',
+    'intercom.io',
+    'tawk.to',
+    'zopim.com',
+    'youtube.com',
+    'vimeo.com',
+]
+CRAWLER_CONCURRENCY = 32
+CRAWLER_PER_HOST_CONCURRENCY = 2
 gettext = lambda s: s
 LANGUAGES = (
     ('it', gettext('Italiano')),
@@ -0,0 +1,16 @@
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """The Redis client shared by the process, connected lazily"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL, socket_timeout=5, socket_connect_timeout=5
+        )
+    return _client
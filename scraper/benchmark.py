@@ -0,0 +1,59 @@
+"""
+Compare the parse time of every HTML parser backend on recorded store pages.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=core.settings.dev python -m scraper.benchmark pages/*.html [--repeat 20]
+
+Record the pages with e.g. `curl -o pages/store_product.html <url>`.
+"""
+import argparse
+import os
+import timeit
+from typing import Dict, List
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.dev")
+django.setup()
+
+from scraper.parsers import PARSERS, parse_html  # noqa: E402
+
+
+def benchmark(paths: List[str], repeat: int) -> Dict[str, Dict[str, float]]:
+    """The best parse time, in milliseconds, of every page with every backend"""
+    results = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            html = f.read()
+
+        results[path] = {}
+        for backend, _ in PARSERS:
+            try:
+                times = timeit.repeat(lambda: parse_html(html, backend), number=1, repeat=repeat)
+            except Exception as e:
+                print(f"{backend} failed on {path}: {e}")
+                continue
+            results[path][backend] = min(times) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="HTML files of recorded store pages")
+    parser.add_argument("--repeat", type=int, default=20, help="parses per page and backend")
+    args = parser.parse_args()
+
+    results = benchmark(args.paths, args.repeat)
+    backends = [backend for backend, _ in PARSERS]
+
+    print(f"{'page':<50}" + "".join(f"{backend:>14}" for backend in backends))
+    for path, times in results.items():
+        row = "".join(f"{times[b]:>12.2f}ms" if b in times else f"{'-':>14}" for b in backends)
+        print(f"{os.path.basename(path)[:50]:<50}{row}")
+
+    totals = {b: sum(times.get(b, 0) for times in results.values()) for b in backends}
+    print(f"{'total':<50}" + "".join(f"{totals[b]:>12.2f}ms" for b in backends))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,251 @@
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+
+logger = get_task_logger(__name__)
 
 chrome_options = Options()
 chrome_options.add_argument("--disable-extensions")
 chrome_options.add_argument("--disable-gpu")
 chrome_options.add_argument("--no-sandbox")  # linux only
 chrome_options.add_argument("--headless")
+# Return from driver.get once the DOM is ready, the rest is bounded by wait_until_ready
+chrome_options.page_load_strategy = "eager"
+# Network events are read back to measure the downloaded and blocked requests
+chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+RESOURCE_EXTENSIONS = {
+    "image": ["png", "jpg", "jpeg", "gif", "webp", "avif", "svg", "ico"],
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "media": ["mp4", "webm", "ogg", "mp3", "wav", "m3u8"],
+    "stylesheet": ["css"],
+}
+
+
+def blocked_url_patterns(allowed_domains: Iterable[str] = ()) -> List[str]:
+    """
+    The url patterns the browser must not download: the resource types in
+    settings.BROWSER_BLOCKED_RESOURCES and the domains in settings.BROWSER_BLOCKED_DOMAINS,
+    except the allowed ones.
+    """
+    patterns = []
+    for resource in settings.BROWSER_BLOCKED_RESOURCES:
+        for extension in RESOURCE_EXTENSIONS[resource]:
+            patterns += [f"*.{extension}", f"*.{extension}?*"]
+
+    allowed_domains = [domain.strip() for domain in allowed_domains if domain.strip()]
+    for domain in settings.BROWSER_BLOCKED_DOMAINS:
+        if any(domain == allowed or domain.endswith(f".{allowed}") for allowed in allowed_domains):
+            continue
+        patterns.append(f"*://*{domain}/*")
+    return patterns
+
+
+def read_network_log(driver) -> Dict[str, int]:
+    """Sum up the network events logged since the last call"""
+    downloaded, requests, blocked = 0, 0, 0
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message["method"] == "Network.loadingFinished":
+            requests += 1
+            downloaded += int(message["params"].get("encodedDataLength", 0))
+        elif message["method"] == "Network.loadingFailed" and message["params"].get("blockedReason"):
+            blocked += 1
+    return {"bytes": downloaded, "requests": requests, "blocked": blocked}
+
+
+class PooledDriver:
+    """A Chrome driver kept warm between pages, with one tab per store"""
+
+    def __init__(self):
+        self.driver = webdriver.Chrome(options=chrome_options)
+        self.driver.set_page_load_timeout(settings.BROWSER_READY_TIMEOUT)
+        self.pages = 0
+        # store id -> window handle, the least recently used first
+        self.tabs: OrderedDict = OrderedDict()
+        self.tabs[None] = self.driver.current_window_handle
+
+    def switch_to_tab(self, store_id: Optional[int], blocked_urls: List[str]):
+        if store_id not in self.tabs:
+            # The new tab is opened from a live window, before the least recently used one is closed
+            self.driver.switch_to.new_window("tab")
+            self.tabs[store_id] = self.driver.current_window_handle
+            if len(self.tabs) > settings.BROWSER_MAX_TABS:
+                _, handle = self.tabs.popitem(last=False)
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+
+        self.tabs.move_to_end(store_id)
+        self.driver.switch_to.window(self.tabs[store_id])
+        self.driver.execute_cdp_cmd("Network.enable", {})
+        self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+
+    @property
+    def is_worn_out(self) -> bool:
+        return self.pages >= settings.BROWSER_MAX_PAGES
+
+    def quit(self):
+        # A crashed chromedriver may fail with any error, the browser is gone anyway
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"Could not quit the browser: {e}")
+
+
+class BrowserPool:
+    """
+    Keep up to `size` headless browsers open in the worker.
+
+    A browser is lent to one caller at a time. Browsers with a tab already open on
+    the requested store are preferred, and a browser is replaced after max pages
+    or as soon as it crashes.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[PooledDriver] = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def driver(self, store_id: Optional[int] = None) -> Iterator[PooledDriver]:
+        pooled = self._acquire(store_id)
+        try:
+            yield pooled
+        except BaseException as e:
+            # The state of the browser is unknown, it is never lent again
+            logger.warning(f"The browser failed, recycling it: {e!r}")
+            self._discard(pooled)
+            raise
+        else:
+            pooled.pages += 1
+            if pooled.is_worn_out:
+                logger.info(f"The browser served {pooled.pages} pages, recycling it")
+                self._discard(pooled)
+            else:
+                self._release(pooled)
+
+    def _acquire(self, store_id: Optional[int]) -> PooledDriver:
+        with self._condition:
+            while True:
+                if self._idle:
+                    for pooled in self._idle:
+                        if store_id in pooled.tabs:
+                            self._idle.remove(pooled)
+                            return pooled
+                    return self._idle.pop()
+
+                if self._created < self.size:
+                    self._created += 1
+                    break
+
+                self._condition.wait()
+
+        try:
+            return PooledDriver()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, pooled: PooledDriver):
+        with self._condition:
+            self._idle.append(pooled)
+            self._condition.notify()
+
+    def _discard(self, pooled: PooledDriver):
+        try:
+            pooled.quit()
+        finally:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for pooled in idle:
+            pooled.quit()
+
+
+pool = BrowserPool(settings.BROWSER_POOL_SIZE)
+atexit.register(pool.close)
+
+render_stats = {"pages": 0, "seconds": 0.0, "bytes": 0, "requests": 0, "blocked": 0}
+_stats_lock = threading.Lock()
+
+
+def browser_stats() -> Dict:
+    """Totals of the pages rendered by the worker"""
+    with _stats_lock:
+        return dict(render_stats)
+
+
+def wait_until_ready(driver, wait_for: Optional[str] = None):
+    """
+    Wait for the page to finish loading and, if given, for the CSS selector to match.
+    The wait is bounded by settings.BROWSER_READY_TIMEOUT, after which the page is used as it is.
+    """
+    wait = WebDriverWait(driver, settings.BROWSER_READY_TIMEOUT, poll_frequency=0.2)
+    try:
+        wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
+        if wait_for:
+            wait.until(expected_conditions.presence_of_element_located((By.CSS_SELECTOR, wait_for)))
+    except TimeoutException:
+        logger.info(f"The page was not ready after {settings.BROWSER_READY_TIMEOUT}s, using it anyway")
+
+
+def get_html(
+    url: str,
+    store_id: Optional[int] = None,
+    wait_for: Optional[str] = None,
+    allowed_domains: Iterable[str] = (),
+) -> str:
+    """
+    Render a page in a pooled browser, without downloading the blocked resources
+
+    :param url: the page to render
+    :param store_id: (optional) the store of the page, its tab is reused
+    :param wait_for: (optional) a CSS selector the page must contain to be ready
+    :param allowed_domains: (optional) blocked domains the store needs anyway
+    """
+    with pool.driver(store_id) as pooled:
+        pooled.switch_to_tab(store_id, blocked_url_patterns(allowed_domains))
+        read_network_log(pooled.driver)
+
+        start = time.monotonic()
+        try:
+            pooled.driver.get(url)
+        except TimeoutException:
+            logger.info(f"{url} did not load in {settings.BROWSER_READY_TIMEOUT}s, reading it anyway")
+        wait_until_ready(pooled.driver, wait_for)
+        html = pooled.driver.page_source
+        seconds = time.monotonic() - start
 
+        network = read_network_log(pooled.driver)
 
-def get_html(url: str) -> str:
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(url)
-    html = driver.page_source
-    driver.close()
+    logger.info(
+        f"Rendered {url} in {seconds:.2f}s: downloaded {network['bytes'] / 1024:.0f} KB "
+        f"in {network['requests']} requests, blocked {network['blocked']} requests"
+    )
+    with _stats_lock:
+        render_stats["pages"] += 1
+        render_stats["seconds"] += seconds
+        for key, value in network.items():
+            render_stats[key] += value
     return html
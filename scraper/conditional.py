@@ -0,0 +1,57 @@
+import hashlib
+from typing import Dict, Optional, Union
+
+from requests import Response
+
+
+class NotModified(Exception):
+    """The page did not change since its validators were stored"""
+
+
+def content_hash(content: Union[str, bytes]) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content, digest_size=20).hexdigest()
+
+
+class Validators:
+    """The cache validators of a page, as stored on search.models.Product"""
+
+    def __init__(
+        self,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_product(cls, product) -> "Validators":
+        return cls(product.etag, product.last_modified, product.content_hash)
+
+    @classmethod
+    def from_response(
+        cls, content: Union[str, bytes], response: Optional[Response] = None
+    ) -> "Validators":
+        headers = response.headers if response is not None else {}
+        return cls(
+            headers.get("ETag"), headers.get("Last-Modified"), content_hash(content)
+        )
+
+    def headers(self) -> Dict[str, str]:
+        """The headers turning a GET into a conditional GET"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def as_dict(self) -> Dict[str, Optional[str]]:
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_hash": self.content_hash,
+        }
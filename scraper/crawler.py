@@ -0,0 +1,215 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from scraper import escalation, throttle
+from scraper.discovery import Discovery
+from scraper.plan import get_plan
+from scraper.slots import StoreSlot
+from scraper.simple import (
+    ProductPage,
+    extract_product,
+    extract_search_results,
+    get_product_page,
+    get_search_soup,
+    next_search_page,
+    numbered_search_pages,
+    search_url,
+)
+from search.helpers import PRODUCT_FIELDS
+from search.models import ImportQuery, Store
+from search.writer import ProductWriter
+
+logger = get_task_logger(__name__)
+
+# What a get_soup function of Crawler.fetch parses a page into
+Page = TypeVar("Page")
+
+
+class Crawler:
+    """
+    Crawl the search pages and the product pages of many stores concurrently.
+
+    Pages are downloaded and parsed in a thread pool, so the pooled sessions of
+    scraper.session and the browser escalation of scraper.simple are reused, while
+    the number of requests in flight is capped per host and in total.
+    Waiting for the rate limiter of a store does not hold a thread.
+    Products are saved by batches with the same ProductWriter used by the synchronous import.
+
+    Each store is crawled while holding one of its scraper.slots.StoreSlot, shared with the
+    Celery import tasks, a store whose slots are all taken is skipped until the next crawl.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        per_host_concurrency: Optional[int] = None,
+    ):
+        self.concurrency = concurrency or settings.CRAWLER_CONCURRENCY
+        self.per_host_concurrency = (
+            per_host_concurrency or settings.CRAWLER_PER_HOST_CONCURRENCY
+        )
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._total: Optional[asyncio.Semaphore] = None
+        self.stats = {"pages": 0, "failed": 0, "skipped": 0, "created": 0, "changed": 0, "unchanged": 0}
+
+    def run(self, queries: Iterable[ImportQuery], stores: Iterable[Store]) -> Dict:
+        """Search every query on every store and import the products found"""
+        return asyncio.run(self.crawl(list(queries), list(stores)))
+
+    async def crawl(self, queries: List[ImportQuery], stores: List[Store]) -> Dict:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+        self._total = asyncio.Semaphore(self.concurrency)
+
+        await asyncio.gather(
+            *(self.crawl_store(store, queries) for store in stores)
+        )
+        return self.stats
+
+    async def crawl_store(self, store: Store, queries: List[ImportQuery]):
+        slot = StoreSlot(store)
+        if not await asyncio.to_thread(slot.acquire):
+            logger.info(f"Every slot of {store.name} is taken, it is not crawled")
+            self.stats["skipped"] += 1
+            return
+
+        with slot:
+            await self.crawl_queries(store, queries)
+
+    async def crawl_queries(self, store: Store, queries: List[ImportQuery]):
+        # Queries come by priority, a page found by many of them is imported for the first one
+        queries = sorted(queries, key=lambda query: query.priority_score, reverse=True)
+        imported = set()
+        writer = ProductWriter(store)
+        for query in queries:
+            try:
+                discovery = (
+                    await sync_to_async(Discovery)(store, query)
+                    if settings.SCRAPER_INCREMENTAL_DISCOVERY else None
+                )
+                urls = await self.search(query.text, store, discovery)
+                if discovery:
+                    await sync_to_async(discovery.finish)()
+
+                urls = [url for url in dict.fromkeys(urls) if url not in imported]
+                imported.update(urls)
+                await asyncio.gather(
+                    *(self.import_product(url, store, query, writer) for url in urls)
+                )
+            except Exception as e:
+                logger.warning(f"Crawl of {query.text} on {store.name} failed: {e}")
+
+        await sync_to_async(writer.flush)()
+        self.stats["created"] += writer.created
+        self.stats["changed"] += writer.changed
+        self.stats["unchanged"] += writer.unchanged
+        await sync_to_async(escalation.flush)(store)
+
+    async def search(
+        self, query: str, store: Store, discovery: Optional[Discovery] = None
+    ) -> List[str]:
+        """The asynchronous counterpart of scraper.simple.search, without limit"""
+        if get_plan(store).search_prefetch:
+            return await self.search_concurrently(query, store, discovery)
+
+        next_url = search_url(query, store)
+        scraped_urls = []
+
+        while next_url:
+            logger.info(f"Searching {query} at {next_url}")
+            soup = await self.fetch(next_url, store, get_search_soup)
+            if not soup:
+                break
+
+            results = extract_search_results(soup, store)
+            scraped_urls.extend(results)
+            if discovery and not await sync_to_async(discovery.keep_paging)(results):
+                break
+
+            next_url = next_search_page(soup, next_url, store)
+
+        return scraped_urls
+
+    async def search_concurrently(
+        self, query: str, store: Store, discovery: Optional[Discovery] = None
+    ) -> List[str]:
+        """The asynchronous counterpart of scraper.simple.search_concurrently, without limit"""
+        urls = numbered_search_pages(search_url(query, store), store)
+        if discovery:
+            urls = islice(urls, discovery.max_pages)
+        pending = deque(
+            asyncio.ensure_future(self.fetch(url, store, get_search_soup))
+            for url in islice(urls, get_plan(store).search_concurrency)
+        )
+        scraped_urls = []
+
+        try:
+            while pending:
+                soup = await pending.popleft()
+                results = extract_search_results(soup, store) if soup else []
+                if not results:
+                    break
+
+                scraped_urls.extend(results)
+                if discovery and not await sync_to_async(discovery.keep_paging)(results):
+                    break
+
+                next_url = next(urls, None)
+                if next_url:
+                    pending.append(
+                        asyncio.ensure_future(self.fetch(next_url, store, get_search_soup))
+                    )
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return scraped_urls
+
+    async def import_product(self, url: str, store: Store, query: ImportQuery, writer: ProductWriter):
+        page = await self.fetch(url, store, self._get_product_page)
+        if not page:
+            return
+
+        data = extract_product(page.soup, url, store, PRODUCT_FIELDS, structured_data=page.structured_data)
+        await sync_to_async(writer.add)(data, query)
+
+    @staticmethod
+    def _get_product_page(url: str, store: Store, throttled: bool) -> Optional[ProductPage]:
+        page, _ = get_product_page(url, store, PRODUCT_FIELDS, throttled=throttled)
+        return page
+
+    async def fetch(
+        self, url: str, store: Store, get_soup: Callable[..., Optional[Page]], **kwargs
+    ) -> Optional[Page]:
+        """
+        Run get_soup in the thread pool, once the store can receive another request.
+        The rate limiter is waited for under the host limit only, a slow store does not
+        hold the slots of the total limit while it is idle.
+        """
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host_concurrency)
+
+        async with self._hosts[host]:
+            try:
+                await asyncio.sleep(await asyncio.to_thread(throttle.reserve, store))
+                async with self._total:
+                    soup = await asyncio.to_thread(
+                        get_soup, url, store, throttled=False, **kwargs
+                    )
+            except Exception as e:
+                logger.warning(f"Could not download {url}: {e}")
+                soup = None
+
+        self.stats["pages"] += 1
+        if soup is None:
+            self.stats["failed"] += 1
+        return soup
@@ -0,0 +1,69 @@
+from typing import List, Set
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from search.models import ImportQuery, Product, SearchDepth, Store
+
+logger = get_task_logger(__name__)
+
+
+class Discovery:
+    """
+    Page through the results of a query on a store only while they list unknown products.
+
+    Each result page is checked against the links of the products already imported from
+    the store. Paging stops on the first page where the share of unknown links is below
+    settings.SCRAPER_DISCOVERY_MIN_NOVELTY, or once the depth learnt for the store and
+    the query is reached. At the end of the search the depth is adjusted: it shrinks to
+    where novelty dropped, and doubles when the last page allowed was still worth reading.
+    """
+
+    def __init__(self, store: Store, query: ImportQuery):
+        self.store = store
+        self.depth, _ = SearchDepth.objects.get_or_create(
+            store=store,
+            query=query,
+            defaults={"max_pages": settings.SCRAPER_DISCOVERY_MAX_PAGES},
+        )
+        self.pages = 0
+        self.novelty = None
+        self.seen: Set[str] = set()
+
+    @property
+    def max_pages(self) -> int:
+        return self.depth.max_pages
+
+    @property
+    def low_novelty(self) -> bool:
+        return self.novelty is not None and self.novelty < settings.SCRAPER_DISCOVERY_MIN_NOVELTY
+
+    def keep_paging(self, urls: List[str]) -> bool:
+        """Record a result page, and tell if the next one is worth reading"""
+        self.pages += 1
+        page_urls = set(urls) - self.seen
+        known = set(
+            Product.objects.filter(store=self.store, link__in=page_urls).values_list("link", flat=True)
+        )
+        self.novelty = len(page_urls - known) / len(urls) if urls else 0
+        self.seen.update(page_urls)
+
+        if self.low_novelty:
+            logger.info(f"Only {self.novelty:.0%} of the products on page {self.pages} are new, stop paging")
+            return False
+        return self.pages < self.max_pages
+
+    def finish(self):
+        """Adjust the depth of the next searches to what this one found"""
+        if self.low_novelty:
+            max_pages = self.pages
+        elif self.pages >= self.max_pages:
+            max_pages = min(self.max_pages * 2, settings.SCRAPER_DISCOVERY_MAX_PAGES)
+        else:
+            # The results ended before the limit, one page of margin notices them growing
+            max_pages = min(self.pages + 1, settings.SCRAPER_DISCOVERY_MAX_PAGES)
+
+        self.depth.max_pages = max(max_pages, 1)
+        self.depth.last_pages = self.pages
+        self.depth.last_novelty = self.novelty
+        self.depth.save(update_fields=["max_pages", "last_pages", "last_novelty", "created_at"])
@@ -0,0 +1,48 @@
+import random
+import threading
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+
+from search.models import Store
+
+
+class EscalationCounter:
+    """Count, per store, the pages tried over plain HTTP and the ones that needed a browser"""
+
+    def __init__(self):
+        self._counts: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, store_id: int, escalated: bool):
+        with self._lock:
+            counts = self._counts.setdefault(store_id, [0, 0])
+            counts[0] += 1
+            counts[1] += int(escalated)
+
+    def pop(self, store_id: int) -> Tuple[int, int]:
+        with self._lock:
+            attempts, escalated = self._counts.pop(store_id, (0, 0))
+        return attempts, escalated
+
+
+counter = EscalationCounter()
+
+
+def should_try_http(store: Store) -> bool:
+    """
+    Stores rendering with JS still get a share of their pages tried over plain HTTP,
+    so they can be moved back to it when they do not need the browser anymore.
+    """
+    return not store.scrape_with_js or random.random() < settings.SCRAPER_JS_PROBE_RATE
+
+
+def record(store: Store, escalated: bool):
+    counter.record(store.id, escalated)
+
+
+def flush(store: Store):
+    """Save the counts of the store, which may switch it to or from the browser"""
+    attempts, escalated = counter.pop(store.id)
+    if attempts:
+        store.record_js_escalations(attempts, escalated)
@@ -0,0 +1,134 @@
+import csv
+import gzip
+import io
+import re
+import unicodedata
+from typing import Dict, Iterator, Optional
+from xml.etree.ElementTree import ParseError, iterparse
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from requests import RequestException
+
+from scraper import throttle
+from scraper.prices import parse_price
+from scraper.session import get_session
+from scraper.sitemap import local_name
+from search.models import Store
+
+logger = get_task_logger(__name__)
+
+# A price as written in a Google Merchant feed, e.g. "12.99 EUR"
+CURRENCY_CODE = re.compile(r"\b([A-Z]{3})\b")
+UNAVAILABLE = ("out of stock", "out_of_stock", "discontinued")
+CSV_EXTENSIONS = (".csv", ".tsv", ".txt")
+GOOGLE_NAMESPACE = "{http://base.google.com/ns/1.0}"
+
+
+def feed_price(text: Optional[str], store: Store):
+    """The price and the currency of a feed price, the currency of the store by default"""
+    price = parse_price(text, "en_US")
+    currency = CURRENCY_CODE.search(text or "")
+    return price, currency.group(1) if currency else store.currency
+
+
+def feed_product(item: Dict[str, str], store: Store) -> Optional[Dict]:
+    """
+    Map a feed item, with the Google Merchant attribute names, onto the fields of
+    scraper.simple.scrape_product. Items without title or price are skipped.
+    """
+    name = (item.get("title") or "").strip()
+    price, currency = feed_price(item.get("price"), store)
+    sale_price, sale_currency = feed_price(item.get("sale_price"), store)
+    if sale_price is not None and (price is None or sale_price < price):
+        price, currency = sale_price, sale_currency
+
+    if not name or price is None:
+        return None
+
+    availability = (item.get("availability") or "").strip().lower()
+    return {
+        "name": unicodedata.normalize("NFKD", name),
+        "price": price,
+        "currency": currency,
+        "is_available": availability not in UNAVAILABLE if availability else None,
+        "image": item.get("image_link") or None,
+        "description": (item.get("description") or "").strip(),
+        "link": (item.get("link") or "").strip(),
+    }
+
+
+def iter_xml_items(stream) -> Iterator[Dict[str, str]]:
+    """The <item> or <entry> elements of an RSS or Atom feed, without namespaces, one at a time"""
+    parents, item, item_element = [], None, None
+    for event, element in iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if item_element is None and local_name(element.tag) in ("item", "entry"):
+                item, item_element = {}, element
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element is item_element:
+            yield item
+            item, item_element = None, None
+            # Drop the items already read, their parent would keep them otherwise
+            parents[-1].clear()
+        elif item_element is not None and parents[-1] is item_element:
+            name = local_name(element.tag)
+            if name == "link" and element.get("href"):
+                item.setdefault("link", element.get("href"))
+            elif element.text and element.text.strip():
+                # The attributes of the Google namespace win over the RSS and Atom ones
+                if element.tag.startswith(GOOGLE_NAMESPACE) or name not in item:
+                    item[name] = element.text.strip()
+
+
+def iter_csv_items(stream) -> Iterator[Dict[str, str]]:
+    """The rows of a CSV or tab separated feed, with the header as keys"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    header = text.readline()
+    delimiter = "\t" if "\t" in header else ","
+    fields = [
+        field.strip().lower().replace("g:", "") for field in next(csv.reader([header], delimiter=delimiter))
+    ]
+    for row in csv.reader(text, delimiter=delimiter):
+        yield dict(zip(fields, row))
+
+
+def iter_feed(store: Store) -> Iterator[Dict]:
+    """
+    The products of the feed of a store, read while it downloads
+
+    XML feeds are read with iterparse, dropping each item once read,
+    and CSV feeds line by line, so the memory used does not depend on the size of the feed.
+    """
+    url = store.feed_url
+    throttle.wait(store)
+    response = get_session(store).get(url, stream=True, timeout=settings.SCRAPER_REQUEST_TIMEOUT)
+    try:
+        if response.status_code != 200:
+            logger.warning(f"Could not get the feed {url}: Status: {response.status_code}")
+            return
+
+        response.raw.decode_content = True
+        # Let the text wrapper of CSV feeds see the end of the stream instead of a closed file
+        response.raw.auto_close = False
+        stream = response.raw
+        path = url.split("?")[0].lower()
+        if path.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=stream)
+            path = path[:-len(".gz")]
+
+        content_type = response.headers.get("Content-Type", "")
+        is_csv = path.endswith(CSV_EXTENSIONS) or "csv" in content_type or "tab-separated" in content_type
+        items = iter_csv_items(stream) if is_csv else iter_xml_items(stream)
+
+        for item in items:
+            data = feed_product(item, store)
+            if data and data["link"]:
+                yield data
+    except (ParseError, csv.Error, OSError, RequestException) as e:
+        logger.warning(f"Could not read the feed {url}: {e}")
+    finally:
+        response.close()
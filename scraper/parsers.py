@@ -0,0 +1,152 @@
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from django.conf import settings
+
+PARSER_HTML = "html.parser"
+PARSER_LXML = "lxml"
+PARSER_SELECTOLAX = "selectolax"
+
+PARSERS = (
+    (PARSER_HTML, "Python (html.parser)"),
+    (PARSER_LXML, "lxml"),
+    (PARSER_SELECTOLAX, "Lexbor (selectolax)"),
+)
+
+
+def css_selector(
+    name: Optional[str] = None, attrs: Optional[Dict[str, str]] = None, class_: Optional[str] = None
+) -> str:
+    """Translate the arguments of BeautifulSoup.find into a CSS selector with the same meaning"""
+    attrs = dict(attrs or {})
+    if class_:
+        attrs["class"] = class_
+
+    selector = name or "*"
+    for attr, value in attrs.items():
+        if not value:
+            continue
+        value = value.replace('"', '\\"')
+        if attr == "class" and " " not in value:
+            # BeautifulSoup matches a single class among the ones of the tag
+            selector += f'[class~="{value}"]'
+        else:
+            selector += f'[{attr}="{value}"]'
+    return selector
+
+
+def attribute_matches(attr: str, value: Union[str, List[str], None], expected: str) -> bool:
+    """Match an attribute value the way BeautifulSoup.find does"""
+    if value is None:
+        return False
+
+    if attr == "class":
+        classes = value if isinstance(value, list) else value.split()
+        return expected in classes or " ".join(classes) == expected
+
+    return value == expected
+
+
+def selectors_strainer(selectors: Iterable[Tuple[str, str, str]]) -> SoupStrainer:
+    """
+    Build a parse filter from (tag, attribute, value) selectors:
+    only the tags they match, and their descendants, end up in the tree.
+    The tag "*" matches any tag.
+    """
+    by_tag = {}
+    for tag, attr, value in selectors:
+        by_tag.setdefault(tag, []).append((attr, value))
+
+    def match(name, attrs) -> bool:
+        if not isinstance(attrs, dict):
+            # Called with a Tag once the tree is built
+            name, attrs = name.name, name.attrs
+
+        return any(
+            attribute_matches(attr, attrs.get(attr), value)
+            for attr, value in chain(by_tag.get(name, ()), by_tag.get("*", ()))
+        )
+
+    return SoupStrainer(match)
+
+
+class SelectolaxNode:
+    """
+    Expose a selectolax node through the subset of the BeautifulSoup API used by
+    the scraper, so scrape_product and search work unchanged on this backend.
+    """
+
+    def __init__(self, node):
+        self._node = node
+
+    @property
+    def name(self) -> str:
+        return self._node.tag
+
+    def get_text(self) -> str:
+        return self._node.text(deep=True)
+
+    @property
+    def string(self) -> str:
+        return self._node.text(deep=True)
+
+    def has_attr(self, key: str) -> bool:
+        return key in self._node.attributes
+
+    def __getitem__(self, key: str) -> str:
+        value = self._node.attributes[key]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def find(
+        self, name: Optional[str] = None, attrs: Optional[Dict[str, str]] = None, class_: Optional[str] = None
+    ) -> Optional["SelectolaxNode"]:
+        node = self._node.css_first(css_selector(name, attrs, class_))
+        return SelectolaxNode(node) if node else None
+
+    def find_all(
+        self, name: Optional[str] = None, attrs: Optional[Dict[str, str]] = None, limit: Optional[int] = None
+    ) -> List["SelectolaxNode"]:
+        nodes = self._node.css(css_selector(name, attrs))
+        return [SelectolaxNode(node) for node in nodes[:limit] if node]
+
+    def find_next(self, name: str) -> Optional["SelectolaxNode"]:
+        """The first tag with the given name after this one, in document order"""
+        for node in self._following():
+            if node.tag == name:
+                return SelectolaxNode(node)
+        return None
+
+    def _following(self) -> Iterator:
+        yield from islice(self._node.traverse(), 1, None)
+
+        current = self._node
+        while current is not None:
+            sibling = current.next
+            while sibling is not None:
+                yield from sibling.traverse()
+                sibling = sibling.next
+            current = current.parent
+
+
+def parse_html(
+    html: Union[str, bytes], backend: Optional[str] = None, parse_only: Optional[SoupStrainer] = None
+) -> BeautifulSoup:
+    """
+    Parse a page with the given backend, by default settings.SCRAPER_HTML_PARSER
+
+    Every backend returns an object with the BeautifulSoup methods used by the scraper.
+    parse_only is ignored by selectolax, which always builds the whole tree.
+    """
+    backend = backend or settings.SCRAPER_HTML_PARSER
+
+    if backend == PARSER_SELECTOLAX:
+        from selectolax.lexbor import LexborHTMLParser
+
+        if isinstance(html, bytes):
+            html = UnicodeDammit(html, is_html=True).unicode_markup
+        return SelectolaxNode(LexborHTMLParser(html).root)
+
+    return BeautifulSoup(html, backend, parse_only=parse_only)
@@ -0,0 +1,111 @@
+import re
+import threading
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from bs4 import SoupStrainer
+from django.conf import settings
+
+from scraper import parsers
+from scraper.structured import JSON_LD_SELECTOR, MICRODATA_SELECTORS, STRUCTURED_FIELDS
+from search.models import Store
+
+# A product page without these fields is not usable
+REQUIRED_FIELDS = ("name", "price")
+PRODUCT_SELECTOR_FIELDS = ["name", "price", "image", "thumb", "is_available", "variations", "description"]
+
+# (field, html tag, attribute, value)
+Selector = Tuple[str, str, str, str]
+
+
+class ExtractionPlan:
+    """
+    The scraping configuration of a store, resolved once: selectors are read from the
+    model and regexes compiled when the plan is built, then reused for every page.
+    """
+
+    def __init__(self, store: Store):
+        self.store_id = store.id
+        self.version = store.config_version
+
+        self.selectors_by_field: Dict[str, Selector] = {}
+        for field in PRODUCT_SELECTOR_FIELDS:
+            style_class = getattr(store, "product_{}_class".format(field))
+            html_tag = getattr(store, "product_{}_tag".format(field))
+            selector = "class" if getattr(store, "product_{}_css_is_class".format(field)) else "id"
+
+            if style_class and html_tag:
+                self.selectors_by_field[field] = (field, html_tag, selector, style_class)
+
+        self.is_available_pattern: Pattern = re.compile((store.product_is_available_match or "").lower())
+
+        self.search_tag = store.search_tag
+        self.search_class = store.search_class
+        self.search_link = store.search_link
+        self.search_next_page = store.search_next_page
+        self.search_page_param = store.search_page_param
+        # Numbered result pages can be fetched in parallel, as many as the store accepts at once
+        self.search_prefetch = bool(store.search_page_param and store.search_prefetch_pages)
+        self.search_concurrency = max(1, min(store.connection_pool_size, store.requests_burst))
+
+        # What a rendered page must contain to be ready
+        self.search_ready_css = parsers.css_selector(self.search_tag, {"class": self.search_class})
+        name_selector = self.selectors_by_field.get("name")
+        self.product_ready_css = (
+            parsers.css_selector(name_selector[1], {name_selector[2]: name_selector[3]})
+            if name_selector else None
+        )
+
+        self.browser_allowed_domains = (store.browser_allowed_domains or "").split()
+
+        self._strainers: Dict[Tuple[str, ...], SoupStrainer] = {}
+
+    def selectors(self, fields: List[str]) -> List[Selector]:
+        """The selectors configured for the given fields, in the same order"""
+        return [self.selectors_by_field[field] for field in fields if field in self.selectors_by_field]
+
+    def strainer(self, fields: List[str]) -> Optional[SoupStrainer]:
+        """
+        A parse filter keeping only the elements matched by the selectors of the given fields,
+        and the schema.org data of the product when it can provide some of them
+        """
+        key = tuple(fields)
+        if key not in self._strainers:
+            selectors = [
+                (html_tag, selector, style_class) for _, html_tag, selector, style_class in self.selectors(fields)
+            ]
+            if selectors and settings.SCRAPER_STRUCTURED_DATA and set(fields) & set(STRUCTURED_FIELDS):
+                selectors += [JSON_LD_SELECTOR] + MICRODATA_SELECTORS
+            self._strainers[key] = parsers.selectors_strainer(selectors) if selectors else None
+        return self._strainers[key]
+
+    def required_selectors_hit(self, soup, fields: List[str]) -> bool:
+        """Tell if the name and the price, when requested and configured, are in the page"""
+        for field, html_tag, selector, style_class in self.selectors(fields):
+            if field in REQUIRED_FIELDS and not soup.find(html_tag, {selector: style_class}):
+                return False
+        return True
+
+    def is_available(self, text: str) -> bool:
+        return bool(self.is_available_pattern.search(text.lower()))
+
+
+_plans: Dict[int, ExtractionPlan] = {}
+_lock = threading.Lock()
+
+
+def get_plan(store: Store) -> ExtractionPlan:
+    """The cached plan of the store, rebuilt when the store configuration changed"""
+    plan = _plans.get(store.id)
+    if plan is not None and plan.version == store.config_version:
+        return plan
+
+    plan = ExtractionPlan(store)
+    if store.id is not None:
+        with _lock:
+            _plans[store.id] = plan
+    return plan
+
+
+def invalidate_plan(store_id: int):
+    with _lock:
+        _plans.pop(store_id, None)
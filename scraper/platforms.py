@@ -0,0 +1,174 @@
+import html
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+
+from bs4 import BeautifulSoup
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from scraper import throttle
+from scraper.session import get_session
+from search.models import Store
+
+logger = get_task_logger(__name__)
+
+
+def html_to_text(markup: Optional[str]) -> str:
+    return " ".join(BeautifulSoup(markup or "", "html.parser").get_text(" ").split())
+
+
+class PlatformAdapter(ABC):
+    """
+    Import the products of a store from the JSON catalog of its e-commerce platform.
+    The catalog is read page by page, every product is returned with the same fields
+    as scraper.simple.scrape_product.
+    """
+
+    page_size = 100
+
+    def __init__(self, store: Store):
+        self.store = store
+
+    @abstractmethod
+    def catalog_url(self) -> str:
+        """The url of the catalog of the store, without the page params"""
+
+    @abstractmethod
+    def page_params(self, page: int) -> Dict:
+        """The query params of a catalog page, numbered from 1, of page_size products"""
+
+    @abstractmethod
+    def products_of(self, response_data) -> List[Dict]:
+        """The raw products of a decoded catalog page, raises ValueError if it is not a catalog"""
+
+    @abstractmethod
+    def to_product(self, item: Dict) -> Optional[Dict]:
+        """A raw product as scrape_product fields, None if it has no name or no price"""
+
+    def get_page(self, page: int) -> Optional[List[Dict]]:
+        """The raw products of a catalog page, or None if the catalog could not be read"""
+        throttle.wait(self.store)
+        url = self.catalog_url()
+        response = get_session(self.store).get(
+            url, params=self.page_params(page), timeout=settings.SCRAPER_REQUEST_TIMEOUT
+        )
+        if response.status_code != 200:
+            logger.warning(f"Could not get page {page} of {url}: Status: {response.status_code}")
+            return None
+
+        try:
+            return self.products_of(response.json())
+        except ValueError as e:
+            logger.warning(f"Page {page} of {url} is not a catalog: {e}")
+            return None
+
+    def iter_products(self, max_pages: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Every product of the catalog
+
+        :param max_pages: (optional) the pages to read at most,
+            settings.SCRAPER_PLATFORM_MAX_PAGES by default
+        """
+        for page in range(1, (max_pages or settings.SCRAPER_PLATFORM_MAX_PAGES) + 1):
+            items = self.get_page(page)
+            if not items:
+                return
+
+            for item in items:
+                data = self.to_product(item)
+                if data:
+                    yield data
+
+            if len(items) < self.page_size:
+                return
+
+    def link(self, path: str) -> str:
+        if path.startswith("http"):
+            return path
+        return f"{self.store.website.rstrip('/')}/{path.lstrip('/')}"
+
+
+class ShopifyAdapter(PlatformAdapter):
+    """The public products.json of Shopify stores"""
+
+    page_size = 250
+
+    def catalog_url(self) -> str:
+        return self.link("products.json")
+
+    def page_params(self, page: int) -> Dict:
+        return {"limit": self.page_size, "page": page}
+
+    def products_of(self, response_data) -> List[Dict]:
+        if not isinstance(response_data, dict) or not isinstance(response_data.get("products"), list):
+            raise ValueError("expected the products of the catalog")
+        return response_data["products"]
+
+    def to_product(self, item: Dict) -> Optional[Dict]:
+        variants = item.get("variants") or []
+        available = [variant for variant in variants if variant.get("available")]
+        prices = [float(variant["price"]) for variant in available or variants if variant.get("price")]
+        if not item.get("title") or not prices:
+            return None
+
+        data = {
+            "name": item["title"],
+            "price": min(prices),
+            "currency": self.store.currency,
+            "is_available": bool(available),
+            "description": html_to_text(item.get("body_html")),
+            "link": self.link(f"products/{item['handle']}"),
+        }
+        images = item.get("images") or []
+        if images:
+            data["image"] = images[0]["src"]
+        return data
+
+
+class WooCommerceAdapter(PlatformAdapter):
+    """The Store API of WooCommerce stores, with prices in minor units"""
+
+    page_size = 100
+
+    def catalog_url(self) -> str:
+        return self.link("wp-json/wc/store/v1/products")
+
+    def page_params(self, page: int) -> Dict:
+        return {"per_page": self.page_size, "page": page}
+
+    def products_of(self, response_data) -> List[Dict]:
+        if not isinstance(response_data, list):
+            raise ValueError("expected a list of products")
+        return response_data
+
+    def to_product(self, item: Dict) -> Optional[Dict]:
+        prices = item.get("prices") or {}
+        if not item.get("name") or not prices.get("price"):
+            return None
+
+        minor_unit = int(prices.get("currency_minor_unit", 2))
+        data = {
+            "name": html.unescape(item["name"]),
+            "price": int(prices["price"]) / 10 ** minor_unit,
+            "currency": prices.get("currency_code") or self.store.currency,
+            # Stock of a variable product is in stock when any of its variations is
+            "is_available": bool(item.get("is_in_stock")),
+            "description": html_to_text(item.get("short_description") or item.get("description")),
+            "link": item["permalink"],
+        }
+        images = item.get("images") or []
+        if images:
+            data["image"] = images[0]["src"]
+        return data
+
+
+ADAPTERS = {
+    Store.PLATFORM_SHOPIFY: ShopifyAdapter,
+    Store.PLATFORM_WOOCOMMERCE: WooCommerceAdapter,
+}
+
+
+def get_adapter(store: Store) -> Optional[PlatformAdapter]:
+    """The adapter of the store platform, None if the store is scraped from its pages"""
+    adapter = ADAPTERS.get(store.platform)
+    return adapter(store) if adapter else None
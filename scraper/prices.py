@@ -0,0 +1,76 @@
+import re
+from typing import Iterable, List, Optional
+
+# A number as written in a price tag: digits grouped by separators, e.g. 1.234,50 or 1 234.50
+PRICE_NUMBER = re.compile(r"\d{1,3}(?:[\s'’]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)*")
+THOUSANDS_ONLY = re.compile(r"[\s'’]")
+DECIMAL_SEPARATORS = {"en_US": ".", "it_IT": ","}
+
+
+def decimal_separator(store_locale: str) -> str:
+    return DECIMAL_SEPARATORS.get(store_locale, "." if store_locale.startswith("en") else ",")
+
+
+def normalize_number(number: str, decimal: str) -> Optional[float]:
+    """
+    Convert a number as written in a price tag to a float
+
+    :param number: digits and separators as matched by PRICE_NUMBER
+    :param decimal: the decimal separator of the store locale, used only when the
+        number alone is ambiguous, e.g. 1.234 or 1,234
+    """
+    number = THOUSANDS_ONLY.sub("", number)
+    separators = [c for c in number if c in ".,"]
+    if not separators:
+        return float(number)
+
+    last = separators[-1]
+    integer, _, fraction = number.rpartition(last)
+
+    if len(set(separators)) > 1:
+        # 1.234,50 or 1,234.50: the last separator is the decimal one
+        is_decimal = True
+    elif len(separators) > 1:
+        # 1.234.567: the separator repeats, so it groups thousands
+        is_decimal = False
+    elif len(fraction) != 3:
+        # 12,99 or 12.5: a single separator not followed by a group of three digits
+        is_decimal = True
+    else:
+        is_decimal = last == decimal
+
+    if not is_decimal:
+        return float(number.replace(last, ""))
+
+    integer = integer.replace("." if last == "," else ",", "")
+    return float(f"{integer}.{fraction}")
+
+
+def parse_price(price_string: str, store_locale: str = "it_IT") -> Optional[float]:
+    """
+    Parse the first price found in a string
+
+    Currency symbols and codes, and any surrounding text, are ignored,
+    so "from €12,99", "EUR 1.234,50" or "$10.00 - $12.00" are all understood.
+    It does not depend on the process locale, so it is safe to use from threads.
+
+    :param price_string: the text of a price tag
+    :param store_locale: one of search.models.Store.LOCALE
+
+    :returns: the price or None if there is no number in the string
+    """
+    match = PRICE_NUMBER.search(price_string or "")
+    if not match:
+        return None
+    return normalize_number(match.group(0), decimal_separator(store_locale))
+
+
+def parse_prices(price_strings: Iterable[str], store_locale: str = "it_IT") -> List[Optional[float]]:
+    """Parse many price strings of the same locale at once, see parse_price"""
+    decimal = decimal_separator(store_locale)
+    search = PRICE_NUMBER.search
+    prices = []
+    for price_string in price_strings:
+        match = search(price_string or "")
+        prices.append(normalize_number(match.group(0), decimal) if match else None)
+    return prices
@@ -0,0 +1,80 @@
+from typing import Dict, List, Optional
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from helpers.redis_client import get_redis
+from search.models import ImportQuery
+
+logger = get_task_logger(__name__)
+
+# The url is new in the run, the caller imports it
+CLAIMED = 1
+# The url was claimed by a query with a lower priority, the caller takes over the product
+TAKEN_OVER = 2
+# The url was claimed by a query with the same or a higher priority, the caller skips it
+ALREADY_CLAIMED = 0
+
+# Claim an url for a query, the hash of the run maps each url to "<priority> <query id>"
+CLAIM_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local claimed = 1
+if current then
+    local priority = tonumber(string.match(current, '^(%S+)'))
+    if priority >= tonumber(ARGV[2]) then
+        return 0
+    end
+    claimed = 2
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ' ' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return claimed
+"""
+
+_script = None
+
+
+class ImportRun:
+    """
+    The product pages already imported from a store during a run of searches.
+
+    Every search task of the run shares the set through Redis, so a product page found by
+    many queries is downloaded once and attributed to the query with the highest priority.
+    Without Redis every page is imported, as if there was no run.
+    """
+
+    def __init__(self, run_id: str, store_id: int):
+        self.key = f"import_run:{run_id}:{store_id}"
+
+    def claim(self, url: str, query: ImportQuery) -> int:
+        """Claim the url for the query, see CLAIMED, TAKEN_OVER and ALREADY_CLAIMED"""
+        global _script
+        try:
+            if _script is None:
+                _script = get_redis().register_script(CLAIM_SCRIPT)
+            return int(_script(
+                keys=[self.key],
+                args=[url, repr(query.priority_score), query.id, settings.SCRAPER_IMPORT_RUN_TTL],
+            ))
+        except RedisError as e:
+            logger.warning(f"Import run unavailable, importing {url} anyway: {e}")
+            return CLAIMED
+
+    def owner(self, url: str) -> Optional[int]:
+        """The id of the query the url is attributed to"""
+        try:
+            value = get_redis().hget(self.key, url)
+        except RedisError:
+            return None
+        return int(value.split()[1]) if value else None
+
+    def owners(self, urls: List[str]) -> Dict[str, int]:
+        """The id of the query each url is attributed to, for the urls claimed in the run"""
+        if not urls:
+            return {}
+        try:
+            values = get_redis().hmget(self.key, urls)
+        except RedisError:
+            return {}
+        return {url: int(value.split()[1]) for url, value in zip(urls, values) if value}
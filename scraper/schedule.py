@@ -0,0 +1,68 @@
+import math
+from datetime import timedelta
+from typing import List, Optional
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from search.models import Product, Store
+
+logger = get_task_logger(__name__)
+
+
+def refresh_interval(volatility: float, clicks: int, priority_score: Optional[float]) -> timedelta:
+    """
+    How long a product can wait before its price and availability are refreshed
+
+    Every signal divides settings.SCRAPER_REFRESH_MAX_INTERVAL: the share of the last
+    refreshes that found a new price or availability, weighted by
+    settings.SCRAPER_REFRESH_VOLATILITY_WEIGHT, the recent clicks on a log scale,
+    and the priority score of the query the product was imported for.
+    The interval is never shorter than settings.SCRAPER_REFRESH_MIN_INTERVAL.
+    """
+    speedup = (
+        1
+        + settings.SCRAPER_REFRESH_VOLATILITY_WEIGHT * volatility
+        + math.log2(1 + clicks)
+        + max(priority_score or 0, 0)
+    )
+    seconds = max(settings.SCRAPER_REFRESH_MAX_INTERVAL / speedup, settings.SCRAPER_REFRESH_MIN_INTERVAL)
+    return timedelta(seconds=seconds)
+
+
+def schedule_products(store: Store, product_ids: Optional[List[str]] = None) -> int:
+    """
+    Set the next refresh of the active products of a store, from the last time they were seen
+
+    :param product_ids: (optional) only schedule these products
+
+    :returns: the number of products scheduled
+    """
+    since = timezone.now() - timedelta(days=settings.SCRAPER_REFRESH_CLICKS_DAYS)
+    products = store.products.only_active()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    values = [
+        [product_id, (last_seen or import_date) + refresh_interval(volatility, clicks, priority_score)]
+        for product_id, volatility, last_seen, import_date, priority_score, clicks in products.annotate(
+            recent_clicks=Count("clicks", filter=Q(clicks__created_at__gte=since))
+        ).values_list("id", "volatility", "last_seen", "import_date", "import_query__priority_score", "recent_clicks")
+    ]
+    if not values:
+        return 0
+
+    sql = (
+        f"UPDATE {connection.ops.quote_name(Product._meta.db_table)} AS product "
+        "SET next_refresh_at = scheduled.next_refresh_at "
+        "FROM (VALUES %s) AS scheduled (id, next_refresh_at) WHERE product.id = scheduled.id"
+    )
+    with connection.cursor() as cursor:
+        execute_values(cursor.cursor, sql, values, template="(%s, %s::timestamptz)", page_size=1000)
+
+    logger.info(f"Scheduled the refresh of {len(values)} products of {store.name}")
+    return len(values)
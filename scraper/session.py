@@ -0,0 +1,116 @@
+import random
+import threading
+from typing import Dict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from search.models import Store
+
+
+def get_random_user_agent():
+    agents = [
+        "Mozilla/5.0 (X11; Linux ppc64le; rv:75.0) Gecko/20100101 Firefox/75.0",
+        "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:39.0) Gecko/20100101 Firefox/75.0",
+        "Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10.10; rv:75.0) Gecko/20100101 Firefox/75.0",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.75.14 (KHTML, like Gecko) Version/7.0.3 Safari/7046A194A",
+        "Opera/9.80 (X11; Linux i686; Ubuntu/14.10) Presto/2.12.388 Version/12.16",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
+        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2919.83 Safari/537.36",
+        "Mozilla/5.0 (Linux; U; Android 4.0.3; ko-kr; LG-L160L Build/IML74K) AppleWebkit/534.30 (KHTML, like Gecko) Version/4.0 Mobile Safari/534.30",
+    ]
+    return random.choice(agents)
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """Build a keep-alive session with a sticky User-Agent and a retrying adapter"""
+    retry = Retry(
+        total=settings.SCRAPER_MAX_RETRIES,
+        backoff_factor=settings.SCRAPER_RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.SCRAPER_SESSION_HOST_POOLS, pool_maxsize=pool_size, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": get_random_user_agent()})
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class SessionRegistry:
+    """
+    Keep one pooled session per store for the lifetime of the worker process,
+    so consecutive requests to the same store reuse the open connections and cookies.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[int, requests.Session] = {}
+        self._pool_sizes: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, store: Store) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(store.id)
+            if session and self._pool_sizes[store.id] == store.connection_pool_size:
+                return session
+
+            if session:
+                session.close()
+
+            session = build_session(store.connection_pool_size)
+            self._sessions[store.id] = session
+            self._pool_sizes[store.id] = store.connection_pool_size
+            return session
+
+    def close(self, store_id: int = None):
+        with self._lock:
+            store_ids = [store_id] if store_id else list(self._sessions)
+            for pk in store_ids:
+                session = self._sessions.pop(pk, None)
+                self._pool_sizes.pop(pk, None)
+                if session:
+                    session.close()
+
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        """
+        Connection reuse per store: every request that did not need a new
+        connection is a hit, every connection opened is a miss.
+        """
+        with self._lock:
+            sessions = dict(self._sessions)
+
+        stats = {}
+        for store_id, session in sessions.items():
+            requests_sent, connections_opened = 0, 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+
+            stats[store_id] = {
+                "requests": requests_sent,
+                "hits": requests_sent - connections_opened,
+                "misses": connections_opened,
+            }
+        return stats
+
+
+sessions = SessionRegistry()
+
+
+def get_session(store: Store) -> requests.Session:
+    return sessions.get(store)
+
+
+def session_stats() -> Dict[int, Dict[str, int]]:
+    return sessions.stats()
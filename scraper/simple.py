@@ -1,39 +1,264 @@
-import locale
-import re
-
-import random
-import string
 import unicodedata
-from time import sleep
-from typing import Optional, List, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, NamedTuple, Optional, List, Dict, Tuple, TypeVar, Union
 from urllib.parse import quote
 
 import requests
 import urllib
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from selenium.common.exceptions import WebDriverException
 
 from scraper.browser import get_html
+from scraper import escalation, parsers, throttle
+from scraper.conditional import NotModified, Validators
+from scraper.discovery import Discovery
+from scraper.plan import get_plan
+from scraper.prices import parse_price
+from scraper.session import get_session, get_random_user_agent
+from scraper.structured import structured_product
 from search.models import Store
 
 logger = get_task_logger(__name__)
 
+# Answers of bot protections that a browser can usually get past
+BLOCKED_STATUSES = (403, 503)
+# The last result page followed through the page param
+SEARCH_MAX_PAGE = 10
+# The id of a product is made from its name, a configured selector keeps it stable
+SELECTOR_FIRST_FIELDS = ("name",)
+
+
+class BlockedPage(Exception):
+    """The store refused to serve the page over plain HTTP"""
+
+
+class ProductPage(NamedTuple):
+    """A parsed product page and its schema.org data, read once per parse"""
+
+    soup: BeautifulSoup
+    structured_data: Dict
+
+
+# What fetch_soup parses a page into
+Page = TypeVar("Page")
+
+
+def fetch_page(
+    url: str,
+    js_enabled: bool = False,
+    store: Optional[Store] = None,
+    throttled: bool = True,
+    validators: Optional[Validators] = None,
+    wait_for: Optional[str] = None,
+) -> Tuple[Optional[Union[str, bytes]], Optional[Validators]]:
+    """
+    Download a page and compute its cache validators
+
+    :param url: the page to download
+    :param js_enabled: (optional) render the page through a browser
+    :param store: (optional) the store the page belongs to, its pooled session is used
+    :param throttled: (optional) wait for the rate limiter of the store before the request,
+        disable it only if the caller already waited
+    :param validators: (optional) the validators stored by a previous download,
+        they make the request conditional
+    :param wait_for: (optional) when rendering through a browser, a CSS selector
+        the page must contain before it is considered ready
+
+    :raises NotModified: if the server answers 304 or the content did not change
+    :raises BlockedPage: if the server answers with one of BLOCKED_STATUSES
+
+    :returns: the page content and its validators, or (None, None) if the page could not be downloaded
+    """
+    if store and throttled:
+        throttle.wait(store)
 
-def get_soup(url: str, js_enabled: bool = False) -> Optional[BeautifulSoup]:
-    """Get a soup object from a url"""
     if js_enabled:
         logger.info("Getting HTML through a browser in order to use JS")
-        html = get_html(url)
+        html = get_html(
+            url,
+            store_id=store.id if store else None,
+            wait_for=wait_for,
+            allowed_domains=get_plan(store).browser_allowed_domains if store else (),
+        )
+        page = None
     else:
-        page = requests.get(url, headers={"User-Agent": get_random_user_agent()})
+        headers = validators.headers() if validators else {}
+        if store:
+            page = get_session(store).get(
+                url, headers=headers, timeout=settings.SCRAPER_REQUEST_TIMEOUT
+            )
+        else:
+            headers["User-Agent"] = get_random_user_agent()
+            page = requests.get(
+                url, headers=headers, timeout=settings.SCRAPER_REQUEST_TIMEOUT
+            )
+
+        if page.status_code == 304:
+            raise NotModified(url)
+
+        if page.status_code in BLOCKED_STATUSES:
+            raise BlockedPage(f"{url} answered {page.status_code}")
+
         if page.status_code != 200:
             logger.warning(
                 f"Could not get status 200: Status: {page.status_code} Content: {page.content}"
             )
-            return None
+            return None, None
         html = page.content
 
-    return BeautifulSoup(html, "html.parser")
+    new_validators = Validators.from_response(html, page)
+    if validators and validators.content_hash == new_validators.content_hash:
+        raise NotModified(url)
+
+    return html, new_validators
+
+
+def fetch_html(
+    url: str,
+    js_enabled: bool = False,
+    store: Optional[Store] = None,
+    throttled: bool = True,
+    wait_for: Optional[str] = None,
+) -> Optional[Union[str, bytes]]:
+    """Download the HTML of a page, see fetch_page for the parameters"""
+    try:
+        html, _ = fetch_page(
+            url, js_enabled=js_enabled, store=store, throttled=throttled, wait_for=wait_for
+        )
+    except BlockedPage as e:
+        logger.warning(f"Could not get status 200: {e}")
+        return None
+    return html
+
+
+def parse_html(
+    html: Union[str, bytes], store: Optional[Store] = None, parse_only: Optional[SoupStrainer] = None
+) -> BeautifulSoup:
+    """Parse a page with the parser configured on the store, or the default one"""
+    return parsers.parse_html(
+        html, backend=store.html_parser if store else None, parse_only=parse_only
+    )
+
+
+def get_soup(
+    url: str,
+    js_enabled: bool = False,
+    store: Optional[Store] = None,
+    wait_for: Optional[str] = None,
+) -> Optional[BeautifulSoup]:
+    """Get a soup object from a url, see fetch_page for the parameters"""
+    html = fetch_html(url, js_enabled=js_enabled, store=store, wait_for=wait_for)
+    if html is None:
+        return None
+
+    return parse_html(html, store)
+
+
+def fetch_soup(
+    url: str,
+    config: Store,
+    parse: Callable[[Union[str, bytes]], Page],
+    is_complete: Callable[[Page], Optional[bool]],
+    wait_for: Optional[str] = None,
+    validators: Optional[Validators] = None,
+    throttled: bool = True,
+) -> Tuple[Optional[Page], Optional[Validators]]:
+    """
+    Download and parse a page over plain HTTP, and render it in a browser only if
+    the store refused it or if the parsed page is not complete.
+    If the browser fails, the page parsed from plain HTTP is returned, if any.
+
+    :param url: the page to download
+    :param config: a search.models.Store instance.
+    :param parse: parse the downloaded HTML
+    :param is_complete: tell if a page parsed from plain HTTP has what the caller needs,
+        None if the page cannot tell, it is then returned and not counted in the escalation rate
+    :param wait_for: (optional) see fetch_page
+    :param validators: (optional) see fetch_page
+    :param throttled: (optional) see fetch_page, only for the first request
+
+    :raises NotModified: if validators are given and the page did not change
+
+    :returns: the parsed page and its validators, or (None, None) if the page could not be downloaded
+    """
+    soup, new_validators = None, None
+    if escalation.should_try_http(config):
+        try:
+            html, new_validators = fetch_page(
+                url, store=config, throttled=throttled, validators=validators
+            )
+            soup = parse(html) if html is not None else None
+            complete = is_complete(soup) if soup is not None else True
+            if complete is None:
+                return soup, new_validators
+            if complete:
+                escalation.record(config, escalated=False)
+                return soup, new_validators
+        except BlockedPage as e:
+            logger.info(f"{e}, trying with a browser")
+
+        logger.info(f"Plain HTTP was not enough for {url}, rendering it in a browser")
+        escalation.record(config, escalated=True)
+        throttled = True
+
+    try:
+        html, rendered_validators = fetch_page(
+            url,
+            js_enabled=True,
+            store=config,
+            throttled=throttled,
+            validators=validators,
+            wait_for=wait_for,
+        )
+    except WebDriverException as e:
+        logger.warning(f"Could not render {url} in a browser: {e}")
+        return soup, new_validators
+    return (parse(html) if html is not None else None), rendered_validators
+
+
+def get_product_page(
+    url: str,
+    config: Store,
+    fields: List[str],
+    validators: Optional[Validators] = None,
+    throttled: bool = True,
+) -> Tuple[Optional[ProductPage], Optional[Validators]]:
+    """Download and parse a product page, see fetch_soup"""
+    plan = get_plan(config)
+    return fetch_soup(
+        url,
+        config,
+        parse=lambda html: parse_product_page(html, config, fields),
+        is_complete=lambda page: plan.required_selectors_hit(
+            page.soup, unstructured_fields(page.structured_data, fields)
+        ),
+        wait_for=plan.product_ready_css,
+        validators=validators,
+        throttled=throttled,
+    )
+
+
+def get_search_soup(url: str, config: Store, throttled: bool = True) -> Optional[BeautifulSoup]:
+    """
+    Download and parse a result page, see fetch_soup
+
+    A page listing products is complete. A page without any cannot tell, the query may
+    have no result on the store: it is only rendered in a browser if the store refused it.
+    """
+    plan = get_plan(config)
+    soup, _ = fetch_soup(
+        url,
+        config,
+        parse=lambda html: parse_html(html, config),
+        is_complete=lambda soup: True if extract_search_results(soup, config, limit=1) else None,
+        wait_for=plan.search_ready_css,
+        throttled=throttled,
+    )
+    return soup
 
 
 def get_link(soup: BeautifulSoup, config: Store) -> str:
@@ -52,60 +277,108 @@ def format_image_link(text: str, store: Store) -> str:
     return text
 
 
-def parse_price(price_string: str, store_locale: str = "it_IT") -> Optional[float]:
-    regex = r"(([A-Z]{3} )?(\$|€|£)?(\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})))"
-    pattern = re.compile(regex)
-    match = pattern.match(price_string)
-    if match:
-        locale.setlocale(locale.LC_NUMERIC, store_locale)
-        return locale.atof(match.group(4))
-    else:
-        allowed_characters = string.digits + ".,$€£"
-        clean_price = "".join(c for c in price_string if c in allowed_characters)
-        return parse_price(clean_price, store_locale)
-
-
-def scrape_product(url: str, config: Store, fields: Optional[List[str]] = None) -> Dict:
+def scrape_product(
+    url: str,
+    config: Store,
+    fields: Optional[List[str]] = None,
+    validators: Optional[Validators] = None,
+) -> Dict:
     """
     Scrape a product from a url based on the config dict
 
     :param url: a valid product page to scrape
     :param config: a search.models.Store instance.
     :param fields: (optional) a list of fields in search.models.Store
+    :param validators: (optional) the validators of the last download of the page
+
+    :raises NotModified: if validators are given and the page did not change
 
     :returns: a dictionary with fields as given in the config and values scraped.
         If a field is not found in the page, it won't be returned.
+        The new validators of the page are always returned.
     """
     fields = fields or ["name", "price", "image"]
 
     logger.info(f"Looking for {fields} on {url}")
-    soup = get_soup(url, js_enabled=config.scrape_with_js)
-    data = {}
-
-    if not soup:
-        return data
-
-    for field in fields:
-        style_class = getattr(config, "product_{}_class".format(field))
-        html_tag = getattr(config, "product_{}_tag".format(field))
-        selector = (
-            "class"
-            if getattr(config, "product_{}_css_is_class".format(field))
-            else "id"
-        )
+    page, new_validators = get_product_page(url, config, fields, validators=validators)
 
-        if not bool(style_class) or not bool(html_tag):
-            continue
+    if page is None:
+        return {}
+
+    data = extract_product(page.soup, url, config, fields, structured_data=page.structured_data)
+    data.update(new_validators.as_dict())
+    return data
+
+
+def parse_product_page(html: Union[str, bytes], config: Store, fields: List[str]) -> ProductPage:
+    """
+    Parse only the parts of a product page matched by the selectors of the given fields.
+    If any of those selectors misses, the whole page is parsed instead.
+
+    The partial page keeps the schema.org data of the product, so it is read only once.
+    """
+    plan = get_plan(config)
+    strainer = plan.strainer(fields)
+    if not settings.SCRAPER_PARTIAL_PARSING or not strainer:
+        soup = parse_html(html, config)
+        return ProductPage(soup, product_structured_data(soup, config, fields))
+
+    soup = parse_html(html, config, parse_only=strainer)
+    structured_data = product_structured_data(soup, config, fields)
+
+    for field, html_tag, selector, style_class in plan.selectors(unstructured_fields(structured_data, fields)):
+        if not soup.find(html_tag, {selector: style_class}):
+            logger.info(f"Selector for {field} missed on the partial page, parsing all of it")
+            return ProductPage(parse_html(html, config), structured_data)
+    return ProductPage(soup, structured_data)
+
+
+def product_structured_data(soup: BeautifulSoup, config: Store, fields: List[str]) -> Dict:
+    """
+    The given fields as found in the schema.org data of the page, if enabled.
+    The fields of SELECTOR_FIRST_FIELDS are left to the selectors of the store, when configured.
+    """
+    if not settings.SCRAPER_STRUCTURED_DATA:
+        return {}
+    plan = get_plan(config)
+    fields = [field for field in fields if field not in SELECTOR_FIRST_FIELDS or not plan.selectors([field])]
+    return structured_product(soup, fields)
 
+
+def unstructured_fields(structured_data: Dict, fields: List[str]) -> List[str]:
+    """The given fields missing from the schema.org data of the page"""
+    return [field for field in fields if field not in structured_data]
+
+
+def extract_product(
+    soup: BeautifulSoup, url: str, config: Store, fields: List[str], structured_data: Optional[Dict] = None
+) -> Dict:
+    """
+    Extract the given fields of a product from an already parsed page, see scrape_product
+
+    The schema.org data of the page is read first, the selectors of the store
+    are used only for the fields it does not provide.
+
+    :param structured_data: (optional) the schema.org data of the page, read from the soup if not given
+    """
+    plan = get_plan(config)
+    data = dict(structured_data) if structured_data is not None else product_structured_data(soup, config, fields)
+    if data:
+        logger.info(f"Found {list(data)} in the structured data")
+    if "image" in data:
+        data["image"] = format_image_link(data["image"], store=config)
+    if "price" in data:
+        data.setdefault("currency", config.currency)
+
+    missing_fields = [field for field in fields if field not in data]
+    for field, html_tag, selector, style_class in plan.selectors(missing_fields):
         soup_obj = soup.find(html_tag, {selector: style_class})
         logger.info(f"Scraping {field} with tag '{html_tag}' and class '{style_class}'")
 
         if field == "is_available":
             text = soup_obj.get_text().strip() if soup_obj else ""
             logger.info(f"Found {text if soup_obj else 'nothing'} in availability tag")
-            data[field] = bool(
-                re.search(config.product_is_available_match.lower(), text.lower())
-            )
+            data[field] = plan.is_available(text)
             continue
 
         if soup_obj:
@@ -139,7 +412,7 @@ def scrape_product(url: str, config: Store, fields: Optional[List[str]] = None)
 
 
 def search(
-    query: str, config: Store, limit: Optional[int] = 1, seconds_of_sleep: int = 10
+    query: str, config: Store, limit: Optional[int] = 1, discovery: Optional[Discovery] = None
 ) -> List[str]:
     """
     Search for the given query on a store and returns a list of product pages
@@ -148,87 +421,165 @@ def search(
     :param config: a search.models.Store instance.
     :param limit: (optional) the maximum number of results,
         if None return all possible products looping through the pages
-    :param seconds_of_sleep: (optional) number of seconds of sleep between scraping pages
+    :param discovery: (optional) stop paging once the pages list few unknown products
 
     :return: a list of scraped urls
     """
-    next_url = config.search_url + quote(query)
+    if get_plan(config).search_prefetch:
+        return search_concurrently(query, config, limit, discovery)
+
+    next_url = search_url(query, config)
     scraped_urls = []
 
     while next_url:
         logger.info(f"Searching {query} at {next_url}")
-        soup = get_soup(next_url, js_enabled=config.scrape_with_js)
+        soup = get_search_soup(next_url, config)
         if not soup:
             return scraped_urls
 
-        soup_list = soup.find_all(
-            name=config.search_tag, attrs={"class": config.search_class}, limit=limit
+        results = extract_search_results(soup, config, limit=limit)
+        for href in results:
+            if limit and len(scraped_urls) == limit:
+                return scraped_urls
+
+            scraped_urls.append(href)
+
+        if discovery and not discovery.keep_paging(results):
+            break
+
+        next_url = next_search_page(soup, next_url, config)
+
+    return scraped_urls
+
+
+def search_concurrently(
+    query: str, config: Store, limit: Optional[int] = 1, discovery: Optional[Discovery] = None
+) -> List[str]:
+    """
+    Search like search(), fetching the numbered result pages in parallel
+
+    Up to plan.search_concurrency pages are in flight, each still waiting for the rate
+    limiter of the store. Results are read in page order and no more pages are requested
+    after the first one without results.
+    """
+    plan = get_plan(config)
+    urls = numbered_search_pages(search_url(query, config), config)
+    if discovery:
+        urls = islice(urls, discovery.max_pages)
+    scraped_urls = []
+
+    with ThreadPoolExecutor(max_workers=plan.search_concurrency) as executor:
+        pending = deque(
+            executor.submit(get_search_soup, url, config)
+            for url in islice(urls, plan.search_concurrency)
         )
+        try:
+            while pending:
+                soup = pending.popleft().result()
+                results = extract_search_results(soup, config) if soup else []
+                if not results:
+                    logger.info(f"No results for {query} after {len(scraped_urls)} products")
+                    break
+
+                for href in results:
+                    if limit and len(scraped_urls) == limit:
+                        return scraped_urls
+                    scraped_urls.append(href)
+
+                if discovery and not discovery.keep_paging(results):
+                    break
+
+                next_url = next(urls, None)
+                if next_url:
+                    pending.append(executor.submit(get_search_soup, next_url, config))
+        finally:
+            for future in pending:
+                future.cancel()
 
-        for obj in soup_list:
-            title = obj.find(class_=config.search_link)
+    return scraped_urls
 
-            if not title:
-                continue
 
-            href = get_link(title, config)
+def search_url(query: str, config: Store) -> str:
+    """The url of the first result page for the given query"""
+    return config.search_url + quote(query)
 
-            if limit and len(scraped_urls) == limit:
-                return scraped_urls
 
-            scraped_urls.append(href)
+def extract_search_results(
+    soup: BeautifulSoup, config: Store, limit: Optional[int] = None
+) -> List[str]:
+    """Extract the product pages listed in an already parsed result page"""
+    plan = get_plan(config)
+    soup_list = soup.find_all(
+        name=plan.search_tag, attrs={"class": plan.search_class}, limit=limit
+    )
 
-        if not (config.search_next_page or config.search_page_param):
-            return scraped_urls
+    urls = []
+    for obj in soup_list:
+        title = obj.find(class_=plan.search_link)
 
-        if config.search_page_param:
-            logger.info(
-                f"Using page param {config.search_page_param} to find next page"
-            )
-            url_parts = list(urllib.parse.urlparse(next_url))
-            query_params = dict(urllib.parse.parse_qsl(url_parts[4]))
+        if not title:
+            continue
 
-            if int(query_params.get(config.search_page_param, 1)) >= 10:
-                return scraped_urls
+        urls.append(get_link(title, config))
+    return urls
 
-            query_params.update(
-                {
-                    config.search_page_param: str(
-                        int(query_params.get(config.search_page_param, 1)) + 1
-                    )
-                }
-            )
-            url_parts[4] = urllib.parse.urlencode(query_params)
-            next_url = urllib.parse.urlunparse(url_parts)
-        elif config.search_next_page:
-            logger.info(f"Using CSS class {config.search_next_page} to find next page")
-            next_link = soup.find(class_=config.search_next_page)
 
-            if not next_link:
-                return scraped_urls
+def next_search_page(soup: BeautifulSoup, url: str, config: Store) -> Optional[str]:
+    """
+    Find the url of the result page following the given one
+
+    :param soup: the parsed result page
+    :param url: the url of the result page
+    :param config: a search.models.Store instance.
+
+    :return: the url of the next page or None if this is the last page
+    """
+    plan = get_plan(config)
+    if plan.search_page_param:
+        logger.info(
+            f"Using page param {plan.search_page_param} to find next page"
+        )
+        page = search_page_number(url, config)
+        if page >= SEARCH_MAX_PAGE:
+            return None
 
-            if next_link.name != "a":
-                next_link = next_link.find("a")
+        return set_search_page_number(url, config, page + 1)
 
-            next_url = next_link["href"]
-            if next_url and not next_url.startswith("http"):
-                next_url = urllib.parse.urljoin(config.website, next_url)
-            sleep(seconds_of_sleep)
+    if plan.search_next_page:
+        logger.info(f"Using CSS class {plan.search_next_page} to find next page")
+        next_link = soup.find(class_=plan.search_next_page)
 
-        else:
-            next_url = None
-    return scraped_urls
+        if not next_link:
+            return None
+
+        if next_link.name != "a":
+            next_link = next_link.find("a")
+
+        next_url = next_link["href"]
+        if next_url and not next_url.startswith("http"):
+            next_url = urllib.parse.urljoin(config.website, next_url)
+        return next_url
+
+    return None
+
+
+def search_page_number(url: str, config: Store) -> int:
+    """The number of a result page, read from the page param"""
+    query_params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(url).query))
+    return int(query_params.get(get_plan(config).search_page_param, 1))
+
+
+def set_search_page_number(url: str, config: Store, page: int) -> str:
+    """The url of another result page, through the page param"""
+    url_parts = list(urllib.parse.urlparse(url))
+    query_params = dict(urllib.parse.parse_qsl(url_parts[4]))
+    query_params[get_plan(config).search_page_param] = str(page)
+    url_parts[4] = urllib.parse.urlencode(query_params)
+    return urllib.parse.urlunparse(url_parts)
 
 
-def get_random_user_agent():
-    agents = [
-        "Mozilla/5.0 (X11; Linux ppc64le; rv:75.0) Gecko/20100101 Firefox/75.0",
-        "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:39.0) Gecko/20100101 Firefox/75.0",
-        "Mozilla/5.0 (Macintosh; U; Intel Mac OS X 10.10; rv:75.0) Gecko/20100101 Firefox/75.0",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.75.14 (KHTML, like Gecko) Version/7.0.3 Safari/7046A194A",
-        "Opera/9.80 (X11; Linux i686; Ubuntu/14.10) Presto/2.12.388 Version/12.16",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
-        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2919.83 Safari/537.36",
-        "Mozilla/5.0 (Linux; U; Android 4.0.3; ko-kr; LG-L160L Build/IML74K) AppleWebkit/534.30 (KHTML, like Gecko) Version/4.0 Mobile Safari/534.30",
-    ]
-    return random.choice(agents)
+def numbered_search_pages(url: str, config: Store) -> Iterator[str]:
+    """The urls of the result pages from the given one to SEARCH_MAX_PAGE, through the page param"""
+    yield url
+    for page in range(search_page_number(url, config) + 1, SEARCH_MAX_PAGE + 1):
+        yield set_search_page_number(url, config, page)
@@ -0,0 +1,160 @@
+import gzip
+import re
+from datetime import datetime, time
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+from xml.etree.ElementTree import ParseError, iterparse
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from requests import RequestException
+from urllib3.exceptions import HTTPError
+
+from scraper import throttle
+from scraper.session import get_session
+from search.models import Store
+
+logger = get_task_logger(__name__)
+
+
+class SitemapError(Exception):
+    """A sitemap could not be read to its end"""
+
+
+class SitemapEntry(NamedTuple):
+    loc: str
+    lastmod: Optional[datetime]
+    # The entry is a child sitemap of a sitemap index
+    is_sitemap: bool = False
+
+
+def parse_lastmod(text: Optional[str]) -> Optional[datetime]:
+    """Parse a W3C datetime, either a date or a date and time, as an aware datetime"""
+    text = (text or "").strip()
+    if not text:
+        return None
+
+    try:
+        value = parse_datetime(text)
+        if value is None:
+            date = parse_date(text)
+            value = datetime.combine(date, time.min) if date else None
+    except ValueError:
+        return None
+
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def local_name(tag: str) -> str:
+    """The tag without its namespace, sitemaps are not always declared with the standard one"""
+    return tag.rpartition("}")[2]
+
+
+def stream_sitemap(url: str, store: Store) -> Iterator[SitemapEntry]:
+    """
+    Read the entries of one sitemap, or of one sitemap index, while it downloads
+
+    Each <url> or <sitemap> element is dropped once read, so the memory used does not
+    depend on the size of the sitemap. Gzipped sitemaps are supported.
+
+    :raises SitemapError: if the sitemap could not be downloaded or parsed to its end
+    """
+    throttle.wait(store)
+    try:
+        response = get_session(store).get(url, stream=True, timeout=settings.SCRAPER_REQUEST_TIMEOUT)
+    except RequestException as e:
+        raise SitemapError(e) from e
+
+    try:
+        if response.status_code != 200:
+            raise SitemapError(f"Status: {response.status_code}")
+
+        response.raw.decode_content = True
+        stream = response.raw
+        if url.endswith(".gz") or "gzip" in response.headers.get("Content-Type", ""):
+            stream = gzip.GzipFile(fileobj=stream)
+
+        # The root is at depth 0, the <url> or <sitemap> elements at 1 and their fields at 2,
+        # the <loc> of an extension, like <image:image><image:loc>, is deeper and ignored
+        root, depth, loc, lastmod = None, -1, None, None
+        for event, element in iterparse(stream, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+
+            level, depth = depth, depth - 1
+            name = local_name(element.tag)
+            if level == 2 and name == "loc":
+                loc = (element.text or "").strip()
+            elif level == 2 and name == "lastmod":
+                lastmod = parse_lastmod(element.text)
+            elif level == 1 and name in ("url", "sitemap"):
+                if loc:
+                    yield SitemapEntry(loc, lastmod, is_sitemap=name == "sitemap")
+                loc, lastmod = None, None
+                root.clear()
+    except (ParseError, OSError, EOFError, RequestException, HTTPError) as e:
+        # urllib3 errors are not wrapped by requests when the raw stream is read
+        raise SitemapError(e) from e
+    finally:
+        response.close()
+
+
+def read_sitemap(
+    store: Store, select: Callable[[List[SitemapEntry]], List[str]], since: Optional[datetime] = None
+) -> Tuple[List[str], int, bool]:
+    """
+    The product pages to import out of the sitemap of a store, following sitemap indexes
+
+    The entries are handed to select by chunks of settings.SCRAPER_SITEMAP_CHUNK_SIZE while
+    each sitemap is read, only the urls it keeps are held, so the memory used does not depend
+    on the size of the sitemap. Every sitemap is read to its end before the urls are returned,
+    the connection of a sitemap is never left idle while product pages are scraped.
+
+    :param store: a search.models.Store instance with a sitemap_url
+    :param select: the urls to import out of a chunk of product entries
+    :param since: (optional) skip the child sitemaps not modified after this date
+
+    :returns: the urls kept by select, the number of entries whose url matches
+        store.sitemap_product_pattern, if any, and whether every sitemap could be read
+    """
+    pattern = re.compile(store.sitemap_product_pattern) if store.sitemap_product_pattern else None
+    pending: List[str] = [store.sitemap_url]
+    visited = set()
+    urls: List[str] = []
+    listed = 0
+    complete = True
+
+    while pending:
+        url = pending.pop()
+        if url in visited:
+            continue
+        visited.add(url)
+
+        chunk: List[SitemapEntry] = []
+        try:
+            for entry in stream_sitemap(url, store):
+                if entry.is_sitemap:
+                    if since and entry.lastmod and entry.lastmod <= since:
+                        continue
+                    pending.append(entry.loc)
+                elif not pattern or pattern.search(entry.loc):
+                    chunk.append(entry)
+                    if len(chunk) >= settings.SCRAPER_SITEMAP_CHUNK_SIZE:
+                        urls.extend(select(chunk))
+                        listed, chunk = listed + len(chunk), []
+        except SitemapError as e:
+            logger.warning(f"Could not read the sitemap {url}: {e}")
+            complete = False
+
+        # The entries read before an error are still imported
+        if chunk:
+            urls.extend(select(chunk))
+            listed += len(chunk)
+
+    return urls, listed, complete
@@ -0,0 +1,92 @@
+import threading
+import time
+import uuid
+from typing import Optional
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from helpers.redis_client import get_redis
+from search.models import Store
+
+logger = get_task_logger(__name__)
+
+# Take or renew a slot, the sorted set of the store maps each holder to the end of its lease.
+# Expired leases are dropped first, so the slots of dead workers are freed.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if not redis.call('ZSCORE', KEYS[1], ARGV[4]) and redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+redis.call('EXPIRE', KEYS[1], math.ceil(ttl) + 1)
+return 1
+"""
+
+_script = None
+
+
+class StoreSlot:
+    """
+    One of the store.max_concurrent_fetches slots of a store, shared by every worker through Redis.
+
+    A slot is leased for settings.SCRAPER_STORE_SLOT_TTL seconds and renewed by a thread
+    while it is held, so the slot of a worker that died is freed once its lease ends.
+    Without Redis the slot is always granted.
+
+        slot = StoreSlot(store)
+        if slot.acquire():
+            with slot:
+                ...
+    """
+
+    def __init__(self, store: Store):
+        self.store = store
+        self.key = f"store_slots:{store.id}"
+        self.token = uuid.uuid4().hex
+        self._stop: Optional[threading.Event] = None
+
+    def _call(self) -> bool:
+        global _script
+        if _script is None:
+            _script = get_redis().register_script(ACQUIRE_SCRIPT)
+        return bool(int(_script(
+            keys=[self.key],
+            args=[time.time(), max(self.store.max_concurrent_fetches, 1), settings.SCRAPER_STORE_SLOT_TTL, self.token],
+        )))
+
+    def acquire(self) -> bool:
+        """Take a slot if one is free, without waiting"""
+        try:
+            return self._call()
+        except RedisError as e:
+            logger.warning(f"Store slots unavailable, {self.store.name} is not limited: {e}")
+            return True
+
+    def release(self):
+        try:
+            get_redis().zrem(self.key, self.token)
+        except RedisError as e:
+            logger.warning(f"Could not release the slot of {self.store.name}: {e}")
+
+    def _renew(self, stop: threading.Event):
+        while not stop.wait(settings.SCRAPER_STORE_SLOT_TTL / 3):
+            try:
+                if not self._call():
+                    logger.warning(f"The slot of {self.store.name} expired and was taken, renewing later")
+            except RedisError as e:
+                logger.warning(f"Could not renew the slot of {self.store.name}: {e}")
+
+    def __enter__(self) -> "StoreSlot":
+        self._stop = threading.Event()
+        threading.Thread(target=self._renew, args=(self._stop,), daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self.release()
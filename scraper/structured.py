@@ -0,0 +1,173 @@
+import html
+import json
+import re
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Union
+
+from bs4 import BeautifulSoup
+
+from scraper.prices import parse_price
+
+# What the parse filter must keep for the structured data to be read from a partial page
+JSON_LD_SELECTOR = ("script", "type", "application/ld+json")
+MICRODATA_PRODUCT_TYPES = ("http://schema.org/Product", "https://schema.org/Product")
+MICRODATA_SELECTORS = [("*", "itemtype", itemtype) for itemtype in MICRODATA_PRODUCT_TYPES]
+
+# The fields of scrape_product that schema.org Product can provide
+STRUCTURED_FIELDS = ("name", "price", "image", "is_available", "description")
+
+UNAVAILABLE = ("OutOfStock", "SoldOut", "Discontinued")
+# An ISO 4217 code, the only currencies search.models.Product can store
+CURRENCY_PATTERN = re.compile(r"[A-Za-z]{3}")
+
+
+def iter_json_ld(soup: BeautifulSoup) -> Iterator[Dict]:
+    """Every object of the JSON-LD blocks of the page, following lists and @graph"""
+    for script in soup.find_all("script", {"type": "application/ld+json"}):
+        try:
+            data = json.loads(script.string or "", strict=False)
+        except ValueError:
+            continue
+
+        pending = [data]
+        while pending:
+            item = pending.pop()
+            if isinstance(item, list):
+                pending.extend(reversed(item))
+            elif isinstance(item, dict):
+                yield item
+                if isinstance(item.get("@graph"), list):
+                    pending.extend(reversed(item["@graph"]))
+
+
+def is_product(item: Dict) -> bool:
+    types = item.get("@type")
+    types = types if isinstance(types, list) else [types]
+    return "Product" in types
+
+
+def first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+def offer_price(offer: Dict) -> Optional[float]:
+    price = offer.get("price", offer.get("lowPrice"))
+    if price is None and isinstance(offer.get("priceSpecification"), dict):
+        price = offer["priceSpecification"].get("price")
+    if isinstance(price, (int, float)):
+        return float(price)
+    # schema.org prices use a dot as decimal separator
+    return parse_price(str(price), "en_US") if price is not None else None
+
+
+def currency_code(value) -> Optional[str]:
+    if not isinstance(value, str) or not CURRENCY_PATTERN.fullmatch(value.strip()):
+        return None
+    return value.strip().upper()
+
+
+def availability(value: Optional[str]) -> Optional[bool]:
+    if not value:
+        return None
+    return value.rstrip("/").rpartition("/")[2] not in UNAVAILABLE
+
+
+def image_url(value) -> Optional[str]:
+    value = first(value)
+    if isinstance(value, dict):
+        value = value.get("url") or value.get("contentUrl")
+    return value if isinstance(value, str) and value else None
+
+
+def product_from_json_ld(soup: BeautifulSoup) -> Dict:
+    """The schema.org Product described by the JSON-LD of the page, as scrape_product fields"""
+    for item in iter_json_ld(soup):
+        if not is_product(item):
+            continue
+
+        data = {}
+        # JSON-LD strings are often HTML escaped, like 5&#8243; on WooCommerce
+        for field in ("name", "description"):
+            if isinstance(item.get(field), str):
+                data[field] = html.unescape(item[field])
+        image = image_url(item.get("image"))
+        if image:
+            data["image"] = image
+
+        # A page with variants has one offer each: the lowest price, available if any offer is
+        offers = item.get("offers")
+        offers = [offer for offer in (offers if isinstance(offers, list) else [offers]) if isinstance(offer, dict)]
+        priced = [(offer_price(offer), offer) for offer in offers]
+        priced = [(price, offer) for price, offer in priced if price is not None]
+        if priced:
+            price, offer = min(priced, key=lambda priced_offer: priced_offer[0])
+            data["price"] = price
+            currency = currency_code(offer.get("priceCurrency"))
+            if currency:
+                data["currency"] = currency
+        availabilities = [availability(offer.get("availability")) for offer in offers]
+        availabilities = [is_available for is_available in availabilities if is_available is not None]
+        if availabilities:
+            data["is_available"] = any(availabilities)
+        return data
+    return {}
+
+
+def microdata_value(node) -> Optional[str]:
+    for attr in ("content", "href", "src"):
+        if node.has_attr(attr):
+            return node[attr]
+    return node.get_text().strip()
+
+
+def product_from_microdata(soup: BeautifulSoup) -> Dict:
+    """The schema.org Product described by the microdata of the page, as scrape_product fields"""
+    for itemtype in MICRODATA_PRODUCT_TYPES:
+        product = soup.find(attrs={"itemtype": itemtype})
+        if product:
+            break
+    else:
+        return {}
+
+    def prop(name: str) -> Optional[str]:
+        node = product.find(attrs={"itemprop": name})
+        return microdata_value(node) if node else None
+
+    data = {}
+    for field in ("name", "description", "image"):
+        value = prop(field)
+        if value:
+            data[field] = value
+
+    price = parse_price(prop("price") or prop("lowPrice"), "en_US")
+    if price is not None:
+        data["price"] = price
+        currency = currency_code(prop("priceCurrency"))
+        if currency:
+            data["currency"] = currency
+
+    is_available = availability(prop("availability"))
+    if is_available is not None:
+        data["is_available"] = is_available
+    return data
+
+
+def structured_product(soup: BeautifulSoup, fields: List[str]) -> Dict[str, Union[str, float, bool]]:
+    """
+    The given fields of the product as found in the schema.org data of the page,
+    JSON-LD first, then microdata. Fields missing from both are not returned.
+    """
+    if not any(field in STRUCTURED_FIELDS for field in fields):
+        return {}
+
+    data = product_from_json_ld(soup) or product_from_microdata(soup)
+    if "price" not in fields:
+        data.pop("currency", None)
+
+    result = {}
+    for field, value in data.items():
+        if field in fields or field == "currency":
+            if isinstance(value, str):
+                value = unicodedata.normalize("NFKD", value).strip()
+            result[field] = value
+    return result
@@ -0,0 +1,1312 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import unittest
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bs4 import BeautifulSoup
+from requests import ConnectionError, ReadTimeout
+from redis.exceptions import RedisError
+from selenium.common.exceptions import WebDriverException
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from helpers.redis_client import get_redis
+from scraper import runs, slots, throttle
+from scraper.browser import BrowserPool, PooledDriver
+from scraper.conditional import NotModified, Validators, content_hash
+from scraper.crawler import Crawler
+from scraper.discovery import Discovery
+from scraper.feeds import feed_product, iter_csv_items, iter_xml_items
+from scraper.parsers import PARSERS, parse_html
+from scraper.platforms import get_adapter
+from scraper.prices import parse_price, parse_prices
+from scraper.plan import get_plan, invalidate_plan
+from scraper.schedule import refresh_interval
+from scraper.session import build_session
+from scraper.simple import (
+    extract_product,
+    extract_search_results,
+    fetch_page,
+    get_product_page,
+    get_search_soup,
+    parse_product_page,
+    scrape_product,
+    search_concurrently,
+)
+from scraper.sitemap import SitemapEntry, read_sitemap
+from scraper.structured import structured_product
+from search.helpers import import_store_sitemap, re_import_chunk, refresh_store_products
+from search.models import ImportQuery, Product, ReImportRun, SearchDepth, Store
+from search.writer import ProductWriter, RefreshWriter, product_fingerprint
+
+
+class ParsePriceTest(SimpleTestCase):
+
+    def test_european_format(self):
+        self.assertEqual(parse_price("12,99", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("1.234,50", Store.LOCALE_EU), 1234.5)
+        self.assertEqual(parse_price("1.234", Store.LOCALE_EU), 1234)
+        self.assertEqual(parse_price("1 234,50", Store.LOCALE_EU), 1234.5)
+
+    def test_american_format(self):
+        self.assertEqual(parse_price("12.99", Store.LOCALE_US), 12.99)
+        self.assertEqual(parse_price("1,234.50", Store.LOCALE_US), 1234.5)
+        self.assertEqual(parse_price("1,234", Store.LOCALE_US), 1234)
+        self.assertEqual(parse_price("1,234,567.89", Store.LOCALE_US), 1234567.89)
+
+    def test_unambiguous_decimals_ignore_locale(self):
+        self.assertEqual(parse_price("12.99", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("12,99", Store.LOCALE_US), 12.99)
+        self.assertEqual(parse_price("1,234.50", Store.LOCALE_EU), 1234.5)
+
+    def test_currency_symbols_and_codes(self):
+        self.assertEqual(parse_price("€ 12,99", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("12,99 €", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("EUR 1.234,50", Store.LOCALE_EU), 1234.5)
+        self.assertEqual(parse_price("$1,299.00", Store.LOCALE_US), 1299)
+        self.assertEqual(parse_price("£29.99 GBP", Store.LOCALE_US), 29.99)
+        self.assertEqual(parse_price("AU$ 45.95", Store.LOCALE_US), 45.95)
+        self.assertEqual(parse_price("\n\t  € 12,99\xa0IVA inclusa ", Store.LOCALE_EU), 12.99)
+
+    def test_ranges_and_prefixes(self):
+        self.assertEqual(parse_price("from €12,99", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("Da 12,99 €", Store.LOCALE_EU), 12.99)
+        self.assertEqual(parse_price("$10.00 - $12.00", Store.LOCALE_US), 10)
+        self.assertEqual(parse_price("12,99 € – 15,99 €", Store.LOCALE_EU), 12.99)
+
+    def test_integer_prices(self):
+        self.assertEqual(parse_price("€ 35", Store.LOCALE_EU), 35)
+        self.assertEqual(parse_price("$1299", Store.LOCALE_US), 1299)
+
+    def test_no_price(self):
+        self.assertIsNone(parse_price("Esaurito", Store.LOCALE_EU))
+        self.assertIsNone(parse_price("", Store.LOCALE_EU))
+        self.assertIsNone(parse_price(None, Store.LOCALE_EU))
+
+    def test_batch(self):
+        self.assertEqual(
+            parse_prices(["€ 12,99", "1.234,50", "n/a", "from €5"], Store.LOCALE_EU),
+            [12.99, 1234.5, None, 5],
+        )
+        self.assertEqual(parse_prices([], Store.LOCALE_US), [])
+
+
+class StructuredProductTest(SimpleTestCase):
+    FIELDS = ["name", "price", "image", "is_available", "description"]
+
+    def test_json_ld(self):
+        soup = BeautifulSoup(
+            """<script type="application/ld+json">{
+                "@context": "https://schema.org", "@type": "Product", "name": "ESC 45A",
+                "image": ["https://cdn.x/esc.jpg"],
+                "offers": {"@type": "Offer", "price": "39.90", "priceCurrency": "EUR",
+                           "availability": "https://schema.org/InStock"}
+            }</script>""",
+            "html.parser",
+        )
+        self.assertEqual(structured_product(soup, self.FIELDS), {
+            "name": "ESC 45A",
+            "image": "https://cdn.x/esc.jpg",
+            "price": 39.9,
+            "currency": "EUR",
+            "is_available": True,
+        })
+
+    def test_json_ld_is_unescaped_and_currency_checked(self):
+        soup = BeautifulSoup(
+            """<script type="application/ld+json">{"@type": "Product", "name": "Props 5&#8243;",
+                "offers": {"price": "3.99", "priceCurrency": "EURO"}}</script>""",
+            "html.parser",
+        )
+        self.assertEqual(structured_product(soup, self.FIELDS), {"name": "Props 5\u2032\u2032", "price": 3.99})
+
+    def test_json_ld_variants(self):
+        soup = BeautifulSoup(
+            """<script type="application/ld+json">{"@type": "Product", "name": "Frame", "offers": [
+                {"price": "59", "priceCurrency": "EUR", "availability": "OutOfStock"},
+                {"price": "49", "priceCurrency": "eur", "availability": "OutOfStock"},
+                {"price": "69", "priceCurrency": "EUR", "availability": "InStock"}
+            ]}</script>""",
+            "html.parser",
+        )
+        self.assertEqual(
+            structured_product(soup, self.FIELDS),
+            {"name": "Frame", "price": 49, "currency": "EUR", "is_available": True},
+        )
+
+    @override_settings(SCRAPER_STRUCTURED_DATA=True)
+    def test_name_selector_is_kept(self):
+        html = """<h1 class="title">ESC 45A (V2)</h1><script type="application/ld+json">{
+            "@type": "Product", "name": "ESC 45A", "offers": {"price": "39.90", "priceCurrency": "EUR"}
+        }</script>"""
+        store = Store(
+            website="https://shop.example", currency="EUR", scrape_with_js=False,
+            product_name_tag="h1", product_name_class="title", product_name_css_is_class=True,
+        )
+        with mock.patch("scraper.simple.fetch_page", return_value=(html, Validators())):
+            data = scrape_product("https://shop.example/esc", store, ["name", "price"])
+        self.assertEqual((data["name"], data["price"]), ("ESC 45A (V2)", 39.9))
+
+    @override_settings(SCRAPER_STRUCTURED_DATA=True, SCRAPER_PARTIAL_PARSING=True)
+    def test_read_once_per_page(self):
+        html = """<html><body><h1 class="title">ESC 45A</h1><script type="application/ld+json">{
+            "@type": "Product", "name": "ESC 45A", "offers": {"price": "39.90", "priceCurrency": "EUR"}
+        }</script></body></html>"""
+        store = Store(website="https://shop.example", currency="EUR", scrape_with_js=False)
+        with mock.patch("scraper.simple.fetch_page", return_value=(html, Validators())), \
+                mock.patch("scraper.simple.structured_product", wraps=structured_product) as read:
+            data = scrape_product("https://shop.example/esc", store, ["name", "price"])
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual((data["name"], data["price"], data["currency"]), ("ESC 45A", 39.9, "EUR"))
+
+    def test_json_ld_graph_and_lists(self):
+        soup = BeautifulSoup(
+            """<script type="application/ld+json">{"@graph": [
+                {"@type": "BreadcrumbList"},
+                {"@type": ["Product"], "name": "Motor 2207",
+                 "offers": [{"@type": "AggregateOffer", "lowPrice": 18, "availability": "OutOfStock"}]}
+            ]}</script>""",
+            "html.parser",
+        )
+        self.assertEqual(
+            structured_product(soup, ["name", "price", "is_available"]),
+            {"name": "Motor 2207", "price": 18.0, "is_available": False},
+        )
+
+    def test_microdata(self):
+        soup = BeautifulSoup(
+            """<div itemscope itemtype="https://schema.org/Product">
+                <h1 itemprop="name"> Frame 5" </h1>
+                <div itemprop="offers" itemscope itemtype="https://schema.org/Offer">
+                    <meta itemprop="priceCurrency" content="USD">
+                    <span itemprop="price" content="59.00">$59</span>
+                    <link itemprop="availability" href="https://schema.org/InStock">
+                </div>
+            </div>""",
+            "html.parser",
+        )
+        self.assertEqual(structured_product(soup, self.FIELDS), {
+            "name": 'Frame 5"', "price": 59.0, "currency": "USD", "is_available": True,
+        })
+
+    def test_only_requested_fields(self):
+        soup = BeautifulSoup(
+            '<script type="application/ld+json">{"@type": "Product", "name": "X", '
+            '"offers": {"price": 1, "priceCurrency": "EUR"}}</script>',
+            "html.parser",
+        )
+        self.assertEqual(structured_product(soup, ["name"]), {"name": "X"})
+        self.assertEqual(structured_product(soup, ["variations"]), {})
+
+    def test_invalid_or_missing(self):
+        soup = BeautifulSoup(
+            '<script type="application/ld+json">{not json</script>'
+            '<script type="application/ld+json">{"@type": "Organization", "name": "Shop"}</script>',
+            "html.parser",
+        )
+        self.assertEqual(structured_product(soup, self.FIELDS), {})
+
+
+SHOPIFY_PRODUCTS = [
+    {
+        "title": "Motor 2207",
+        "handle": "motor-2207",
+        "body_html": "<p>A <b>fast</b> motor</p>",
+        "images": [{"src": "https://cdn.shopify.com/motor.jpg"}],
+        "variants": [
+            {"price": "24.90", "available": False},
+            {"price": "21.50", "available": True},
+        ],
+    },
+    {
+        "title": "ESC 45A",
+        "handle": "esc-45a",
+        "body_html": "",
+        "images": [],
+        "variants": [{"price": "39.00", "available": False}, {"price": "35.00", "available": False}],
+    },
+    {"title": "Frame", "handle": "frame", "variants": [{"price": "59.00", "available": True}]},
+]
+
+WOOCOMMERCE_PRODUCTS = [
+    {
+        "name": "Props 5&#8243;",
+        "permalink": "https://shop.example/product/props/",
+        "short_description": "<p>Tri-blade</p>",
+        "images": [{"src": "https://shop.example/props.jpg"}],
+        "prices": {"price": "399", "currency_code": "GBP", "currency_minor_unit": 2},
+        "is_in_stock": True,
+    },
+    {
+        "name": "Goggles",
+        "permalink": "https://shop.example/product/goggles/",
+        "prices": {"price": "45900", "currency_code": "GBP", "currency_minor_unit": 2},
+        "is_in_stock": False,
+    },
+]
+
+
+class FakeStoreHandler(BaseHTTPRequestHandler):
+    """Serve the catalogs of a Shopify and a WooCommerce store, paginated like the real ones"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: int(values[0]) for key, values in parse_qs(url.query).items()}
+        if url.path == "/products.json":
+            products, size = SHOPIFY_PRODUCTS, params["limit"]
+        elif url.path == "/wp-json/wc/store/v1/products":
+            products, size = WOOCOMMERCE_PRODUCTS, params["per_page"]
+        else:
+            self.send_error(404)
+            return
+
+        start = (params["page"] - 1) * size
+        page = products[start:start + size]
+        body = json.dumps({"products": page} if url.path == "/products.json" else page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PlatformAdapterTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("localhost", 0), FakeStoreHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def store(self, platform):
+        return Store(
+            id=1000,
+            name="Fake",
+            website=f"http://localhost:{self.server.server_port}/",
+            currency="EUR",
+            platform=platform,
+            requests_per_second=1000,
+            requests_burst=1000,
+        )
+
+    def test_shopify(self):
+        adapter = get_adapter(self.store(Store.PLATFORM_SHOPIFY))
+        adapter.page_size = 2
+        products = list(adapter.iter_products())
+
+        self.assertEqual([product["name"] for product in products], ["Motor 2207", "ESC 45A", "Frame"])
+        self.assertEqual(products[0], {
+            "name": "Motor 2207",
+            "price": 21.5,
+            "currency": "EUR",
+            "is_available": True,
+            "description": "A fast motor",
+            "link": f"http://localhost:{self.server.server_port}/products/motor-2207",
+            "image": "https://cdn.shopify.com/motor.jpg",
+        })
+        self.assertFalse(products[1]["is_available"])
+        self.assertEqual(products[1]["price"], 35)
+        self.assertNotIn("image", products[1])
+
+    def test_woocommerce(self):
+        products = list(get_adapter(self.store(Store.PLATFORM_WOOCOMMERCE)).iter_products())
+
+        self.assertEqual(products[0], {
+            "name": "Props 5\u2033",
+            "price": 3.99,
+            "currency": "GBP",
+            "is_available": True,
+            "description": "Tri-blade",
+            "link": "https://shop.example/product/props/",
+            "image": "https://shop.example/props.jpg",
+        })
+        self.assertEqual(products[1]["price"], 459)
+        self.assertFalse(products[1]["is_available"])
+
+    def test_missing_catalog(self):
+        store = self.store(Store.PLATFORM_SHOPIFY)
+        store.website += "not-a-shop/"
+        self.assertEqual(list(get_adapter(store).iter_products()), [])
+
+    def test_no_platform(self):
+        self.assertIsNone(get_adapter(self.store(None)))
+
+
+SITEMAP_INDEX = """<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>{root}/sitemap-products.xml</loc></sitemap>
+  <sitemap><loc>{root}/sitemap-more.xml</loc></sitemap>
+</sitemapindex>"""
+
+# Shopify and Yoast list the images of a product in its <url>, with their own <loc>
+SITEMAP_PRODUCTS = """<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url>
+    <loc>{root}/products/motor</loc><lastmod>2021-11-02</lastmod>
+    <image:image><image:loc>https://cdn.shopify.com/motor.jpg</image:loc></image:image>
+  </url>
+  <url><loc>{root}/products/frame</loc></url>
+</urlset>"""
+
+
+class FakeSitemapHandler(BaseHTTPRequestHandler):
+    """Serve a sitemap index whose second sitemap is cut when truncated is set"""
+
+    truncated = False
+
+    def do_GET(self):
+        root = f"http://localhost:{self.server.server_port}"
+        if self.path == "/sitemap.xml":
+            body = SITEMAP_INDEX.format(root=root).encode()
+        elif self.path == "/sitemap-products.xml":
+            body = SITEMAP_PRODUCTS.format(root=root).encode()
+        elif self.path == "/sitemap-more.xml":
+            body = SITEMAP_PRODUCTS.replace("motor", "esc").replace("frame", "props").format(root=root).encode()
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path == "/sitemap-more.xml" and self.truncated:
+            # The connection is dropped in the middle of the sitemap
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SitemapTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("localhost", 0), FakeSitemapHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def tearDown(self):
+        FakeSitemapHandler.truncated = False
+
+    def store(self):
+        root = f"http://localhost:{self.server.server_port}"
+        return Store(
+            id=1001,
+            name="Fake",
+            website=f"{root}/",
+            sitemap_url=f"{root}/sitemap.xml",
+            sitemap_product_pattern="/products/",
+            requests_per_second=1000,
+            requests_burst=1000,
+        )
+
+    def read(self):
+        chunks = []
+
+        def select(entries):
+            chunks.append(len(entries))
+            return [urlparse(entry.loc).path for entry in entries if "motor" not in entry.loc]
+
+        urls, listed, complete = read_sitemap(self.store(), select)
+        return urls, listed, complete, chunks
+
+    def test_read_sitemap(self):
+        urls, listed, complete, _ = self.read()
+        self.assertTrue(complete)
+        self.assertEqual(listed, 4)
+        self.assertEqual(sorted(urls), ["/products/esc", "/products/frame", "/products/props"])
+
+    def test_image_locations_are_ignored(self):
+        store = self.store()
+        store.sitemap_product_pattern = ""
+        urls, _, _ = read_sitemap(store, lambda entries: [entry.loc for entry in entries])
+        self.assertEqual(
+            sorted(urlparse(url).path for url in urls),
+            ["/products/esc", "/products/frame", "/products/motor", "/products/props"],
+        )
+
+    @override_settings(SCRAPER_SITEMAP_CHUNK_SIZE=1)
+    def test_entries_are_selected_by_chunks(self):
+        urls, listed, _, chunks = self.read()
+        self.assertEqual((len(urls), listed, chunks), (3, 4, [1, 1, 1, 1]))
+
+    def test_dropped_connection_is_incomplete(self):
+        FakeSitemapHandler.truncated = True
+        urls, _, complete, _ = self.read()
+        self.assertFalse(complete)
+        self.assertIn("/products/frame", urls)
+
+
+class FeedTest(SimpleTestCase):
+    RSS = b"""<?xml version="1.0"?>
+    <rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">
+      <channel>
+        <title>The store</title>
+        <link>https://shop.example</link>
+        <item>
+          <title>Motor 2207 - Black</title>
+          <g:title>Motor 2207</g:title>
+          <link>https://shop.example/motor</link>
+          <g:price>24.90 EUR</g:price>
+          <g:sale_price>19.90 EUR</g:sale_price>
+          <g:availability>in stock</g:availability>
+          <g:image_link>https://shop.example/motor.jpg</g:image_link>
+          <g:shipping><g:country>IT</g:country><g:price>4.90 EUR</g:price></g:shipping>
+        </item>
+        <item>
+          <g:title>ESC 45A</g:title>
+          <g:link>https://shop.example/esc</g:link>
+          <g:price>1,299.00 USD</g:price>
+          <g:availability>out_of_stock</g:availability>
+        </item>
+      </channel>
+    </rss>"""
+
+    def test_xml(self):
+        store = Store(currency="EUR")
+        products = [feed_product(item, store) for item in iter_xml_items(io.BytesIO(self.RSS))]
+        self.assertEqual(products, [
+            {
+                "name": "Motor 2207",
+                "price": 19.9,
+                "currency": "EUR",
+                "is_available": True,
+                "image": "https://shop.example/motor.jpg",
+                "description": "",
+                "link": "https://shop.example/motor",
+            },
+            {
+                "name": "ESC 45A",
+                "price": 1299,
+                "currency": "USD",
+                "is_available": False,
+                "image": None,
+                "description": "",
+                "link": "https://shop.example/esc",
+            },
+        ])
+
+    def test_csv(self):
+        feed = io.BytesIO(
+            "id\ttitle\tlink\tprice\tavailability\tdescription\n"
+            "1\tFrame 5\"\thttps://shop.example/frame\t59.00\tpreorder\tCarbon frame\n".encode()
+        )
+        items = list(iter_csv_items(feed))
+        self.assertEqual(items[0]["title"], 'Frame 5"')
+        product = feed_product(items[0], Store(currency="GBP"))
+        self.assertEqual((product["price"], product["currency"], product["is_available"]), (59, "GBP", True))
+
+    def test_items_without_title_or_price(self):
+        store = Store(currency="EUR")
+        self.assertIsNone(feed_product({"title": "X", "price": ""}, store))
+        self.assertIsNone(feed_product({"price": "1.00 EUR"}, store))
+
+
+class ProductFingerprintTest(SimpleTestCase):
+    product = {"name": "Motor 2207", "price": 19.9, "currency": "EUR", "is_available": True}
+
+    def test_page_validators_are_ignored(self):
+        self.assertEqual(
+            product_fingerprint({**self.product, "etag": "a", "variations": []}, None),
+            product_fingerprint({**self.product, "etag": "b"}, None),
+        )
+
+    def test_scraped_fields_and_query(self):
+        fingerprint = product_fingerprint(self.product, None)
+        self.assertNotEqual(fingerprint, product_fingerprint({**self.product, "price": 17.9}, None))
+        self.assertNotEqual(fingerprint, product_fingerprint({**self.product, "is_available": False}, None))
+        self.assertNotEqual(fingerprint, product_fingerprint(self.product, ImportQuery(id=1)))
+
+
+@override_settings(
+    SCRAPER_REFRESH_MIN_INTERVAL=60 * 60,
+    SCRAPER_REFRESH_MAX_INTERVAL=24 * 60 * 60,
+    SCRAPER_REFRESH_VOLATILITY_WEIGHT=10,
+)
+class RefreshIntervalTest(SimpleTestCase):
+
+    def test_quiet_product_waits_the_longest(self):
+        self.assertEqual(refresh_interval(0, 0, None), timedelta(days=1))
+        self.assertEqual(refresh_interval(0, 0, 0), timedelta(days=1))
+
+    def test_signals_shorten_the_interval(self):
+        quiet = refresh_interval(0, 0, 0)
+        self.assertLess(refresh_interval(0.5, 0, 0), quiet)
+        self.assertLess(refresh_interval(0, 3, 0), quiet)
+        self.assertLess(refresh_interval(0, 0, 2), quiet)
+        self.assertLess(refresh_interval(0.5, 3, 2), refresh_interval(0.5, 3, 0))
+
+    def test_minimum_interval(self):
+        self.assertEqual(refresh_interval(1, 10000, 2), timedelta(hours=1))
+
+
+def create_store(**kwargs) -> Store:
+    return Store.objects.create(
+        **{
+            "name": "Test store",
+            "website": "https://shop.example",
+            "search_url": "https://shop.example/search",
+            "is_scrapable": True,
+            **kwargs,
+        }
+    )
+
+
+class RefreshStoreProductsTest(TestCase):
+    refreshed = {"price": 9.5, "currency": "EUR", "is_available": False}
+
+    def setUp(self):
+        self.store = create_store()
+        for product_id, link in (("a1", "https://shop.example/a"), ("a2", "https://shop.example/a"),
+                                 ("b1", "https://shop.example/b")):
+            Product.objects.create(
+                id=product_id, name=product_id, description="", price=10, link=link, store=self.store
+            )
+
+    def refresh(self, product_ids=None):
+        with mock.patch("search.helpers.scrape_product", return_value=dict(self.refreshed)):
+            refresh_store_products(self.store, product_ids)
+
+    def test_every_refreshed_product_is_scheduled(self):
+        self.refresh()
+        for product in Product.objects.all():
+            self.assertEqual((product.price, product.is_available), (9.5, False))
+            self.assertIsNotNone(product.next_refresh_at, product.id)
+            self.assertGreaterEqual(
+                product.next_refresh_at,
+                product.last_seen + timedelta(seconds=settings.SCRAPER_REFRESH_MIN_INTERVAL),
+            )
+
+    def test_timeout_skips_the_page(self):
+        with mock.patch("search.helpers.scrape_product", side_effect=ReadTimeout("read timed out")):
+            refresh_store_products(self.store)
+        self.assertEqual(Product.objects.filter(is_active=True).count(), 3)
+        self.assertIsNotNone(Product.objects.get(id="a1").next_refresh_at)
+
+    def test_batch_of_due_products_replaces_their_lease(self):
+        lease = timezone.now() + timedelta(seconds=settings.SCRAPER_REFRESH_LEASE)
+        Product.objects.update(next_refresh_at=lease)
+        self.refresh(["a2", "b1"])
+        next_refresh = dict(Product.objects.values_list("id", "next_refresh_at"))
+        self.assertEqual(next_refresh["a1"], lease)
+        self.assertGreater(next_refresh["a2"], lease)
+        self.assertGreater(next_refresh["b1"], lease)
+
+
+class ReImportChunkTest(TestCase):
+    def setUp(self):
+        self.store = create_store()
+        self.product = Product.objects.create(
+            id="a1", name="a1", description="", price=10, link="https://shop.example/a", store=self.store
+        )
+
+    def re_import(self, error):
+        with mock.patch("search.helpers.import_product", side_effect=error):
+            return re_import_chunk(self.store, [self.product], mock.Mock())
+
+    def test_timeout_keeps_the_product(self):
+        self.assertEqual(self.re_import(ReadTimeout("read timed out")), 0)
+        self.assertTrue(Product.objects.get(id="a1").is_active)
+
+    def test_unreachable_page_deactivates_the_product(self):
+        self.re_import(ConnectionError("connection refused"))
+        self.assertFalse(Product.objects.get(id="a1").is_active)
+
+
+class ReImportRunTest(TransactionTestCase):
+    def setUp(self):
+        self.store = create_store()
+
+    def test_running_run_is_not_resumed(self):
+        run = ReImportRun.start_or_resume(self.store)
+        self.assertIsNotNone(run)
+        self.assertIsNone(ReImportRun.start_or_resume(self.store))
+
+        ReImportRun.objects.update(started_at=timezone.now() - timedelta(seconds=settings.SCRAPER_REIMPORT_RUN_STALE))
+        self.assertEqual(ReImportRun.start_or_resume(self.store), run)
+        self.assertIsNone(ReImportRun.start_or_resume(self.store))
+
+    def test_concurrent_starts_create_one_run(self):
+        count = ReImportRun.products
+
+        def slow_products(run):
+            products = count(run)
+            products.count = lambda: time.sleep(0.3) or 0
+            return products
+
+        runs = []
+
+        def start():
+            try:
+                runs.append(ReImportRun.start_or_resume(self.store))
+            finally:
+                connection.close()
+
+        with mock.patch.object(ReImportRun, "products", slow_products):
+            threads = [threading.Thread(target=start) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(ReImportRun.objects.filter(store=self.store).count(), 1)
+        self.assertEqual(sum(run is not None for run in runs), 1)
+
+
+@override_settings(SCRAPER_DISCOVERY_MIN_NOVELTY=0.5, SCRAPER_DISCOVERY_MAX_PAGES=8)
+class DiscoveryTest(TestCase):
+    def setUp(self):
+        self.store = create_store()
+        self.query = ImportQuery.objects.create(text="esc")
+        for n in range(3):
+            Product.objects.create(
+                id=f"known{n}", name=f"known{n}", description="", price=10,
+                link=f"https://shop.example/known{n}", store=self.store,
+            )
+
+    def page(self, new, known=0):
+        return [f"https://shop.example/new{len(self.pages)}-{n}" for n in range(new)] + [
+            f"https://shop.example/known{n}" for n in range(known)
+        ]
+
+    def search(self, *pages, max_pages=None):
+        if max_pages:
+            SearchDepth.objects.create(store=self.store, query=self.query, max_pages=max_pages)
+        discovery = Discovery(self.store, self.query)
+        self.pages, paging = [], []
+        for new, known in pages:
+            urls = self.page(new, known)
+            self.pages.append(urls)
+            paging.append(discovery.keep_paging(urls))
+            if not paging[-1]:
+                break
+        discovery.finish()
+        return paging, SearchDepth.objects.get(store=self.store, query=self.query)
+
+    def test_known_products_stop_paging(self):
+        paging, depth = self.search((4, 0), (1, 3), (4, 0))
+        self.assertEqual(paging, [True, False])
+        self.assertEqual((depth.max_pages, depth.last_pages, depth.last_novelty), (2, 2, 0.25))
+
+    def test_new_products_on_the_last_page_double_the_depth(self):
+        paging, depth = self.search((4, 0), (4, 0), (4, 0), max_pages=2)
+        self.assertEqual(paging, [True, False])
+        self.assertEqual(depth.max_pages, 4)
+
+    def test_depth_is_capped(self):
+        paging, depth = self.search(*[(4, 0)] * 6, max_pages=6)
+        self.assertEqual(paging[-1], False)
+        self.assertEqual(depth.max_pages, 8)
+
+    def test_results_ending_early_keep_one_page_of_margin(self):
+        _, depth = self.search((4, 0), (4, 0))
+        self.assertEqual((depth.max_pages, depth.last_pages), (3, 2))
+
+
+class ImportStoreSitemapTest(TestCase):
+    def setUp(self):
+        self.store = create_store(sitemap_url="https://shop.example/sitemap.xml")
+        self.entries = [SitemapEntry("https://shop.example/a", None), SitemapEntry("https://shop.example/b", None)]
+
+    def import_sitemap(self, complete):
+        def read_sitemap(store, select, since=None):
+            return select(self.entries), len(self.entries), complete
+
+        with mock.patch("search.helpers.read_sitemap", read_sitemap), \
+                mock.patch("search.helpers.import_product") as import_product:
+            import_store_sitemap(self.store.id)
+        self.store.refresh_from_db()
+        return [call.args[0] for call in import_product.call_args_list]
+
+    def test_only_new_pages_are_imported(self):
+        Product.objects.create(
+            id="a1", name="a1", description="", price=10, link="https://shop.example/a", store=self.store
+        )
+        self.assertEqual(self.import_sitemap(complete=True), ["https://shop.example/b"])
+        self.assertIsNotNone(self.store.sitemap_checked_at)
+
+    def test_incomplete_read_is_not_checked(self):
+        self.assertEqual(len(self.import_sitemap(complete=False)), 2)
+        self.assertIsNone(self.store.sitemap_checked_at)
+        self.assertIsNotNone(self.store.last_check)
+
+
+class ProductWriterTest(TestCase):
+    def setUp(self):
+        self.store = create_store()
+
+    def product(self, name, price=10, **kwargs):
+        return {"name": name, "description": "", "price": price, "link": f"https://shop.example/{name}", **kwargs}
+
+    def write(self, *products):
+        with ProductWriter(self.store) as writer:
+            for data in products:
+                writer.add(data, None)
+        return writer
+
+    def test_created_changed_and_unchanged(self):
+        writer = self.write(self.product("motor"), self.product("frame"))
+        self.assertEqual((writer.created, writer.changed, writer.unchanged), (2, 0, 0))
+
+        writer = self.write(self.product("motor"), self.product("frame", price=8), self.product("esc"))
+        self.assertEqual((writer.created, writer.changed, writer.unchanged), (1, 1, 1))
+        self.assertEqual(writer.report(), "3 products, 1 new, 1 changed, 1 unchanged")
+
+        frame = Product.objects.get(name="frame")
+        self.assertEqual(frame.price, 8)
+        self.assertGreater(frame.volatility, 0)
+        self.assertEqual(Product.objects.get(name="motor").volatility, 0)
+
+    def test_touch_only_sets_last_seen_and_validators(self):
+        self.write(self.product("motor", etag="v1"))
+        before = Product.objects.get(name="motor")
+        Product.objects.filter(id=before.id).update(description="Edited")
+
+        writer = self.write(self.product("motor", etag="v2"))
+        self.assertEqual(writer.unchanged, 1)
+        after = Product.objects.get(id=before.id)
+        self.assertEqual((after.name, after.description, after.import_date), ("motor", "Edited", before.import_date))
+        self.assertEqual(after.etag, "v2")
+        self.assertGreater(after.last_seen, before.last_seen)
+
+    def test_broken_batch_is_saved_one_by_one(self):
+        # A NULL description breaks the batch, the other product is still saved
+        writer = self.write(self.product("motor"), self.product("frame", description=None))
+        self.assertEqual(writer.created, 1)
+        self.assertEqual(list(Product.objects.values_list("name", flat=True)), ["motor"])
+
+
+class RefreshWriterTest(TestCase):
+    def setUp(self):
+        self.store = create_store()
+        for product_id in ("a1", "b1"):
+            Product.objects.create(
+                id=product_id, name=product_id, description="", price=10, currency="EUR",
+                link=f"https://shop.example/{product_id}", store=self.store, fingerprint="scraped",
+            )
+
+    def test_refresh(self):
+        with RefreshWriter(self.store) as writer:
+            writer.add({"price": 9, "currency": "EUR", "is_available": True}, ["a1"])
+            # A field that was not found keeps its value
+            writer.add({"price": 10, "currency": None, "is_available": True}, ["b1"])
+        self.assertEqual((writer.written, writer.changed, writer.unchanged), (2, 1, 1))
+
+        products = {product.id: product for product in Product.objects.all()}
+        self.assertEqual((products["a1"].price, products["a1"].fingerprint), (9, None))
+        self.assertEqual((products["b1"].currency, products["b1"].fingerprint), ("EUR", "scraped"))
+        self.assertIsNotNone(products["b1"].last_seen)
+        self.assertGreater(products["a1"].volatility, products["b1"].volatility)
+
+
+class LocalTokenBucketTest(SimpleTestCase):
+    def test_reserve(self):
+        bucket = throttle.LocalTokenBucket()
+        delays = [bucket.reserve("shop", rate=2, burst=2, now=100) for _ in range(4)]
+        self.assertEqual(delays, [0, 0, 0.5, 1])
+        # Refilled at the rate, never above the burst
+        self.assertEqual(bucket.reserve("shop", rate=2, burst=2, now=101), 0.5)
+        self.assertEqual(bucket.reserve("other", rate=2, burst=2, now=102.5), 0)
+
+
+class BrokenRedis:
+    """A client whose server cannot be reached"""
+
+    def register_script(self, script):
+        def call(keys, args):
+            raise RedisError("Connection refused")
+        return call
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            raise RedisError("Connection refused")
+        return call
+
+
+class RedisFallbackTest(SimpleTestCase):
+    def setUp(self):
+        for module in (throttle, runs, slots):
+            patcher = mock.patch.multiple(module, _script=None, get_redis=BrokenRedis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_throttle_is_local(self):
+        store = Store(website="https://broken.example", requests_per_second=1, requests_burst=1)
+        with mock.patch.object(throttle, "local_buckets", throttle.LocalTokenBucket()):
+            self.assertEqual(throttle.reserve(store), 0)
+            self.assertGreater(throttle.reserve(store), 0)
+
+    def test_every_url_is_claimed(self):
+        run = runs.ImportRun("broken", 1)
+        query = ImportQuery(id=1, priority_score=1)
+        self.assertEqual(run.claim("https://shop.example/a", query), runs.CLAIMED)
+        self.assertEqual(run.claim("https://shop.example/a", query), runs.CLAIMED)
+        self.assertEqual(run.owners(["https://shop.example/a"]), {})
+
+    def test_slot_is_granted(self):
+        self.assertTrue(slots.StoreSlot(Store(id=1, max_concurrent_fetches=1)).acquire())
+
+
+class RedisScriptsTest(SimpleTestCase):
+    """The Lua scripts, run by the Redis server of the settings"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        try:
+            get_redis().ping()
+        except RedisError:
+            raise unittest.SkipTest("Redis is unreachable")
+
+    def setUp(self):
+        self.run_id = uuid.uuid4().hex
+        for module in (throttle, runs, slots):
+            patcher = mock.patch.object(module, "_script", None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        store = Store(website=f"https://{self.run_id}.example", requests_per_second=2, requests_burst=2)
+        self.addCleanup(get_redis().delete, throttle.throttle_key(store))
+        with mock.patch("scraper.throttle.time.time", return_value=100):
+            self.assertEqual([throttle.reserve(store) for _ in range(4)], [0, 0, 0.5, 1])
+        with mock.patch("scraper.throttle.time.time", return_value=101):
+            self.assertEqual(throttle.reserve(store), 0.5)
+
+    def test_claim(self):
+        run = runs.ImportRun(self.run_id, 1)
+        self.addCleanup(get_redis().delete, run.key)
+        url = "https://shop.example/a"
+        low, high = ImportQuery(id=1, priority_score=1), ImportQuery(id=2, priority_score=2.5)
+
+        self.assertEqual(run.claim(url, low), runs.CLAIMED)
+        self.assertEqual(run.claim(url, low), runs.ALREADY_CLAIMED)
+        self.assertEqual(run.claim(url, high), runs.TAKEN_OVER)
+        self.assertEqual(run.claim(url, low), runs.ALREADY_CLAIMED)
+        self.assertEqual(run.owner(url), 2)
+        self.assertEqual(run.owners([url, "https://shop.example/b"]), {url: 2})
+        self.assertGreater(get_redis().ttl(run.key), 0)
+
+    def test_store_slots(self):
+        store = Store(id=int(time.time() * 1000), name="Fake", max_concurrent_fetches=2)
+        first, second, third = slots.StoreSlot(store), slots.StoreSlot(store), slots.StoreSlot(store)
+        self.addCleanup(get_redis().delete, first.key)
+
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.acquire())
+        self.assertFalse(third.acquire())
+        # A holder renews its own slot
+        self.assertTrue(first.acquire())
+
+        first.release()
+        self.assertTrue(third.acquire())
+
+    @override_settings(SCRAPER_STORE_SLOT_TTL=0.5)
+    def test_expired_slot_is_freed(self):
+        store = Store(id=int(time.time() * 1000) + 1, name="Fake", max_concurrent_fetches=1)
+        dead = slots.StoreSlot(store)
+        self.addCleanup(get_redis().delete, dead.key)
+
+        self.assertTrue(dead.acquire())
+        self.assertFalse(slots.StoreSlot(store).acquire())
+        time.sleep(0.6)
+        self.assertTrue(slots.StoreSlot(store).acquire())
+
+
+PRODUCT_PAGE = """<html><body>
+<div class="product main">
+  <h1 class="title">ESC &amp; BEC 45A</h1>
+  <span id="price">39.90 EUR</span>
+  <div class="gallery"><img data-src="/img/esc.jpg" src="/img/placeholder.gif"></div>
+  <p class="stock">In stock</p>
+</div>
+<div itemscope itemtype="https://schema.org/Product">
+  <meta itemprop="name" content="ESC 45A"><span itemprop="description"> A fast ESC </span>
+  <meta itemprop="price" content="39.90"><meta itemprop="priceCurrency" content="EUR">
+  <link itemprop="availability" href="https://schema.org/InStock">
+</div>
+<script type="application/ld+json">{"@type": "Product", "name": "ESC 45A", "image": "https://cdn.x/esc.jpg"}</script>
+</body></html>"""
+
+SEARCH_PAGE = """<html><body><ul>
+<li class="result item"><div class="name">ESC</div><a href="/products/esc">ESC</a></li>
+<li class="result"><a class="name" href="https://shop.example/products/motor">Motor</a></li>
+<li class="ad"><a class="name" href="/ads/1">Ad</a></li>
+</ul></body></html>"""
+
+
+class ParserBackendTest(SimpleTestCase):
+    """Every backend gives the same products and results, selectolax through its BeautifulSoup shim"""
+
+    FIELDS = ["name", "price", "image", "is_available", "description"]
+
+    def setUp(self):
+        self.store = Store(
+            website="https://shop.example", currency="EUR", locale="en_US",
+            product_name_tag="h1", product_name_class="title", product_name_css_is_class=True,
+            product_price_tag="span", product_price_class="price", product_price_css_is_class=False,
+            product_image_tag="div", product_image_class="gallery", product_image_css_is_class=True,
+            product_is_available_tag="p", product_is_available_class="stock",
+            product_is_available_css_is_class=True, product_is_available_match="in stock",
+            search_tag="li", search_class="result", search_link="name",
+        )
+
+    def backends(self):
+        for backend, _ in PARSERS:
+            try:
+                parse_html("<p></p>", backend)
+            except ImportError:
+                continue
+            yield backend
+
+    def scrape(self, backend):
+        product_soup, search_soup = parse_html(PRODUCT_PAGE, backend), parse_html(SEARCH_PAGE, backend)
+        return (
+            extract_product(product_soup, "https://shop.example/esc", self.store, self.FIELDS, structured_data={}),
+            extract_search_results(search_soup, self.store),
+            structured_product(product_soup, self.FIELDS),
+        )
+
+    def test_backends_agree(self):
+        expected = self.scrape("html.parser")
+        self.assertEqual(expected, (
+            {
+                "name": "ESC & BEC 45A",
+                "price": 39.9,
+                "currency": "EUR",
+                "image": "https://shop.example/img/esc.jpg",
+                "is_available": True,
+                "link": "https://shop.example/esc",
+            },
+            ["https://shop.example/products/esc", "https://shop.example/products/motor"],
+            {"name": "ESC 45A", "image": "https://cdn.x/esc.jpg"},
+        ))
+        for backend in self.backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(self.scrape(backend), expected)
+
+    def test_microdata(self):
+        page = PRODUCT_PAGE.replace("application/ld+json", "text/plain")
+        for backend in self.backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(structured_product(parse_html(page, backend), self.FIELDS), {
+                    "name": "ESC 45A",
+                    "description": "A fast ESC",
+                    "price": 39.9,
+                    "currency": "EUR",
+                    "is_available": True,
+                })
+
+
+class SearchConcurrentlyTest(SimpleTestCase):
+    def setUp(self):
+        self.store = Store(
+            id=4243, website="https://shop.example", search_url="https://shop.example/search?q=",
+            search_tag="li", search_class="result", search_link="name",
+            search_page_param="page", search_prefetch_pages=True, connection_pool_size=3, requests_burst=3,
+        )
+        self.addCleanup(invalidate_plan, self.store.id)
+        self.requested = []
+
+    def get_search_soup(self, url, config):
+        page = int(parse_qs(urlparse(url).query).get("page", ["1"])[0])
+        self.requested.append(page)
+        # The first pages answer last
+        time.sleep(0.05 * max(4 - page, 0))
+        if page == 4:
+            return BeautifulSoup("<ul></ul>", "html.parser")
+        return BeautifulSoup(
+            "".join(f'<li class="result"><a class="name" href="/p{page}-{n}">P</a></li>' for n in (1, 2)),
+            "html.parser",
+        )
+
+    def test_pages_in_order_until_the_first_empty_one(self):
+        with mock.patch("scraper.simple.get_search_soup", side_effect=self.get_search_soup):
+            urls = search_concurrently("esc", self.store, limit=None)
+        self.assertEqual(
+            [urlparse(url).path for url in urls],
+            ["/p1-1", "/p1-2", "/p2-1", "/p2-2", "/p3-1", "/p3-2"],
+        )
+        self.assertLessEqual(max(self.requested), 6)
+
+    def test_limit(self):
+        with mock.patch("scraper.simple.get_search_soup", side_effect=self.get_search_soup):
+            urls = search_concurrently("esc", self.store, limit=3)
+        self.assertEqual([urlparse(url).path for url in urls], ["/p1-1", "/p1-2", "/p2-1"])
+
+
+class ExtractionPlanTest(SimpleTestCase):
+    def setUp(self):
+        self.store = Store(
+            id=4242, website="https://shop.example", config_version=1,
+            product_name_tag="h1", product_name_class="title", product_name_css_is_class=True,
+        )
+        self.addCleanup(invalidate_plan, self.store.id)
+
+    def test_plan_is_cached(self):
+        plan = get_plan(self.store)
+        self.assertIs(get_plan(self.store), plan)
+        self.assertEqual(plan.selectors(["name", "price"]), [("name", "h1", "class", "title")])
+
+    def test_new_config_version_rebuilds_the_plan(self):
+        plan = get_plan(self.store)
+        self.store.product_name_tag = "h2"
+        # Until the version changes the cached plan is kept
+        self.assertIs(get_plan(self.store), plan)
+
+        self.store.config_version = 2
+        self.assertEqual(get_plan(self.store).selectors(["name"]), [("name", "h2", "class", "title")])
+        self.assertIsNot(get_plan(self.store), plan)
+
+    def test_invalidate_plan(self):
+        plan = get_plan(self.store)
+        invalidate_plan(self.store.id)
+        self.assertIsNot(get_plan(self.store), plan)
+
+
+@override_settings(SCRAPER_PARTIAL_PARSING=True, SCRAPER_STRUCTURED_DATA=False)
+class PartialParsingTest(SimpleTestCase):
+    def setUp(self):
+        self.store = Store(
+            id=4241, website="https://shop.example",
+            product_name_tag="h1", product_name_class="title", product_name_css_is_class=True,
+            product_price_tag="span", product_price_class="price", product_price_css_is_class=True,
+        )
+        self.addCleanup(invalidate_plan, self.store.id)
+
+    def parse(self, html):
+        return parse_product_page(html, self.store, ["name", "price"]).soup
+
+    def test_only_the_selected_tags_are_parsed(self):
+        soup = self.parse("<h1 class='title'>ESC</h1><span class='price'>39.90</span><footer>Shop</footer>")
+        self.assertEqual(soup.find("span", {"class": "price"}).get_text(), "39.90")
+        self.assertIsNone(soup.find("footer"))
+
+    def test_missed_selector_parses_the_whole_page(self):
+        soup = self.parse("<h1 class='title'>ESC</h1><span class='amount'>39.90</span><footer>Shop</footer>")
+        self.assertEqual(soup.find("span", {"class": "amount"}).get_text(), "39.90")
+        self.assertIsNotNone(soup.find("footer"))
+
+
+class ConditionalRequestTest(SimpleTestCase):
+    def setUp(self):
+        self.store = Store(website="https://shop.example")
+        self.validators = Validators('"v1"', "Tue, 02 Nov 2021 10:00:00 GMT", content_hash(b"<p>page</p>"))
+
+    def fetch(self, status_code, content=b""):
+        response = mock.Mock(status_code=status_code, content=content, headers={"ETag": '"v2"'})
+        with mock.patch("scraper.simple.get_session") as get_session:
+            get_session.return_value.get.return_value = response
+            result = fetch_page("https://shop.example/a", store=self.store, throttled=False, validators=self.validators)
+        self.assertEqual(get_session.return_value.get.call_args.kwargs["headers"], {
+            "If-None-Match": '"v1"', "If-Modified-Since": "Tue, 02 Nov 2021 10:00:00 GMT",
+        })
+        return result
+
+    def test_not_modified_status(self):
+        with self.assertRaises(NotModified):
+            self.fetch(304)
+
+    def test_same_content(self):
+        with self.assertRaises(NotModified):
+            self.fetch(200, b"<p>page</p>")
+
+    def test_new_content(self):
+        html, validators = self.fetch(200, b"<p>new page</p>")
+        self.assertEqual(html, b"<p>new page</p>")
+        self.assertEqual(validators.as_dict(), {
+            "etag": '"v2"', "last_modified": None, "content_hash": content_hash(b"<p>new page</p>"),
+        })
+
+
+class SessionTest(SimpleTestCase):
+    def test_pools_of_every_host_are_kept(self):
+        pools = build_session(2).get_adapter("https://shop.example").poolmanager
+        website = pools.connection_from_url("https://shop.example")
+        pools.connection_from_url("https://www.shop.example")
+        pools.connection_from_url("https://search.shop.example")
+        self.assertIs(pools.connection_from_url("https://shop.example"), website)
+
+
+class FetchSoupTest(SimpleTestCase):
+    RESULTS = b"""<div class="item"><a class="title" href="/products/motor">Motor</a></div>"""
+
+    def setUp(self):
+        self.store = Store(
+            website="https://shop.example", search_tag="div", search_class="item", search_link="title",
+            product_name_tag="h1", product_name_class="title", product_name_css_is_class=True,
+            product_price_tag="span", product_price_class="price", product_price_css_is_class=True,
+            scrape_with_js=False,
+        )
+        patcher = mock.patch("scraper.simple.escalation.record")
+        self.record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, get, html, rendered=b""):
+        def fetch_page(url, js_enabled=False, **kwargs):
+            if js_enabled and isinstance(rendered, Exception):
+                raise rendered
+            return (rendered if js_enabled else html), Validators()
+
+        with mock.patch("scraper.simple.fetch_page", side_effect=fetch_page) as fetch_page:
+            return get(), [call.kwargs.get("js_enabled", False) for call in fetch_page.call_args_list]
+
+    def test_search_with_results_is_not_rendered(self):
+        soup, rendered = self.fetch(lambda: get_search_soup("https://shop.example/search", self.store), self.RESULTS)
+        self.assertEqual(rendered, [False])
+        self.record.assert_called_once_with(self.store, escalated=False)
+
+    def test_empty_search_is_neither_rendered_nor_counted(self):
+        soup, rendered = self.fetch(lambda: get_search_soup("https://shop.example/search", self.store), b"<p>0</p>")
+        self.assertIsNotNone(soup)
+        self.assertEqual(rendered, [False])
+        self.record.assert_not_called()
+
+    def test_browser_failure_returns_the_plain_page(self):
+        page, rendered = self.fetch(
+            lambda: get_product_page("https://shop.example/motor", self.store, ["name", "price"])[0],
+            b"<h1 class='title'>Motor</h1>",
+            rendered=WebDriverException("chrome not reachable"),
+        )
+        self.assertEqual(rendered, [False, True])
+        self.assertEqual(page.soup.find("h1").get_text(), "Motor")
+        self.record.assert_called_once_with(self.store, escalated=True)
+
+
+class CrawlerTest(SimpleTestCase):
+    def crawl(self, acquired):
+        with mock.patch("scraper.crawler.StoreSlot.acquire", return_value=acquired), \
+                mock.patch("scraper.crawler.StoreSlot.release"), \
+                mock.patch.object(Crawler, "crawl_queries") as crawl_queries:
+            stats = Crawler(concurrency=1).run([], [Store(id=1, name="Fake")])
+        return stats, crawl_queries.call_count
+
+    def test_throttled_store_does_not_hold_the_total_limit(self):
+        slow, fast = Store(website="https://slow.example"), Store(website="https://fast.example")
+        done = []
+
+        def get_soup(url, store, throttled):
+            done.append(store)
+            return BeautifulSoup("", "html.parser")
+
+        async def crawl():
+            crawler = Crawler(concurrency=1)
+            crawler._total = asyncio.Semaphore(1)
+            await asyncio.gather(
+                crawler.fetch("https://slow.example/a", slow, get_soup),
+                crawler.fetch("https://fast.example/a", fast, get_soup),
+            )
+
+        with mock.patch("scraper.crawler.throttle.reserve", side_effect=lambda store: 0.3 if store is slow else 0):
+            asyncio.run(crawl())
+        self.assertEqual(done, [fast, slow])
+
+    def test_store_without_free_slot_is_skipped(self):
+        stats, crawled = self.crawl(acquired=False)
+        self.assertEqual((stats["skipped"], crawled), (1, 0))
+
+    def test_store_with_free_slot_is_crawled(self):
+        stats, crawled = self.crawl(acquired=True)
+        self.assertEqual((stats["skipped"], crawled), (0, 1))
+
+
+class FakeChrome:
+    """The window handling of chromedriver: a tab can only be opened from an open window"""
+
+    def __init__(self):
+        self.window_handles = ["tab-0"]
+        self.current_window_handle = "tab-0"
+        self.switch_to = self
+        self.opened = 0
+
+    def new_window(self, kind):
+        if self.current_window_handle not in self.window_handles:
+            raise WebDriverException("no such window")
+        self.opened += 1
+        self.current_window_handle = f"tab-{self.opened}"
+        self.window_handles.append(self.current_window_handle)
+
+    def window(self, handle):
+        if handle not in self.window_handles:
+            raise WebDriverException("no such window")
+        self.current_window_handle = handle
+
+    def close(self):
+        self.window_handles.remove(self.current_window_handle)
+
+    def execute_cdp_cmd(self, command, params):
+        pass
+
+    def quit(self):
+        pass
+
+
+def fake_pooled_driver() -> PooledDriver:
+    pooled = PooledDriver.__new__(PooledDriver)
+    pooled.driver = FakeChrome()
+    pooled.pages = 0
+    pooled.tabs = OrderedDict([(None, pooled.driver.current_window_handle)])
+    return pooled
+
+
+@override_settings(BROWSER_MAX_TABS=2)
+class BrowserPoolTest(SimpleTestCase):
+
+    def test_least_recently_used_tab_is_closed(self):
+        pooled = fake_pooled_driver()
+        for store_id in (1, 2, 1, 3):
+            pooled.switch_to_tab(store_id, [])
+            self.assertEqual(pooled.driver.current_window_handle, pooled.tabs[store_id])
+
+        self.assertEqual(list(pooled.tabs), [1, 3])
+        self.assertEqual(sorted(pooled.driver.window_handles), sorted(pooled.tabs.values()))
+
+    def test_failed_browser_frees_its_slot(self):
+        pool = BrowserPool(1)
+        errors = [KeyError("message"), ValueError("invalid JSON")]
+        raised = []
+        done = threading.Event()
+
+        def use_browsers():
+            # A leaked browser would block the next one forever, the pool holds a single browser
+            for error in errors:
+                try:
+                    with pool.driver(1):
+                        raise error
+                except type(error):
+                    raised.append(error)
+            with pool.driver(1):
+                done.set()
+
+        with mock.patch("scraper.browser.PooledDriver", side_effect=fake_pooled_driver):
+            threading.Thread(target=use_browsers, daemon=True).start()
+            self.assertTrue(done.wait(5))
+        self.assertEqual(raised, errors)
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+from celery.utils.log import get_task_logger
+from redis.exceptions import RedisError
+
+from helpers.redis_client import get_redis
+from search.models import Store
+
+logger = get_task_logger(__name__)
+
+# Reserve a token from the bucket and return how many seconds the caller must wait
+# before using it. Tokens may go negative: every caller gets its own turn in the queue.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - 1
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+class LocalTokenBucket:
+    """Same algorithm as TOKEN_BUCKET_SCRIPT, used for the process only when Redis is unreachable"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, rate: float, burst: int, now: float) -> float:
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate) - 1
+            self._buckets[key] = (tokens, now)
+
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+
+local_buckets = LocalTokenBucket()
+_script = None
+
+
+def throttle_key(store: Store) -> str:
+    return f"throttle:{urlparse(store.website).netloc}"
+
+
+def reserve(store: Store) -> float:
+    """
+    Take a request slot for the domain of the store.
+
+    The bucket is shared by every worker through Redis, it refills at
+    store.requests_per_second and holds at most store.requests_burst tokens.
+
+    :returns: the seconds to wait before sending the request
+    """
+    global _script
+    key = throttle_key(store)
+    rate = max(store.requests_per_second, 0.01)
+    now = time.time()
+
+    try:
+        if _script is None:
+            _script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        return float(_script(keys=[key], args=[rate, store.requests_burst, now]))
+    except RedisError as e:
+        logger.warning(f"Rate limiter unavailable, throttling {key} locally: {e}")
+        return local_buckets.reserve(key, rate, store.requests_burst, now)
+
+
+def wait(store: Store):
+    """Block until the store can receive another request"""
+    delay = reserve(store)
+    if delay:
+        logger.info(f"Waiting {delay:.2f}s before requesting {store.website}")
+        time.sleep(delay)
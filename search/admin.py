@@ -6,7 +6,7 @@ from typing import List
 
 from django.conf.urls import url
 from django.contrib import admin, messages
-from django.db.models import Count
+from django.db.models import Count, F
 from django.http import StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.utils import timezone
@@ -14,11 +14,12 @@ from django.utils.html import format_html
 from core.translation import *
 from modeltranslation.admin import TranslationAdmin
 
+from scraper.plan import invalidate_plan
 from .forms import CsvImportForm
+from .helpers import re_import_products, re_import_products_by_batches
 from .tasks import (
     check_scraping_compatibility,
     task_search_and_import_store_products,
-    task_re_import_product,
     task_search_and_import_products_from_active_stores,
     task_re_import_product_from_active_stores,
     task_re_import_product_from_store,
@@ -32,6 +33,8 @@ from .models import (
     Country,
     ClickedProduct,
     RequestedStore,
+    ReImportRun,
+    SearchDepth,
     ShippingZone, SuggestedShippingMethod
 )
 
@@ -185,7 +188,15 @@ class StoreAdmin(ImportExportMixin):
         "products_not_active",
         "last_check",
     )
-    readonly_fields = ("is_scrapable", "not_scrapable_reason", "logo_tag", "has_shipping_methods",)
+    readonly_fields = (
+        "is_scrapable",
+        "not_scrapable_reason",
+        "logo_tag",
+        "has_shipping_methods",
+        "config_version",
+        "js_escalation_rate",
+        "sitemap_checked_at",
+    )
     fieldsets = [
         (
             None,
@@ -208,9 +219,18 @@ class StoreAdmin(ImportExportMixin):
             {
                 "fields": [
                     "locale",
+                    "platform",
                     "scrape_with_js",
+                    "js_escalation_rate",
+                    "browser_allowed_domains",
+                    "html_parser",
+                    "connection_pool_size",
+                    "requests_per_second",
+                    "requests_burst",
+                    "max_concurrent_fetches",
                     "is_scrapable",
                     "not_scrapable_reason",
+                    "config_version",
                 ]
             }
         ),
@@ -224,6 +244,11 @@ class StoreAdmin(ImportExportMixin):
                     "search_link",
                     "search_next_page",
                     "search_page_param",
+                    "search_prefetch_pages",
+                    "feed_url",
+                    "sitemap_url",
+                    "sitemap_product_pattern",
+                    "sitemap_checked_at",
                 ]
             },
         ),
@@ -266,8 +291,17 @@ class StoreAdmin(ImportExportMixin):
     def create_obj_from_dict(self, data):
         data.pop("id", None)
         data.pop("created_at", None)
+        data.pop("config_version", None)
         data["country"] = Country.objects.filter(name=data.get("country")).first()
-        Store.objects.update_or_create(website=data.get("website"), defaults=data)
+        store, created = Store.objects.update_or_create(website=data.get("website"), defaults=data)
+        if not created:
+            Store.objects.filter(pk=store.pk).update(config_version=F("config_version") + 1)
+            invalidate_plan(store.pk)
+
+    def save_model(self, request, obj, form, change):
+        obj.config_version += 1
+        super().save_model(request, obj, form, change)
+        invalidate_plan(obj.pk)
 
     def get_urls(self):
         urls = super(StoreAdmin, self).get_urls()
@@ -322,12 +356,16 @@ class ProductAdmin(ImportExportMixin):
     )
     readonly_fields = (
         "import_date",
+        "last_seen",
+        "volatility",
+        "next_refresh_at",
         "image_tag",
         "id",
         "original_link",
         "import_query"
     )
     list_filter = ("is_available", "store")
+    actions = ["re_import_selected_products", "export_as_csv"]
     fieldsets = [
         (
             None,
@@ -346,10 +384,31 @@ class ProductAdmin(ImportExportMixin):
         ),
         (
             "Advanced",
-            {"fields": ["original_link", "import_date", "import_query", "is_active", "id"]},
+            {
+                "fields": [
+                    "original_link",
+                    "import_date",
+                    "last_seen",
+                    "volatility",
+                    "next_refresh_at",
+                    "import_query",
+                    "is_active",
+                    "id",
+                ]
+            },
         ),
     ]
 
+    def re_import_selected_products(self, request, queryset):
+        sent = re_import_products_by_batches(queryset)
+        self.message_user(
+            request,
+            f"{sent} tasks have been launched to re-import {queryset.count()} products.",
+            messages.SUCCESS,
+        )
+
+    re_import_selected_products.short_description = "Re-import selected products"
+
     @staticmethod
     def original_link(obj):
         return format_html(f'<a href="{obj.link}" target="_blank">Open</a>')
@@ -383,7 +442,7 @@ class ProductAdmin(ImportExportMixin):
 
     def product_import(self, request, product_id):
         product = self.get_object(request, product_id)
-        task_re_import_product.delay(product_id)
+        re_import_products.delay(product.store_id, [product_id])
         messages.success(
             request,
             f"Starting to re-import {product.name} from {product.store.name}. Refresh the page to see the new data.",
@@ -401,7 +460,7 @@ class ProductAdmin(ImportExportMixin):
 
     @staticmethod
     def import_all(request):
-        task_re_import_product_from_active_stores.delay(Store.objects.filter(is_active=True))
+        task_re_import_product_from_active_stores.delay()
         messages.success(
             request,
             "Re Importing ALL products. It's gonna take a while",
@@ -560,6 +619,29 @@ class RequestedStoreAdmin(admin.ModelAdmin):
         return super().changelist_view(request, extra_context=extra_context)
 
 
+class SearchDepthAdmin(admin.ModelAdmin):
+    list_display = ("query", "store", "max_pages", "last_pages", "last_novelty", "created_at",)
+    list_filter = ("store",)
+    readonly_fields = ("last_pages", "last_novelty", "created_at",)
+
+
+class ReImportRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "store", "started_at", "progress_percent", "products_done", "products_total", "checkpointed_at", "finished_at",
+    )
+    list_filter = ("store",)
+    readonly_fields = (
+        "started_at", "finished_at", "checkpointed_at", "cursor_import_date", "cursor_product_id",
+        "products_total", "products_done",
+    )
+
+    @staticmethod
+    def progress_percent(obj):
+        return f"{obj.progress:.0%}"
+
+    progress_percent.short_description = "Progress"
+
+
 class ShippingZoneAdmin(ManyToManyExport, ImportExportMixin):
     readonly_fields = ("created_at",)
     many_to_many_field = "ship_to"
@@ -609,4 +691,6 @@ admin.site.register(Country, CountryAdmin)
 admin.site.register(ClickedProduct, ClickedProductAdmin)
 admin.site.register(RequestedStore, RequestedStoreAdmin)
 admin.site.register(ShippingZone, ShippingZoneAdmin)
+admin.site.register(SearchDepth, SearchDepthAdmin)
+admin.site.register(ReImportRun, ReImportRunAdmin)
 admin.site.register(SuggestedShippingMethod)
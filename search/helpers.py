@@ -1,74 +1,138 @@
 import random
-from time import sleep
-from typing import Dict
+import uuid
+from datetime import timedelta
+from typing import List, Optional
 
 from celery.task import task
 from celery.utils.log import get_task_logger
-from django.db.models import QuerySet
-from django.db.utils import IntegrityError
+from django.conf import settings
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from requests import TooManyRedirects
+from requests import ConnectionError, RequestException, Timeout, TooManyRedirects
 
 from helpers import logger
+from scraper import escalation
+from scraper.conditional import NotModified, Validators
+from scraper import runs
+from scraper.discovery import Discovery
+from scraper.feeds import iter_feed
+from scraper.platforms import get_adapter
+from scraper.schedule import schedule_products
 from scraper.simple import scrape_product, search
-from search.models import Product, Store, ImportQuery
+from scraper.sitemap import SitemapEntry, read_sitemap
+from scraper.slots import StoreSlot
+from search.models import Product, ReImportRun, Store, ImportQuery
+from search.writer import ProductWriter, RefreshWriter, create_or_update_product, query_brand
 
 celery_logger = get_task_logger(__name__)
 
+PRODUCT_FIELDS = ['name', 'price', 'image', 'is_available', 'variations', 'description']
+# The fields scraped by the fast refresh of re_import_store_products
+REFRESH_FIELDS = ['price', 'is_available']
 
-def create_or_update_product(store: Store, data: Dict, query: ImportQuery) -> bool:
-    if not data:
-        return False
-
-    product_id = f"{store.name}_{data.get('name')}".replace(' ', '_')
-    data["store"] = store
-    data['import_date'] = timezone.now()
-    data['import_query'] = query
-    data['brand'] = query.brand if query.brand and query.brand.name in data.get("name", "") else None
-
-    celery_logger.info(f"ID: {product_id} with data {data}")
-    data.pop("variations", None)
-    try:
-        product, created = Product.objects.update_or_create(id=product_id, defaults=data)
-        celery_logger.info(f"{'created' if created else 'updated'}")
-    except IntegrityError as e:
-        qs = Product.objects.filter(id=product_id)
-        if qs.exists():
-            product = qs.first()
-            product.is_active = False
-            product.save(update_fields=["is_active"])
-        return False
 
-    return bool(created)
+def attribute_products(store: Store, link: str, query: ImportQuery):
+    """Attribute the products of a page to another query"""
+    for product in Product.objects.filter(store=store, link=link):
+        product.import_query = query
+        product.brand = query_brand(query, product.name)
+        product.save(update_fields=["import_query", "brand"])
 
 
-def random_sleep_time() -> float:
-    return random.uniform(1.5, 4.5)
+def store_slot(task, store: Store) -> StoreSlot:
+    """
+    Take a fetch slot of the store for a bound task, see scraper.slots.StoreSlot.
+    When every slot is taken the task is retried later, the worker moves on to other stores.
+    Tasks taking slots are declared with max_retries=None, they wait for a slot as long as needed.
+    """
+    slot = StoreSlot(store)
+    if not slot.acquire():
+        countdown = settings.SCRAPER_STORE_SLOT_RETRY * random.uniform(1, 2)
+        celery_logger.info(f"Every slot of {store.name} is taken, retrying {task.name} in {countdown:.0f}s")
+        raise task.retry(countdown=countdown)
+    return slot
 
 
-def re_import_products_from(store_qs: QuerySet):
+def re_import_products_from(store_qs: QuerySet, fast: bool = False):
+    """
+    Re import the products of the stores, see re_import_store_products.
+    Catalogs and feeds list every field at once, they are always imported in full.
+    """
     for store in store_qs:
-        re_import_store_products.delay(store.id)
+        if store.platform:
+            import_store_catalog.delay(store.id)
+        elif store.feed_url:
+            import_store_feed.delay(store.id)
+        else:
+            re_import_store_products.delay(store.id, fast=fast)
 
 
-def import_product(link: str, store: Store, import_query: ImportQuery):
-    data = scrape_product(
-        link, store, fields=['name', 'price', 'image', 'is_available', 'variations', 'description']
-    )
-    created = create_or_update_product(store, data, import_query)
-    if created:
-        sleep(random_sleep_time())
+def import_product(
+    link: str,
+    store: Store,
+    import_query: Optional[ImportQuery],
+    validators: Optional[Validators] = None,
+    writer: Optional[ProductWriter] = None,
+):
+    """
+    Scrape a product page and save the product
+
+    :param writer: (optional) buffer the product in the writer instead of saving it right away
+
+    :raises NotModified: if validators are given and the page did not change since
+    """
+    data = scrape_product(link, store, fields=PRODUCT_FIELDS, validators=validators)
+    if writer:
+        writer.add(data, import_query)
+    else:
+        create_or_update_product(store, data, import_query)
+
+
+def import_without_search(store_qs: QuerySet) -> List[Store]:
+    """
+    Import the stores that do not need to be searched: stores on a known platform
+    from their catalog, stores with a feed from their feed, and stores with a sitemap
+    are crawled from it.
+
+    :returns: the other stores, to be searched
+    """
+    search_stores = []
+    for store in store_qs:
+        if store.platform:
+            import_store_catalog.delay(store.id)
+        elif store.feed_url:
+            import_store_feed.delay(store.id)
+        elif store.sitemap_url:
+            import_store_sitemap.delay(store.id)
+        else:
+            search_stores.append(store)
+    return search_stores
 
 
 def search_and_import_from(store_qs: QuerySet):
-    for query in ImportQuery.objects.filter(is_active=True):
-        for store in store_qs:
-            search_and_import_products.delay(query.id, store.id)
+    """
+    Search every active query on the stores, importing each product page once.
+    The stores that do not need to be searched are imported without, see import_without_search.
+    """
+    search_stores = import_without_search(store_qs)
+
+    run_id = uuid.uuid4().hex
+    for query in ImportQuery.objects.filter(is_active=True).order_by("-priority_score"):
+        for store in search_stores:
+            search_and_import_products.delay(query.id, store.id, run_id=run_id)
+
 
+@task(bind=True, max_retries=None)
+def re_import_store_products(self, store_id: int, fast: bool = False):
+    """
+    Re import all products of a given store
 
-@task
-def re_import_store_products(store_id: int):
-    """ Re import all products of a given store """
+    The products are re-imported by chunks of settings.SCRAPER_REIMPORT_CHUNK_SIZE within a
+    search.models.ReImportRun, a task that stopped halfway is continued by the next one.
+
+    :param fast: (optional) only refresh the price and the availability, see refresh_store_products
+    """
     store = Store.objects.filter(id=store_id).first()
     if not store:
         return
@@ -77,19 +141,207 @@ def re_import_store_products(store_id: int):
         # logger.warning(f'{store} is not compatible. Import cancelled')
         return
 
-    for product in store.products.only_active().order_by("import_date"):
+    with store_slot(self, store):
+        if fast:
+            refresh_store_products(store)
+            return
+
+        run = ReImportRun.start_or_resume(store)
+        if not run:
+            celery_logger.info(f"A re import of {store.name} is already running")
+            return
+
+        not_modified = 0
+        with ProductWriter(store) as writer:
+            while True:
+                chunk = list(run.products().select_related("import_query")[:settings.SCRAPER_REIMPORT_CHUNK_SIZE])
+                if not chunk:
+                    break
+
+                not_modified += re_import_chunk(store, chunk, writer)
+                # The cursor only moves past products that are written
+                writer.flush()
+                run.checkpoint(chunk[-1], len(chunk))
+
+        run.finish()
+        celery_logger.info(f"Re import of {store.name}: skipped {not_modified} unchanged pages, {writer.report()}")
+        schedule_products(store)
+        escalation.flush(store)
+        store.last_check = timezone.now()
+        store.save(update_fields=["last_check"])
+
+
+def re_import_chunk(store: Store, products: List[Product], writer: ProductWriter, conditional: bool = True) -> int:
+    """
+    Re import products of a store into the writer, products whose page is gone are deactivated.
+    Pages that fail for another reason, a timeout for instance, are skipped until the next re import.
+
+    :param conditional: (optional) skip the pages that did not change since the last import
+
+    :returns: the number of pages that did not change
+    """
+    not_modified = 0
+    for product in products:
         # logger.info(f"Re importing {product.name} from {product.store.name}")
         try:
-            import_product(product.link, product.store, product.import_query)
+            validators = Validators.from_product(product) if conditional else None
+            import_product(product.link, store, product.import_query, validators, writer)
+        except NotModified:
+            not_modified += 1
+        except Timeout as e:
+            celery_logger.warning(f"Could not re import {product.link}: {e}")
         except (ConnectionError, TooManyRedirects):
             product.is_active = False
             product.save(update_fields=["is_active"])
+        except RequestException as e:
+            celery_logger.warning(f"Could not re import {product.link}: {e}")
+    return not_modified
 
+
+@task(bind=True, max_retries=None)
+def re_import_products(self, store_id: int, product_ids: List[str]):
+    """
+    Re import a batch of products of a store, whatever their page validators.
+    The products are loaded with one query and written by one ProductWriter,
+    the session and the extraction plan of the store are shared by the batch.
+    """
+    store = Store.objects.filter(id=store_id).first()
+    if not store or not store.is_scrapable:
+        return
+
+    products = list(store.products.filter(id__in=product_ids).select_related("import_query"))
+    with store_slot(self, store):
+        with ProductWriter(store) as writer:
+            re_import_chunk(store, products, writer, conditional=False)
+
+        celery_logger.info(f"Re import of {len(products)} products of {store.name}: {writer.report()}")
+        escalation.flush(store)
+
+
+def re_import_products_by_batches(products: QuerySet) -> int:
+    """
+    Send the products to re_import_products, by batches of at most
+    settings.SCRAPER_REIMPORT_CHUNK_SIZE products of the same store
+
+    :returns: the number of tasks sent
+    """
+    batches = {}
+    sent = 0
+    for product_id, store_id in products.order_by("store_id", "import_date").values_list("id", "store_id"):
+        batch = batches.setdefault(store_id, [])
+        batch.append(product_id)
+        if len(batch) >= settings.SCRAPER_REIMPORT_CHUNK_SIZE:
+            re_import_products.delay(store_id, batch)
+            batches[store_id] = []
+            sent += 1
+
+    for store_id, batch in batches.items():
+        if batch:
+            re_import_products.delay(store_id, batch)
+            sent += 1
+    return sent
+
+
+def refresh_store_products(store: Store, product_ids: Optional[List[str]] = None):
+    """
+    Scrape only the price and the availability of the products of a store and write only those,
+    then schedule their next refresh.
+
+    Products are listed by id and link, the pages are parsed for REFRESH_FIELDS only and
+    without conditional requests, as the validators of the full import must stay untouched.
+    Products whose page is gone are deactivated, the pages that fail for another reason
+    are skipped and their products refreshed at their next due date.
+
+    :param product_ids: (optional) only refresh these products
+    """
+    products = store.products.only_active()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    links = {}
+    for product_id, link in products.order_by("import_date").values_list("id", "link"):
+        links.setdefault(link, []).append(product_id)
+
+    with RefreshWriter(store) as writer:
+        for link, page_product_ids in links.items():
+            try:
+                data = scrape_product(link, store, fields=REFRESH_FIELDS)
+            except Timeout as e:
+                celery_logger.warning(f"Could not refresh {link}: {e}")
+                continue
+            except (ConnectionError, TooManyRedirects):
+                Product.objects.filter(id__in=page_product_ids).update(is_active=False)
+                continue
+            except RequestException as e:
+                celery_logger.warning(f"Could not refresh {link}: {e}")
+                continue
+            writer.add(data, page_product_ids)
+
+    celery_logger.info(f"Fast refresh of {store.name}: {writer.report()}")
+    schedule_products(store, product_ids)
+    escalation.flush(store)
     store.last_check = timezone.now()
     store.save(update_fields=["last_check"])
 
-@task
-def search_and_import_products(query_id: int, store_id: int):
+
+@task(bind=True, max_retries=None)
+def refresh_products(self, store_id: int, product_ids: List[str]):
+    """Refresh the price and the availability of some products of a store, see refresh_store_products"""
+    store = Store.objects.filter(id=store_id).first()
+    if not store or not store.is_scrapable:
+        return
+
+    with store_slot(self, store):
+        refresh_store_products(store, product_ids)
+
+
+def refresh_due_products():
+    """
+    Send to refresh the products whose next refresh is due, the most overdue first,
+    whatever their store. Products never scheduled come first.
+
+    At most settings.SCRAPER_REFRESH_QUEUE_SIZE products are sent, they are not sent again
+    for settings.SCRAPER_REFRESH_LEASE seconds, so the queue can run often.
+    """
+    now = timezone.now()
+    stores = Store.objects.only_active().without_platform().without_feed().filter(is_scrapable=True)
+    due = list(
+        Product.objects.only_active()
+        .filter(store__in=stores)
+        .filter(Q(next_refresh_at__isnull=True) | Q(next_refresh_at__lte=now))
+        .order_by(F("next_refresh_at").asc(nulls_first=True))
+        .values_list("id", "store_id")[:settings.SCRAPER_REFRESH_QUEUE_SIZE]
+    )
+    if not due:
+        return
+
+    Product.objects.filter(id__in=[product_id for product_id, _ in due]).update(
+        next_refresh_at=now + timedelta(seconds=settings.SCRAPER_REFRESH_LEASE)
+    )
+    by_store = {}
+    for product_id, store_id in due:
+        by_store.setdefault(store_id, []).append(product_id)
+    for store_id, product_ids in by_store.items():
+        refresh_products.delay(store_id, product_ids)
+
+    celery_logger.info(f"Sent {len(due)} due products of {len(by_store)} stores to refresh")
+
+
+@task(bind=True, max_retries=None)
+def search_and_import_products(
+    self, query_id: int, store_id: int, incremental: Optional[bool] = None, run_id: Optional[str] = None
+):
+    """
+    Search a query on a store and import the products found
+
+    :param incremental: (optional) stop paging once the result pages list few unknown products,
+        settings.SCRAPER_INCREMENTAL_DISCOVERY by default
+    :param run_id: (optional) the run of searches the task belongs to, a product page
+        already imported by the run is not downloaded again, see scraper.runs.ImportRun
+    """
+    if incremental is None:
+        incremental = settings.SCRAPER_INCREMENTAL_DISCOVERY
+
     store = Store.objects.filter(id=store_id).first()
     if not store:
         return
@@ -102,9 +354,141 @@ def search_and_import_products(query_id: int, store_id: int):
     if not query:
         return
 
-    urls = search(query.text, store, limit=None)
-    for url in urls:
-        import_product(url, store, query)
+    with store_slot(self, store):
+        discovery = Discovery(store, query) if incremental else None
+        urls = search(query.text, store, limit=None, discovery=discovery)
+        if discovery:
+            discovery.finish()
 
-    store.last_check = timezone.now()
-    store.save(update_fields=["last_check"])
\ No newline at end of file
+        run = runs.ImportRun(run_id, store.id) if run_id else None
+        already_imported = 0
+        imported = []
+        with ProductWriter(store) as writer:
+            for url in urls:
+                if run:
+                    claim = run.claim(url, query)
+                    if claim == runs.ALREADY_CLAIMED:
+                        already_imported += 1
+                        continue
+
+                    if claim == runs.TAKEN_OVER:
+                        already_imported += 1
+                        attribute_products(store, url, query)
+                        continue
+
+                import_product(url, store, query, writer=writer)
+                imported.append(url)
+
+        if run:
+            # A query with a higher priority may have found the pages while they were imported
+            for url, owner_id in run.owners(imported).items():
+                if owner_id != query.id:
+                    owner = ImportQuery.objects.filter(id=owner_id).first()
+                    if owner:
+                        attribute_products(store, url, owner)
+
+        celery_logger.info(f"{query.text} on {store.name}: {writer.report()}")
+        if already_imported:
+            celery_logger.info(f"{query.text} on {store.name}: {already_imported} pages already imported by the run")
+        escalation.flush(store)
+        store.last_check = timezone.now()
+        store.save(update_fields=["last_check"])
+
+
+def changed_sitemap_links(store: Store, entries: List[SitemapEntry]) -> List[str]:
+    """The product pages of the sitemap entries that are new, or that changed since they were imported"""
+    import_dates = dict(
+        Product.objects.filter(store=store, link__in=[entry.loc for entry in entries])
+        .annotate(seen=Coalesce("last_seen", "import_date"))
+        .values_list("link", "seen")
+    )
+    links = []
+    for entry in entries:
+        import_date = import_dates.get(entry.loc)
+        if not import_date or (entry.lastmod and entry.lastmod > import_date):
+            links.append(entry.loc)
+    return links
+
+
+@task(bind=True, max_retries=None)
+def import_store_sitemap(self, store_id: int):
+    """
+    Import the product pages listed in the sitemap of a store that are new,
+    or that changed since they were imported according to their lastmod
+
+    The whole sitemap is read and compared to the imported products, chunk by chunk, before
+    any product page is scraped. store.sitemap_checked_at only moves forward once every sitemap
+    could be read, otherwise the child sitemaps are read again at the next import.
+    """
+    store = Store.objects.filter(id=store_id).first()
+    if not store or not store.sitemap_url:
+        return
+
+    if not store.is_scrapable:
+        return
+
+    with store_slot(self, store):
+        started_at = timezone.now()
+        links, listed, complete = read_sitemap(
+            store, lambda entries: changed_sitemap_links(store, entries), since=store.sitemap_checked_at
+        )
+
+        imported = 0
+        with ProductWriter(store) as writer:
+            for link in links:
+                try:
+                    import_product(link, store, None, writer=writer)
+                    imported += 1
+                except RequestException as e:
+                    celery_logger.warning(f"Could not import {link}: {e}")
+
+        celery_logger.info(
+            f"Sitemap of {store.name}: imported {imported} of {listed} product pages, {writer.report()}"
+        )
+        escalation.flush(store)
+        store.last_check = timezone.now()
+        update_fields = ["last_check"]
+        if complete:
+            store.sitemap_checked_at = started_at
+            update_fields.append("sitemap_checked_at")
+        else:
+            celery_logger.warning(f"Sitemap of {store.name} was not read to its end, it will be read again")
+        store.save(update_fields=update_fields)
+
+
+@task(bind=True, max_retries=None)
+def import_store_catalog(self, store_id: int):
+    """Import every product of a store from the JSON catalog of its platform"""
+    store = Store.objects.filter(id=store_id).first()
+    if not store or not store.is_scrapable:
+        return
+
+    adapter = get_adapter(store)
+    if not adapter:
+        return
+
+    with store_slot(self, store):
+        with ProductWriter(store) as writer:
+            for data in adapter.iter_products():
+                writer.add(data, None)
+
+        celery_logger.info(f"Catalog of {store.name}: {writer.report()}")
+        store.last_check = timezone.now()
+        store.save(update_fields=["last_check"])
+
+
+@task(bind=True, max_retries=None)
+def import_store_feed(self, store_id: int):
+    """Import every product of a store from its product feed"""
+    store = Store.objects.filter(id=store_id).first()
+    if not store or not store.feed_url or not store.is_scrapable:
+        return
+
+    with store_slot(self, store):
+        with ProductWriter(store) as writer:
+            for data in iter_feed(store):
+                writer.add(data, None)
+
+        celery_logger.info(f"Feed of {store.name}: {writer.report()}")
+        store.last_check = timezone.now()
+        store.save(update_fields=["last_check"])
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0040_suggestedshippingmethod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='connection_pool_size',
+            field=models.PositiveSmallIntegerField(default=4, help_text='Connections are kept alive and reused between pages of the same store', verbose_name='Max open connections to the store'),
+        ),
+    ]
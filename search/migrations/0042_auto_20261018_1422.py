@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0041_store_connection_pool_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='requests_burst',
+            field=models.PositiveSmallIntegerField(default=2, help_text='How many requests can be sent at once after the store was idle', verbose_name='Max burst of requests'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='requests_per_second',
+            field=models.FloatField(default=0.33, help_text='Shared by every worker scraping the store', verbose_name='Max requests per second'),
+        ),
+    ]
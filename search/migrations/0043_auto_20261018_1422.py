@@ -0,0 +1,28 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0042_auto_20261018_1422'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True, verbose_name="Hash of the product's page"),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='etag',
+            field=models.CharField(blank=True, max_length=256, null=True, verbose_name="ETag of the product's page"),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name="Last-Modified of the product's page"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0043_auto_20261018_1422'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='html_parser',
+            field=models.CharField(blank=True, choices=[('html.parser', 'Python (html.parser)'), ('lxml', 'lxml'), ('selectolax', 'Lexbor (selectolax)')], help_text='Leave empty to use the default parser', max_length=16, null=True, verbose_name='HTML parser'),
+        ),
+    ]
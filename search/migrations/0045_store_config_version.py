@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0044_store_html_parser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='config_version',
+            field=models.PositiveIntegerField(default=0, help_text='Increased on every save from the admin, it invalidates the cached extraction plans', verbose_name='Version of the scraping config'),
+        ),
+    ]
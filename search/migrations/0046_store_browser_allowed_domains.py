@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0045_store_config_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='browser_allowed_domains',
+            field=models.TextField(blank=True, help_text='One per line. Trackers and other third party domains are blocked when using JS, list here the ones the store needs to render its pages', null=True, verbose_name='Domains the browser must not block'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0046_store_browser_allowed_domains'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='js_escalation_rate',
+            field=models.FloatField(blank=True, help_text='Measured on the last window of pages tried over plain HTTP', null=True, verbose_name='Share of pages that needed JS'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='js_escalations',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages that needed JS'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='js_http_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages tried over plain HTTP'),
+        ),
+        migrations.AlterField(
+            model_name='store',
+            name='scrape_with_js',
+            field=models.BooleanField(default=False, help_text='Pages are rendered in a browser only when plain HTTP is not enough, this is updated automatically from the escalation rate', verbose_name='Use JS when scraping'),
+        ),
+    ]
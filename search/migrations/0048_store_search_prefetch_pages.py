@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0047_auto_20261018_1431'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='search_prefetch_pages',
+            field=models.BooleanField(default=False, help_text='Only with a page param, the pages are still rate limited and the search stops at the first page without results', verbose_name='Fetch the result pages concurrently'),
+        ),
+    ]
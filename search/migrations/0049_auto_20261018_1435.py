@@ -0,0 +1,43 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0048_store_search_prefetch_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDepth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_created=True, auto_now=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('max_pages', models.PositiveSmallIntegerField(verbose_name='Result pages to read at most')),
+                ('last_pages', models.PositiveSmallIntegerField(default=0, verbose_name='Result pages read by the last search')),
+                ('last_novelty', models.FloatField(blank=True, null=True, verbose_name='Share of new products on the last page read')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['store', 'link'], name='search_prod_store_i_0e762d_idx'),
+        ),
+        migrations.AddField(
+            model_name='searchdepth',
+            name='query',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_depths', to='search.importquery'),
+        ),
+        migrations.AddField(
+            model_name='searchdepth',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_depths', to='search.store'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdepth',
+            unique_together={('store', 'query')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0049_auto_20261018_1435'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='sitemap_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last sitemap crawl'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='sitemap_product_pattern',
+            field=models.CharField(blank=True, max_length=256, null=True, verbose_name='Regex matching the product pages in the sitemap'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='sitemap_url',
+            field=models.URLField(blank=True, help_text='When set, products are discovered from the sitemap instead of searching every query', max_length=1024, null=True, verbose_name='The sitemap listing the product pages'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0050_auto_20261018_1438'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='platform',
+            field=models.CharField(blank=True, choices=[('shopify', 'Shopify'), ('woocommerce', 'WooCommerce')], help_text='When set, products are imported from the JSON catalog of the platform instead of its pages', max_length=16, null=True, verbose_name='E-commerce platform of the store'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0051_store_platform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='feed_url',
+            field=models.URLField(blank=True, help_text='A Google Merchant XML or CSV feed, when set the whole catalog is imported from it', max_length=1024, null=True, verbose_name='The product feed of the store'),
+        ),
+    ]
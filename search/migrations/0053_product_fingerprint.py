@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0052_store_feed_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=40, null=True, verbose_name="Hash of the product's scraped fields"),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last time the product was scraped'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0053_product_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='next_refresh_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Next refresh of the price and availability'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='volatility',
+            field=models.FloatField(default=0, verbose_name='Share of the last scrapes that found a new price or availability'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['next_refresh_at'], name='search_prod_next_re_b7de62_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0054_product_refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='max_concurrent_fetches',
+            field=models.PositiveSmallIntegerField(default=2, help_text='How many import tasks can scrape the store at once, shared by every worker', verbose_name='Max concurrent fetches'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0055_store_max_concurrent_fetches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_created=True, auto_now=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Started at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+                ('checkpointed_at', models.DateTimeField(blank=True, null=True, verbose_name='Last chunk committed at')),
+                ('cursor_import_date', models.DateTimeField(blank=True, null=True, verbose_name='Import date of the last product done')),
+                ('cursor_product_id', models.CharField(blank=True, max_length=770, null=True, verbose_name='ID of the last product done')),
+                ('products_total', models.PositiveIntegerField(default=0, verbose_name='Products to re-import')),
+                ('products_done', models.PositiveIntegerField(default=0, verbose_name='Products re-imported')),
+            ],
+            options={
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['store', 'import_date', 'id'], name='search_prod_store_i_b926b0_idx'),
+        ),
+        migrations.AddField(
+            model_name='reimportrun',
+            name='store',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='re_import_runs', to='search.store'),
+        ),
+    ]
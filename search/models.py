@@ -1,13 +1,16 @@
+from typing import Optional
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
+from django.conf import settings
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
-from django.db import models
-from django.db.models import QuerySet
+from django.db import models, transaction
+from django.db.models import F, QuerySet
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from helpers.models import BaseModel
+from scraper.parsers import PARSERS
 
 
 class StoreQuerySet(QuerySet):
@@ -30,6 +33,12 @@ class StoreQuerySet(QuerySet):
         oceania = Continent.objects.filter(name_en="Oceania").first()
         return self.only_active().filter(country__continent=oceania)
 
+    def without_platform(self):
+        return self.filter(models.Q(platform__isnull=True) | models.Q(platform=""))
+
+    def without_feed(self):
+        return self.filter(models.Q(feed_url__isnull=True) | models.Q(feed_url=""))
+
 
 class Store(BaseModel):
     """This model represent an online store"""
@@ -47,6 +56,10 @@ class Store(BaseModel):
     LOCALE_EU = "it_IT"
     LOCALE = ((LOCALE_US, "American"), (LOCALE_EU, "European"))
 
+    PLATFORM_SHOPIFY = "shopify"
+    PLATFORM_WOOCOMMERCE = "woocommerce"
+    PLATFORM = ((PLATFORM_SHOPIFY, "Shopify"), (PLATFORM_WOOCOMMERCE, "WooCommerce"))
+
     name = models.CharField("Name of the store", max_length=256)
     website = models.URLField("URL of the store")
     logo = models.ImageField("Logo", default=None, null=True, blank=True, upload_to ='uploads/')
@@ -70,9 +83,68 @@ class Store(BaseModel):
         null=True,
         blank=True,
     )
-    scrape_with_js = models.BooleanField("Use JS when scraping", default=False)
+    platform = models.CharField(
+        "E-commerce platform of the store",
+        max_length=16,
+        choices=PLATFORM,
+        null=True,
+        blank=True,
+        help_text="When set, products are imported from the JSON catalog of the platform instead of its pages",
+    )
+    scrape_with_js = models.BooleanField(
+        "Use JS when scraping",
+        default=False,
+        help_text="Pages are rendered in a browser only when plain HTTP is not enough, "
+                  "this is updated automatically from the escalation rate",
+    )
+    js_http_attempts = models.PositiveIntegerField("Pages tried over plain HTTP", default=0)
+    js_escalations = models.PositiveIntegerField("Pages that needed JS", default=0)
+    js_escalation_rate = models.FloatField(
+        "Share of pages that needed JS", null=True, blank=True,
+        help_text="Measured on the last window of pages tried over plain HTTP",
+    )
+    browser_allowed_domains = models.TextField(
+        "Domains the browser must not block",
+        null=True,
+        blank=True,
+        help_text="One per line. Trackers and other third party domains are blocked when using JS, "
+                  "list here the ones the store needs to render its pages",
+    )
+    html_parser = models.CharField(
+        "HTML parser",
+        max_length=16,
+        choices=PARSERS,
+        null=True,
+        blank=True,
+        help_text="Leave empty to use the default parser",
+    )
+    connection_pool_size = models.PositiveSmallIntegerField(
+        "Max open connections to the store",
+        default=4,
+        help_text="Connections are kept alive and reused between pages of the same store",
+    )
+    requests_per_second = models.FloatField(
+        "Max requests per second",
+        default=0.33,
+        help_text="Shared by every worker scraping the store",
+    )
+    requests_burst = models.PositiveSmallIntegerField(
+        "Max burst of requests",
+        default=2,
+        help_text="How many requests can be sent at once after the store was idle",
+    )
+    max_concurrent_fetches = models.PositiveSmallIntegerField(
+        "Max concurrent fetches",
+        default=2,
+        help_text="How many import tasks can scrape the store at once, shared by every worker",
+    )
 
     # Scraping config
+    config_version = models.PositiveIntegerField(
+        "Version of the scraping config",
+        default=0,
+        help_text="Increased on every save from the admin, it invalidates the cached extraction plans",
+    )
     search_url = models.URLField("The base url of the search page")
     search_tag = models.CharField(
         "The nearest html tag for each product item displayed in the result page",
@@ -97,6 +169,33 @@ class Store(BaseModel):
         null=True,
         blank=True,
     )
+    search_prefetch_pages = models.BooleanField(
+        "Fetch the result pages concurrently",
+        default=False,
+        help_text="Only with a page param, the pages are still rate limited "
+                  "and the search stops at the first page without results",
+    )
+    feed_url = models.URLField(
+        "The product feed of the store",
+        max_length=1024,
+        null=True,
+        blank=True,
+        help_text="A Google Merchant XML or CSV feed, when set the whole catalog is imported from it",
+    )
+    sitemap_url = models.URLField(
+        "The sitemap listing the product pages",
+        max_length=1024,
+        null=True,
+        blank=True,
+        help_text="When set, products are discovered from the sitemap instead of searching every query",
+    )
+    sitemap_product_pattern = models.CharField(
+        "Regex matching the product pages in the sitemap",
+        max_length=256,
+        null=True,
+        blank=True,
+    )
+    sitemap_checked_at = models.DateTimeField("Last sitemap crawl", null=True, blank=True)
     product_name_class = models.CharField(
         "CSS class/id for Product's name", max_length=64
     )
@@ -242,6 +341,30 @@ class Store(BaseModel):
         self.is_scrapable = True
         self.save()
 
+    def record_js_escalations(self, attempts: int, escalated: int):
+        """
+        Add the pages tried over plain HTTP, and the ones that needed a browser.
+        Once a window is complete, the store switches to the browser if most pages needed it
+        and back to plain HTTP if few did.
+        """
+        Store.objects.filter(pk=self.pk).update(
+            js_http_attempts=F("js_http_attempts") + attempts,
+            js_escalations=F("js_escalations") + escalated,
+        )
+        self.refresh_from_db(fields=["js_http_attempts", "js_escalations", "scrape_with_js"])
+        if self.js_http_attempts < settings.SCRAPER_JS_ESCALATION_WINDOW:
+            return
+
+        self.js_escalation_rate = self.js_escalations / self.js_http_attempts
+        if self.js_escalation_rate >= settings.SCRAPER_JS_PROMOTE_RATE:
+            self.scrape_with_js = True
+        elif self.js_escalation_rate <= settings.SCRAPER_JS_DEMOTE_RATE:
+            self.scrape_with_js = False
+
+        self.js_http_attempts = 0
+        self.js_escalations = 0
+        self.save(update_fields=["js_http_attempts", "js_escalations", "js_escalation_rate", "scrape_with_js"])
+
     def best_shipping_method(self) -> "ShippingMethod":
         return self.shipping_methods.order_by("price", "name").first()
 
@@ -393,6 +516,24 @@ class ImportQuery(BaseModel):
         super().save(force_insert, force_update, using, update_fields)
 
 
+class SearchDepth(BaseModel):
+    """How many result pages of a query are worth reading on a store, learnt from the past searches"""
+
+    store = models.ForeignKey(Store, related_name="search_depths", on_delete=models.CASCADE)
+    query = models.ForeignKey(ImportQuery, related_name="search_depths", on_delete=models.CASCADE)
+    max_pages = models.PositiveSmallIntegerField("Result pages to read at most")
+    last_pages = models.PositiveSmallIntegerField("Result pages read by the last search", default=0)
+    last_novelty = models.FloatField(
+        "Share of new products on the last page read", null=True, blank=True
+    )
+
+    class Meta:
+        unique_together = ("store", "query")
+
+    def __str__(self):
+        return f"{self.query.text} on {self.store.name}: {self.max_pages} pages"
+
+
 class ProductQuerySet(QuerySet):
     def only_active(self):
         return self.filter(is_active=True)
@@ -426,10 +567,30 @@ class Product(BaseModel):
 
     search_vector = SearchVectorField(null=True)
 
+    etag = models.CharField("ETag of the product's page", max_length=256, null=True, blank=True)
+    last_modified = models.CharField(
+        "Last-Modified of the product's page", max_length=64, null=True, blank=True
+    )
+    content_hash = models.CharField("Hash of the product's page", max_length=40, null=True, blank=True)
+    fingerprint = models.CharField(
+        "Hash of the product's scraped fields", max_length=40, null=True, blank=True
+    )
+    last_seen = models.DateTimeField("Last time the product was scraped", null=True, blank=True)
+    volatility = models.FloatField(
+        "Share of the last scrapes that found a new price or availability", default=0
+    )
+    next_refresh_at = models.DateTimeField("Next refresh of the price and availability", null=True, blank=True)
+
     objects = ProductQuerySet.as_manager()
 
     class Meta:
-        indexes = [GinIndex(fields=["search_vector"])]
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            models.Index(fields=["store", "link"]),
+            models.Index(fields=["next_refresh_at"]),
+            # The cursor of re-import runs
+            models.Index(fields=["store", "import_date", "id"]),
+        ]
 
     def __str__(self):
         return f"{self.name} from {self.store.name}, price: {self.price}"
@@ -466,6 +627,87 @@ class Product(BaseModel):
         return urlunparse(url_parts)
 
 
+class ReImportRun(BaseModel):
+    """
+    A re-import of the products of a store, committed by chunks so it can resume where it stopped.
+
+    The run goes through the products imported before it started, ordered by import date and id,
+    and stores the last product of each chunk as its cursor. Products written by the run get a
+    newer import date, so they leave the run instead of shifting the products after the cursor.
+    """
+
+    store = models.ForeignKey(Store, related_name="re_import_runs", on_delete=models.CASCADE)
+    started_at = models.DateTimeField("Started at", default=timezone.now)
+    finished_at = models.DateTimeField("Finished at", null=True, blank=True)
+    checkpointed_at = models.DateTimeField("Last chunk committed at", null=True, blank=True)
+    cursor_import_date = models.DateTimeField("Import date of the last product done", null=True, blank=True)
+    cursor_product_id = models.CharField("ID of the last product done", max_length=770, null=True, blank=True)
+    products_total = models.PositiveIntegerField("Products to re-import", default=0)
+    products_done = models.PositiveIntegerField("Products re-imported", default=0)
+
+    class Meta:
+        ordering = ("-started_at",)
+
+    def __str__(self):
+        return f"Re-import of {self.store.name} started at {self.started_at:%Y-%m-%d %H:%M}"
+
+    @classmethod
+    def start_or_resume(cls, store: Store) -> Optional["ReImportRun"]:
+        """
+        The unfinished run of the store, or a new one.
+        None while another task is running it, that is it committed a chunk in the last
+        settings.SCRAPER_REIMPORT_RUN_STALE seconds.
+
+        The row of the store is locked meanwhile, so tasks holding two slots of the same store
+        cannot both create a run, nor both resume the same stale one.
+        """
+        with transaction.atomic():
+            Store.objects.select_for_update().filter(id=store.id).first()
+            run = cls.objects.filter(store=store, finished_at__isnull=True).first()
+            if not run:
+                run = cls(store=store)
+                run.products_total = run.products().count()
+                run.save()
+                return run
+
+            last_active = run.checkpointed_at or run.started_at
+            if (timezone.now() - last_active).total_seconds() < settings.SCRAPER_REIMPORT_RUN_STALE:
+                return None
+            # Resumed, the other tasks leave it alone until it is stale again
+            run.checkpointed_at = timezone.now()
+            run.save(update_fields=["checkpointed_at"])
+            return run
+
+    def products(self) -> QuerySet:
+        """The products of the run that are not done yet, in the order they are re-imported"""
+        products = self.store.products.only_active().filter(import_date__lte=self.started_at)
+        if self.cursor_import_date:
+            products = products.filter(
+                models.Q(import_date__gt=self.cursor_import_date)
+                | models.Q(import_date=self.cursor_import_date, id__gt=self.cursor_product_id)
+            )
+        return products.order_by("import_date", "id")
+
+    def checkpoint(self, last_product: Product, done: int):
+        """Record a chunk whose products are all written"""
+        self.cursor_import_date = last_product.import_date
+        self.cursor_product_id = last_product.id
+        self.products_done += done
+        self.checkpointed_at = timezone.now()
+        self.save(update_fields=["cursor_import_date", "cursor_product_id", "products_done", "checkpointed_at"])
+
+    def finish(self):
+        self.finished_at = timezone.now()
+        self.save(update_fields=["finished_at"])
+
+    @property
+    def progress(self) -> float:
+        """The share of the products done, the total is counted when the run starts"""
+        if not self.products_total:
+            return 1.0 if self.finished_at else 0.0
+        return min(self.products_done / self.products_total, 1.0)
+
+
 class Continent(BaseModel):
     name = models.CharField("The name of the continent", max_length=128)
 
@@ -1,16 +1,22 @@
-import requests
 from celery.task import task
-from requests.exceptions import ConnectionError, TooManyRedirects
+from django.conf import settings
+from requests.exceptions import ConnectionError
 
 from helpers.logger import logger
-from scraper.simple import search, scrape_product, get_random_user_agent
+from scraper.crawler import Crawler
+from scraper.platforms import get_adapter
+from scraper.session import get_session, session_stats
+from scraper import escalation
+from scraper.simple import search, scrape_product, BLOCKED_STATUSES
 from search.helpers import (
+    import_without_search,
     re_import_store_products,
     re_import_products_from,
-    import_product,
+    re_import_products_by_batches,
+    refresh_due_products,
     search_and_import_from
 )
-from search.models import Store, Product
+from search.models import Store, Product, ImportQuery
 
 
 @task(name='check_scraping_compatibility')
@@ -19,11 +25,9 @@ def check_scraping_compatibility(store_pk: int) -> bool:
     logger.info(f"Starting to check compatibility for {config.name}")
     # Is the store still available?
     try:
-        headers = {'User-Agent': get_random_user_agent()}
-        res = requests.get(config.website, headers=headers)
-        if res.status_code == 503:
-            config.scrape_with_js = True
-            config.save(update_fields=["scrape_with_js"])
+        res = get_session(config).get(config.website, timeout=settings.SCRAPER_REQUEST_TIMEOUT)
+        if res.status_code in BLOCKED_STATUSES:
+            logger.info(f"{config.website} answered {res.status_code}, pages will be rendered with JS when needed")
         elif res.status_code != 200:
             config.set_is_not_scrapable(f'Cannot reach {config.website} status code was: {res.status_code}')
             return False
@@ -33,6 +37,18 @@ def check_scraping_compatibility(store_pk: int) -> bool:
 
     logger.info("OK: We can reach the website")
 
+    adapter = get_adapter(config)
+    if adapter:
+        data = next(adapter.iter_products(max_pages=1), None)
+        if not data:
+            config.set_is_not_scrapable(f'The {config.get_platform_display()} catalog did not list any product')
+            return False
+
+        logger.info(f"Imported {data}")
+        config.set_is_scrapable()
+        logger.info("{} is compatible with the scraping".format(config.name))
+        return True
+
     product_pages = []
     # Can we perform some query?
     queries = ['Motor', 'ESC']
@@ -58,8 +74,10 @@ def check_scraping_compatibility(store_pk: int) -> bool:
             return False
         logger.info(f"Scraped {data}")
 
+    escalation.flush(config)
     config.set_is_scrapable()
     logger.info("{} is compatible with the scraping".format(config.name))
+    logger.info(f"Connection reuse for {config.name}: {session_stats().get(config.id)}")
     return True
 
 
@@ -70,16 +88,12 @@ def task_search_and_import_store_products(store_pk):
 
 @task(name='re_import_product')
 def task_re_import_product(product_id: str):
-    product = Product.objects.get(id=product_id)
-    try:
-        import_product(product.link, product.store, product.import_query)
-    except TooManyRedirects:
-        product.is_active = False
-        product.save(update_fields=["is_active"])
+    re_import_products_by_batches(Product.objects.filter(id=product_id))
+
 
 @task(name="re_import_product_from_store")
-def task_re_import_product_from_store(store_pk: int):
-    re_import_store_products(store_pk)
+def task_re_import_product_from_store(store_pk: int, fast: bool = False):
+    re_import_store_products.delay(store_pk, fast=fast)
 
 
 @task(name="search_and_import_products_from_active_stores")
@@ -88,6 +102,13 @@ def task_search_and_import_products_from_active_stores():
     logger.info("Search and import done for  stores", send_to_telegram=True)
 
 
+@task(name="crawl_products_from_active_stores")
+def task_crawl_products_from_active_stores():
+    stores = import_without_search(Store.objects.only_active().filter(is_scrapable=True))
+    stats = Crawler().run(ImportQuery.objects.filter(is_active=True), stores)
+    logger.info(f"Crawl done for active stores: {stats}", send_to_telegram=True)
+
+
 @task(name="search_and_import_products_from_asian_stores")
 def task_search_and_import_products_from_asian_stores():
     search_and_import_from(Store.objects.only_asian())
@@ -118,6 +139,17 @@ def task_re_import_product_from_active_stores():
     logger.info("Reimport done for active stores", send_to_telegram=True)
 
 
+@task(name="fast_re_import_product_from_active_stores")
+def task_fast_re_import_product_from_active_stores():
+    re_import_products_from(Store.objects.only_active(), fast=True)
+    logger.info("Fast refresh done for active stores", send_to_telegram=True)
+
+
+@task(name="refresh_due_products")
+def task_refresh_due_products():
+    refresh_due_products()
+
+
 @task(name="re_import_products_from_asian_stores")
 def task_re_import_products_from_asian_stores():
     re_import_products_from(Store.objects.only_asian())
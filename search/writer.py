@@ -0,0 +1,350 @@
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.utils import IntegrityError
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from scraper.conditional import content_hash
+from search.models import ImportQuery, Product, Store
+
+logger = get_task_logger(__name__)
+
+# Columns written for every product, with the value of a new product when the scraper did not find it
+INSERT_DEFAULTS = {
+    "description": "",
+    "currency": "USD",
+    "image": None,
+    "link": "",
+    "is_available": True,
+    "etag": None,
+    "last_modified": None,
+    "content_hash": None,
+    "fingerprint": None,
+    "import_query_id": None,
+    "brand_id": None,
+    "is_active": True,
+    "volatility": 0.0,
+}
+# Without these a product cannot be inserted, it is saved on its own with update_or_create
+REQUIRED_COLUMNS = ("name", "price")
+# A product whose scraped fields did not change is not rewritten, see product_fingerprint
+FINGERPRINT_FIELDS = ("name", "description", "price", "currency", "image", "link", "is_available")
+# The validators of the page change with it even when the product does not, they are kept up to date
+VALIDATOR_COLUMNS = ("etag", "last_modified", "content_hash")
+# The columns whose changes make a product volatile, see scraper.schedule
+VOLATILE_COLUMNS = ("price", "is_available")
+
+
+def get_product_id(store: Store, name: str) -> str:
+    return f"{store.name}_{name}".replace(' ', '_')
+
+
+def query_brand(query: ImportQuery, product_name: str):
+    return query.brand if query.brand and query.brand.name in product_name else None
+
+
+def product_fingerprint(data: Dict, query: Optional[ImportQuery]) -> str:
+    """A hash of the scraped fields of a product and of the query it is imported for"""
+    values = {field: data[field] for field in FINGERPRINT_FIELDS if field in data}
+    if query:
+        values["import_query"] = query.id
+    return content_hash(json.dumps(values, sort_keys=True, default=str))
+
+
+def volatility_update(table: str, changed: str) -> str:
+    """The SQL assignment of the volatility of a product, from the SQL telling if its last scrape changed it"""
+    smoothing = float(settings.SCRAPER_VOLATILITY_SMOOTHING)
+    return f"volatility = {table}.volatility * {1 - smoothing!r} + {smoothing!r} * ({changed})::int"
+
+
+def create_or_update_product(store: Store, data: Dict, query: Optional[ImportQuery]) -> bool:
+    """
+    Save a scraped product, a product imported without query keeps its previous one.
+    A product with the same fingerprint is only marked as seen.
+    """
+    if not data:
+        return False
+
+    product_id = get_product_id(store, data.get('name'))
+    now = timezone.now()
+    data["fingerprint"] = product_fingerprint(data, query)
+    data["last_seen"] = now
+    seen = {column: data[column] for column in VALIDATOR_COLUMNS if column in data}
+    if Product.objects.filter(id=product_id, fingerprint=data["fingerprint"]).update(last_seen=now, **seen):
+        logger.info(f"ID: {product_id} unchanged")
+        return False
+
+    data["store"] = store
+    data['import_date'] = now
+    if query:
+        data['import_query'] = query
+        data['brand'] = query_brand(query, data.get("name", ""))
+
+    logger.info(f"ID: {product_id} with data {data}")
+    data.pop("variations", None)
+    try:
+        product, created = Product.objects.update_or_create(id=product_id, defaults=data)
+        logger.info(f"{'created' if created else 'updated'}")
+    except IntegrityError as e:
+        qs = Product.objects.filter(id=product_id)
+        if qs.exists():
+            product = qs.first()
+            product.is_active = False
+            product.save(update_fields=["is_active"])
+        return False
+
+    return bool(created)
+
+
+class ProductWriter:
+    """
+    Collect the scraped products of a store and save them by batches, each one a single
+    INSERT ... ON CONFLICT DO UPDATE. Like create_or_update_product, a product is identified
+    by get_product_id and only the scraped fields of an existing product are updated.
+
+    The buffer is written once it holds settings.SCRAPER_WRITER_BATCH_SIZE products, once
+    the oldest one waited settings.SCRAPER_WRITER_MAX_DELAY seconds, and when the writer
+    is closed. If a batch breaks a constraint, its products are saved one by one
+    with create_or_update_product.
+
+    Existing products are only updated when their fingerprint changed, the others
+    only get their last_seen date and page validators set, by a single UPDATE per batch
+    that does not fire the search vector trigger. Both update the volatility of the products.
+
+        with ProductWriter(store) as writer:
+            for url in urls:
+                writer.add(scrape_product(url, store), query)
+    """
+
+    def __init__(self, store: Store, batch_size: Optional[int] = None, max_delay: Optional[float] = None):
+        self.store = store
+        self.batch_size = batch_size or settings.SCRAPER_WRITER_BATCH_SIZE
+        self.max_delay = max_delay if max_delay is not None else settings.SCRAPER_WRITER_MAX_DELAY
+        # product id -> (scraped data, query), the last scrape of a product wins
+        self._buffer: Dict[str, Tuple[Dict, Optional[ImportQuery]]] = {}
+        self._buffered_at: Optional[float] = None
+        self.created = 0
+        self.unchanged = 0
+        self.written = 0
+
+    def __enter__(self) -> "ProductWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, data: Dict, query: Optional[ImportQuery]) -> int:
+        """
+        Buffer a scraped product, see create_or_update_product
+
+        :returns: the number of products created, if the buffer was written
+        """
+        if not data:
+            return 0
+        return self.buffer(get_product_id(self.store, data.get("name")), data, query)
+
+    def buffer(self, product_id: str, data: Dict, query: Optional[ImportQuery]) -> int:
+        self._buffer[product_id] = (dict(data), query)
+        if self._buffered_at is None:
+            self._buffered_at = time.monotonic()
+
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._buffered_at >= self.max_delay:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        """
+        Write the buffered products
+
+        :returns: the number of products created
+        """
+        buffer, self._buffer, self._buffered_at = self._buffer, {}, None
+        if not buffer:
+            return 0
+
+        now = timezone.now()
+        # Products with the same scraped columns are written by the same statement
+        batches: Dict[Tuple[str, ...], List[Tuple[Dict, Dict, Optional[ImportQuery]]]] = {}
+        created = 0
+        for product_id, (data, query) in buffer.items():
+            row = self.row(product_id, data, query, now)
+            if any(row.get(column) is None for column in REQUIRED_COLUMNS):
+                created += create_or_update_product(self.store, data, query)
+                continue
+            batches.setdefault(tuple(sorted(row)), []).append((row, data, query))
+
+        unchanged = 0
+        for columns, rows in batches.items():
+            try:
+                with transaction.atomic():
+                    written = self.upsert(columns, [row for row, _, _ in rows])
+                    created += sum(1 for is_insert in written.values() if is_insert)
+                    seen = [row for row, _, _ in rows if row["id"] not in written]
+                    self.touch(columns, seen)
+                    unchanged += len(seen)
+            except IntegrityError as e:
+                logger.warning(
+                    f"A batch of {len(rows)} products of {self.store.name} failed, saving them one by one: {e}"
+                )
+                for _, data, query in rows:
+                    created += create_or_update_product(self.store, data, query)
+
+        self.created += created
+        self.unchanged += unchanged
+        self.written += len(buffer)
+        logger.info(
+            f"Saved {len(buffer)} products of {self.store.name}: {created} new, "
+            f"{len(buffer) - created - unchanged} changed, {unchanged} unchanged"
+        )
+        return created
+
+    @property
+    def changed(self) -> int:
+        """The existing products that were updated"""
+        return self.written - self.created - self.unchanged
+
+    def report(self) -> str:
+        return f"{self.written} products, {self.created} new, {self.changed} changed, {self.unchanged} unchanged"
+
+    def row(self, product_id: str, data: Dict, query: Optional[ImportQuery], now) -> Dict:
+        """The columns to write for a product, the keys of data that are not Product fields are ignored"""
+        row = {
+            "id": product_id,
+            "store_id": self.store.id,
+            "import_date": now,
+            "created_at": now,
+            "last_seen": now,
+            "fingerprint": product_fingerprint(data, query),
+        }
+        for field in Product._meta.concrete_fields:
+            if field.name in data and field.name not in ("id", "store", "import_query", "brand", "fingerprint"):
+                row[field.column] = data[field.name]
+        if query:
+            row["import_query_id"] = query.id
+            brand = query_brand(query, data.get("name", ""))
+            row["brand_id"] = brand.id if brand else None
+        return row
+
+    def upsert(self, columns: Tuple[str, ...], rows: List[Dict]) -> Dict[str, bool]:
+        """
+        Insert or update products with the same scraped columns, unless their fingerprint did not change
+
+        :returns: whether each written product was inserted, by id
+        """
+        insert_columns = list(columns) + [column for column in INSERT_DEFAULTS if column not in columns]
+        updated_columns = [column for column in columns if column != "id"]
+
+        quote = connection.ops.quote_name
+        table = quote(Product._meta.db_table)
+        volatile_columns = [quote(column) for column in VOLATILE_COLUMNS if column in columns]
+        changed = (
+            f"({', '.join(f'{table}.{column}' for column in volatile_columns)}) IS DISTINCT FROM "
+            f"({', '.join(f'EXCLUDED.{column}' for column in volatile_columns)})"
+        )
+        sql = (
+            f"INSERT INTO {table} ({', '.join(map(quote, insert_columns))}) VALUES %s "
+            f"ON CONFLICT ({quote('id')}) DO UPDATE SET "
+            + ", ".join(f"{quote(column)} = EXCLUDED.{quote(column)}" for column in updated_columns)
+            + f", {volatility_update(table, changed)}"
+            + f" WHERE {table}.{quote('fingerprint')} IS DISTINCT FROM EXCLUDED.{quote('fingerprint')}"
+            + f" RETURNING {quote('id')}, (xmax = 0)"
+        )
+        values = [
+            [row[column] if column in row else INSERT_DEFAULTS[column] for column in insert_columns]
+            for row in rows
+        ]
+        # execute_values runs on the psycopg2 cursor, its errors are wrapped as Django ones
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            written = execute_values(cursor.cursor, sql, values, page_size=len(values), fetch=True)
+        return dict(written)
+
+    def touch(self, columns: Tuple[str, ...], rows: List[Dict]):
+        """Set the last_seen date and the page validators of unchanged products"""
+        if not rows:
+            return
+
+        touched_columns = ["last_seen"] + [column for column in VALIDATOR_COLUMNS if column in columns]
+        quote = connection.ops.quote_name
+        sql = (
+            f"UPDATE {quote(Product._meta.db_table)} AS product SET "
+            + ", ".join(f"{quote(column)} = seen.{quote(column)}" for column in touched_columns)
+            + f", {volatility_update('product', 'false')}"
+            + f" FROM (VALUES %s) AS seen ({', '.join(map(quote, ['id'] + touched_columns))})"
+            + f" WHERE product.{quote('id')} = seen.{quote('id')}"
+        )
+        values = [[row["id"]] + [row[column] for column in touched_columns] for row in rows]
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            execute_values(cursor.cursor, sql, values, page_size=len(values))
+
+
+class RefreshWriter(ProductWriter):
+    """
+    Collect the price and the availability of known products and write only those columns,
+    for the fast refresh of search.helpers.re_import_store_products.
+
+    The products are identified by id as the name is not scraped. A product whose price
+    or availability changed loses its fingerprint, so the next full import writes it again.
+    """
+
+    def add(self, data: Dict, product_ids: List[str]) -> int:
+        """Buffer the refreshed fields of the products of a page"""
+        if not data:
+            return 0
+        for product_id in product_ids:
+            self.buffer(product_id, data, None)
+        return 0
+
+    def flush(self) -> int:
+        buffer, self._buffer, self._buffered_at = self._buffer, {}, None
+        if not buffer:
+            return 0
+
+        now = timezone.now()
+        rows = [
+            {
+                "id": product_id,
+                "price": data.get("price"),
+                "currency": data.get("currency"),
+                "is_available": data.get("is_available"),
+                "last_seen": now,
+            }
+            for product_id, (data, _) in buffer.items()
+        ]
+        with transaction.atomic():
+            changed = self.refresh(rows)
+            seen = [row for row in rows if row["id"] not in changed]
+            self.touch((), seen)
+
+        self.unchanged += len(seen)
+        self.written += len(rows)
+        logger.info(
+            f"Refreshed {len(rows)} products of {self.store.name}: {len(changed)} changed, {len(seen)} unchanged"
+        )
+        return 0
+
+    def refresh(self, rows: List[Dict]) -> Set[str]:
+        """Write the price and the availability of the products that changed, returns their ids"""
+        refreshed = (
+            "COALESCE(seen.price, product.price), COALESCE(seen.currency, product.currency), "
+            "COALESCE(seen.is_available, product.is_available)"
+        )
+        sql = (
+            f"UPDATE {connection.ops.quote_name(Product._meta.db_table)} AS product SET "
+            f"(price, currency, is_available) = ({refreshed}), last_seen = seen.last_seen, fingerprint = NULL, "
+            f"{volatility_update('product', 'true')} "
+            "FROM (VALUES %s) AS seen (id, price, currency, is_available, last_seen) "
+            f"WHERE product.id = seen.id AND (product.price, product.currency, product.is_available) "
+            f"IS DISTINCT FROM ({refreshed}) "
+            "RETURNING product.id"
+        )
+        values = [[row["id"], row["price"], row["currency"], row["is_available"], row["last_seen"]] for row in rows]
+        # Typed, as a column of the batch may only hold NULL
+        template = "(%s, %s::double precision, %s::varchar, %s::boolean, %s::timestamptz)"
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            changed = execute_values(cursor.cursor, sql, values, template=template, page_size=len(values), fetch=True)
+        return {product_id for (product_id,) in changed}